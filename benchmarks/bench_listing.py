@@ -0,0 +1,64 @@
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
+
+import listing
+from tests.stub_s3 import StubS3, populate
+
+# Reporter listing: sequential walk vs prefix-sharded thread pool.
+#
+# Runs against tests.stub_s3.StubS3 with a fixed per-call latency, so the
+# numbers show how much listing wall time the fan-out hides, not real S3
+# throughput.
+#
+#     python -m benchmarks.bench_listing --buckets 2 --objects 20000 --latency 0.02
+
+
+def sequential(s3, buckets, time_prev):
+    # The original reporter loop: one paginator per bucket, one after another
+    for bucket_name in buckets:
+        for page in s3.get_paginator("list_objects_v2").paginate(Bucket = bucket_name):
+            for obj in page.get("Contents", []):
+                if obj["LastModified"] >= time_prev:
+                    yield listing.object_row(bucket_name, obj)
+
+
+def timed(rows):
+    start = time.perf_counter()
+    count = sum(1 for _ in rows)
+    return count, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--buckets", type = int, default = 2)
+    parser.add_argument("--objects", type = int, default = 20000, help = "objects per bucket")
+    parser.add_argument("--prefixes", type = int, default = 16, help = "top-level prefixes per bucket")
+    parser.add_argument("--latency", type = float, default = 0.02, help = "seconds per S3 call")
+    parser.add_argument("--workers", type = int, default = 8)
+    args = parser.parse_args()
+
+    buckets = [f"bucket-{n}" for n in range(args.buckets)]
+    s3 = StubS3(latency = args.latency)
+    populate(s3, buckets, args.objects, args.prefixes)
+    time_prev = datetime(2000, 1, 1, tzinfo = timezone.utc)
+
+    count, seq_time = timed(sequential(s3, buckets, time_prev))
+    seq_calls = s3.calls.pop("list_objects_v2")
+    par_count, par_time = timed(listing.list_objects(s3, buckets, time_prev, None, args.workers))
+    par_calls = s3.calls.pop("list_objects_v2")
+    assert par_count == count
+
+    print(f"objects: {count}  buckets: {args.buckets}  prefixes/bucket: {args.prefixes}  "
+          f"latency: {args.latency * 1000:.0f} ms")
+    print(f"sequential: {seq_time:.2f} s  ({seq_calls} calls)")
+    print(f"sharded x{args.workers}: {par_time:.2f} s  ({par_calls} calls)")
+    print(f"speedup: {seq_time / par_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
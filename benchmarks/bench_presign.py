@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Presign Lambda: cold-start and warm latency, boto3 signer vs stdlib signer.
+#
+# Each cold sample is a fresh interpreter that imports presign_url and serves
+# one /gen-url request, with SSM answered by a botocore Stubber (no network).
+# Warm latency is the mean of repeated requests in one process.
+#
+#     python -m benchmarks.bench_presign --cold 10 --warm 2000
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda")
+
+CHILD = r"""
+import json, os, sys, time
+start = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import presign_url
+from botocore.stub import Stubber
+
+ssm = presign_url.get_client("ssm")
+stub = Stubber(ssm)
+stub.add_response("get_parameter", {"Parameter": {"Name": "/tripoli/buckets", "Version": 1,
+    "Value": json.dumps({"key-1": {"bucket": "tripolistack-valdezlogbucket-abc123",
+                                   "datacenter": "valdez", "keyLayout": "hourly"}})}})
+stub.activate()
+event = {"resource": "/gen-url", "requestContext": {"identity": {"apiKeyId": "key-1"}},
+         "body": json.dumps({"key": "app.log"})}
+resp = presign_url.main(event, None)
+cold = time.perf_counter() - start
+assert resp["statusCode"] == 200, resp
+
+warm = int(sys.argv[2])
+start = time.perf_counter()
+for _ in range(warm):
+    presign_url.main(event, None)
+warm_time = (time.perf_counter() - start) / max(warm, 1)
+print(json.dumps({"cold": cold, "warm": warm_time}))
+"""
+
+
+def run(signer, warm):
+    env = dict(os.environ,
+               PRESIGN_SIGNER = signer,
+               SSM_logBucketMap_PARAM = "/tripoli/buckets",
+               AWS_ACCESS_KEY_ID = "AKIDEXAMPLE",
+               AWS_SECRET_ACCESS_KEY = "secret",
+               AWS_SESSION_TOKEN = "token",
+               AWS_REGION = "us-east-1",
+               AWS_DEFAULT_REGION = "us-east-1")
+    out = subprocess.run([sys.executable, "-c", CHILD, LAMBDA_DIR, str(warm)],
+                         env = env, check = True, capture_output = True, text = True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cold", type = int, default = 10, help = "cold-start samples per signer")
+    parser.add_argument("--warm", type = int, default = 2000, help = "warm requests per sample")
+    args = parser.parse_args()
+
+    for signer in ["boto3", "stdlib"]:
+        samples = [run(signer, args.warm if n == 0 else 0) for n in range(args.cold)]
+        cold = [s["cold"] * 1000 for s in samples]
+        print(f"{signer:>6}: cold start median {statistics.median(cold):.0f} ms "
+              f"(min {min(cold):.0f}), warm {samples[0]['warm'] * 1e6:.0f} us/request")
+
+
+if __name__ == "__main__":
+    main()
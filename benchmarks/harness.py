@@ -0,0 +1,318 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda"))
+
+from tests.stub_s3 import StubS3
+from tests.stub_aws import StubSSM, StubSNS, StubLambda, StubTable
+
+# Load-test and benchmark harness for the presign and reporter Lambdas.
+#
+# Runs presign_url.main and reporter.lambda_handler in-process against the
+# in-memory AWS stand-ins in tests/ (no network, no credentials), at
+# configurable scales, and records per scenario and scale:
+#
+#   p50/p99 latency, throughput, peak RSS, RSS growth during the run and the
+#   number of AWS API calls by operation.
+#
+# Every (scenario, scale) runs in a forked child so RSS figures don't leak
+# between runs. Results can be saved as a JSON baseline and compared against
+# a previous one; --compare exits non-zero on regressions.
+#
+#     python -m benchmarks.harness --objects 1000,100000 --datacenters 2
+#     python -m benchmarks.harness --save benchmarks/baseline.json
+#     python -m benchmarks.harness --compare benchmarks/baseline.json
+#
+# Scenarios:
+#   presign           single /gen-url requests spread across datacenters
+#   presign-batch     /gen-urls requests of --batch-size keys
+#   reporter-index    daily report read from the upload index
+#   reporter-hourly   daily report listing only the hourly prefixes in the window
+#   reporter-scan     daily report listing whole (flat layout) buckets
+#
+# Reporter scenarios spread --objects uploads evenly over --days of history.
+# The stubs keep every object in memory, so the largest scales (10M) need
+# several GB of RAM for the stand-ins themselves.
+
+SCENARIOS = ["presign", "presign-batch", "reporter-index", "reporter-hourly", "reporter-scan"]
+PARAM_NAME = "/tripoli/buckets"
+OUT_BUCKET = "tripoli-reports"
+TABLE_NAME = "tripoli-upload-index"
+# Relative slack before a metric counts as a regression in --compare
+TOLERANCE = {"p50_ms": 0.25, "p99_ms": 0.50, "throughput": 0.20, "peak_rss_mb": 0.20}
+
+
+def rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def datacenters(count):
+    return [f"dc{n:03d}" for n in range(count)]
+
+
+def bucket_name(dc):
+    return f"tripolistack-{dc}logbucket-abc123"
+
+
+def merge_calls(*stubs):
+    calls = {}
+    for stub in stubs:
+        for name, count in stub.calls.items():
+            calls[name] = calls.get(name, 0) + count
+    return calls
+
+
+def run_presign(args, dcs, batch):
+    import presign_url
+
+    os.environ.update({
+        "SSM_logBucketMap_PARAM": PARAM_NAME,
+        "URL_EXPIRATION": "3600",
+        "PRESIGN_SIGNER": os.environ.get("PRESIGN_SIGNER", "stdlib"),
+        "AWS_ACCESS_KEY_ID": "AKIDEXAMPLE",
+        "AWS_SECRET_ACCESS_KEY": "secret",
+        "AWS_SESSION_TOKEN": "token",
+        "AWS_REGION": "us-east-1",
+        "AWS_DEFAULT_REGION": "us-east-1"
+    })
+    ssm = StubSSM({PARAM_NAME: {
+        f"key-{dc}": {"bucket": bucket_name(dc), "datacenter": dc, "keyLayout": "hourly"} for dc in dcs
+    }})
+    presign_url.clients["ssm"] = ssm
+
+    events = []
+    for n in range(args.requests):
+        dc = dcs[n % len(dcs)]
+        if batch:
+            resource_path = "/gen-urls"
+            body = {"keys": [f"host-{n}/file-{k}.log" for k in range(args.batch_size)]}
+        else:
+            resource_path = "/gen-url"
+            body = {"key": f"host-{n}/file.log"}
+        events.append({"resource": resource_path, "requestContext": {"identity": {"apiKeyId": f"key-{dc}"}},
+                       "body": json.dumps(body)})
+
+    rss_before = rss_mb()
+    latencies = []
+    start = time.perf_counter()
+    for event in events:
+        t = time.perf_counter()
+        resp = presign_url.main(event, None)
+        latencies.append(time.perf_counter() - t)
+        assert resp["statusCode"] == 200, resp
+    elapsed = time.perf_counter() - start
+
+    calls = merge_calls(ssm)
+    if "s3" in presign_url.clients:
+        calls["s3 (boto3 client)"] = 1
+    urls = args.requests * (args.batch_size if batch else 1)
+    return latencies, urls / elapsed, rss_before, calls
+
+
+def uploads(objects, dcs, days, now):
+    # (dc, uploaded, key) spread evenly over the last `days` days, newest first
+    span = timedelta(days = days).total_seconds()
+    for n in range(objects):
+        dc = dcs[n % len(dcs)]
+        uploaded = now - timedelta(seconds = span * n / objects)
+        yield dc, uploaded, f"host-{n % 64:02d}/file-{n:09d}.log"
+
+
+def run_reporter(args, dcs, objects, mode):
+    import indexer
+    import key_layout
+    import reporter
+
+    now = datetime.now(timezone.utc)
+    s3 = StubS3(latency = args.s3_latency_ms / 1000)
+    table = StubTable()
+    sns = StubSNS()
+    lambda_client = StubLambda()
+    layout = key_layout.HOURLY if mode == "hourly" else key_layout.FLAT
+    ssm = StubSSM({PARAM_NAME: {
+        f"key-{dc}": {"bucket": bucket_name(dc), "datacenter": dc, "keyLayout": layout} for dc in dcs
+    }})
+
+    for dc, uploaded, key in uploads(objects, dcs, args.days, now):
+        if mode == "index":
+            if uploaded < now - timedelta(days = 30):
+                continue  # past the index TTL
+            table._put({
+                "pk": indexer.index_partition(dc, uploaded),
+                "sk": indexer.index_sort_key(uploaded, bucket_name(dc), key),
+                "bucket": bucket_name(dc),
+                "key": key,
+                "size": 1024,
+                "uploaded": indexer.format_time(uploaded)
+            })
+        else:
+            if mode == "hourly":
+                key = key_layout.build_key(key_layout.HOURLY, dc, uploaded, key)
+            s3.add_object(bucket_name(dc), key, uploaded, size = 1024)
+
+    os.environ.update({
+        "SSM_logBucketMap_PARAM": PARAM_NAME,
+        "OUTPUT_BUCKET_NAME": OUT_BUCKET,
+        "REPORTER_SNS_ARN": "arn:aws:sns:us-east-1:123456789012:ReportSNS",
+        "CUTOFF_HOUR": "24",
+        "REPORT_URL_EXPIRATION_SECONDS": "86400",
+        "SETTLE_SECONDS": "0",
+        "BACKFILL_SELF_INVOKE": "false"
+    })
+    if mode == "index":
+        os.environ["INDEX_TABLE_NAME"] = TABLE_NAME
+    else:
+        os.environ.pop("INDEX_TABLE_NAME", None)
+
+    reporter.clients.update({"s3": s3, "sns": sns, "ssm": ssm, "lambda": lambda_client, ("dynamodb", TABLE_NAME): table})
+    reporter.bucket_map.cache.clear()
+    s3.calls.clear()
+    table.calls.clear()
+
+    rss_before = rss_mb()
+    latencies = []
+    for _ in range(args.repeat):
+        s3.buckets.pop(OUT_BUCKET, None)  # drop report + checkpoint, every run covers CUTOFF_HOUR
+        t = time.perf_counter()
+        resp = reporter.lambda_handler({}, None)
+        latencies.append(time.perf_counter() - t)
+        assert resp["statusCode"] == 200, resp
+
+    in_window = objects / args.days if args.days >= 1 else objects
+    calls = {name: count / args.repeat for name, count in merge_calls(s3, table, sns, lambda_client).items()}
+    return latencies, in_window / statistics.median(latencies), rss_before, calls
+
+
+def run_child(scenario, objects, args, queue):
+    dcs = datacenters(args.datacenters)
+    if scenario == "presign":
+        latencies, throughput, rss_before, calls = run_presign(args, dcs, batch = False)
+    elif scenario == "presign-batch":
+        latencies, throughput, rss_before, calls = run_presign(args, dcs, batch = True)
+    else:
+        latencies, throughput, rss_before, calls = run_reporter(args, dcs, objects, scenario.split("-")[1])
+
+    peak = rss_mb()
+    queue.put({
+        "scenario": scenario,
+        "objects": objects if scenario.startswith("reporter") else None,
+        "requests": args.requests if scenario.startswith("presign") else args.repeat,
+        "datacenters": args.datacenters,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "throughput": round(throughput, 1),
+        "throughput_unit": "urls/s" if scenario.startswith("presign") else "objects reported/s",
+        "peak_rss_mb": round(peak, 1),
+        "run_rss_growth_mb": round(peak - rss_before, 1),
+        "api_calls": {name: round(count, 1) for name, count in sorted(calls.items())}
+    })
+
+
+def run(scenario, objects, args):
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    child = ctx.Process(target = run_child, args = (scenario, objects, args, queue))
+    child.start()
+    result = queue.get()
+    child.join()
+    return result
+
+
+def result_key(result):
+    return (result["scenario"], result["objects"], result["datacenters"])
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {result_key(r): r for r in json.load(f)["results"]}
+
+    regressions = []
+    for result in results:
+        old = baseline.get(result_key(result))
+        if not old:
+            continue
+        for metric, tolerance in TOLERANCE.items():
+            new_value, old_value = result[metric], old[metric]
+            worse = new_value < old_value * (1 - tolerance) if metric == "throughput" \
+                else new_value > old_value * (1 + tolerance)
+            if worse:
+                regressions.append(f"{result['scenario']} objects={result['objects']}: "
+                                   f"{metric} {old_value} -> {new_value}")
+        for name, count in result["api_calls"].items():
+            if count > old["api_calls"].get(name, 0):
+                regressions.append(f"{result['scenario']} objects={result['objects']}: "
+                                   f"{name} calls {old['api_calls'].get(name, 0)} -> {count}")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True,
+                              text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(prog = "benchmarks.harness",
+                                     description = "Benchmark the presign and reporter Lambdas against the stubs")
+    parser.add_argument("--scenarios", default = ",".join(SCENARIOS),
+                        help = "comma-separated, any of " + ", ".join(SCENARIOS))
+    parser.add_argument("--objects", default = "1000,100000",
+                        help = "comma-separated archive sizes for the reporter scenarios (e.g. 1000,1000000,10000000)")
+    parser.add_argument("--datacenters", type = int, default = 2)
+    parser.add_argument("--days", type = float, default = 30, help = "history the objects are spread over")
+    parser.add_argument("--requests", type = int, default = 2000, help = "presign requests per run")
+    parser.add_argument("--batch-size", type = int, default = 100)
+    parser.add_argument("--repeat", type = int, default = 5, help = "reporter runs per scale")
+    parser.add_argument("--s3-latency-ms", type = float, default = 0, help = "simulated S3 round trip per call")
+    parser.add_argument("--save", help = "write results as a JSON baseline")
+    parser.add_argument("--compare", help = "compare against a saved baseline, exit 1 on regressions")
+    args = parser.parse_args()
+
+    results = []
+    for scenario in args.scenarios.split(","):
+        scales = [int(o) for o in args.objects.split(",")] if scenario.startswith("reporter") else [None]
+        for objects in scales:
+            result = run(scenario, objects, args)
+            results.append(result)
+            print(f"{scenario:<16} objects={str(objects):<9} p50={result['p50_ms']:>10.3f} ms  "
+                  f"p99={result['p99_ms']:>10.3f} ms  {result['throughput']:>12.1f} {result['throughput_unit']}  "
+                  f"rss={result['peak_rss_mb']:.0f} MB  calls={result['api_calls']}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({
+                "commit": git_commit(),
+                "created": datetime.now(timezone.utc).isoformat(timespec = "seconds"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results
+            }, f, indent = 2)
+            f.write("\n")
+
+    if args.compare:
+        regressions = compare(results, args.compare)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against", args.compare)
+
+
+if __name__ == "__main__":
+    main()
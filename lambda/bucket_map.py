@@ -0,0 +1,39 @@
+import json
+import time
+
+import key_layout
+
+# The API key -> bucket map TripoliStack keeps in SSM (presign_url.py reads it
+# per request), turned around to bucket name -> {"bucket", "datacenter",
+# "keyLayout", "region", "endpoint"}. The reporter and restorer take their
+# bucket list from it, so onboarding a datacenter doesn't touch their environment.
+
+# Warm-container cache: parameter name -> (expires, map)
+cache = {}
+
+
+def by_bucket(key_map):
+    buckets = {}
+    for value in key_map.values():
+        # Plain bucket names are still accepted, like presign_url.bucket_entry
+        entry = {"bucket" : value} if isinstance(value, str) else dict(value)
+        entry["datacenter"] = entry.get("datacenter") or entry["bucket"]
+        entry.setdefault("keyLayout", key_layout.FLAT)
+        entry.setdefault("region", None)
+        buckets[entry["bucket"]] = entry
+    return buckets
+
+
+def load(ssm, param_name, ttl = 60):
+    cached = cache.get(param_name)
+    if cached and time.monotonic() < cached[0]:
+        return cached[1]
+    resp = ssm.get_parameter(Name = param_name)
+    buckets = by_bucket(json.loads(resp["Parameter"]["Value"]))
+    cache[param_name] = (time.monotonic() + ttl, buckets)
+    return buckets
+
+
+def other_region(entry, region):
+    # Buckets placed in another region have no upload index and need their own client
+    return bool(region and entry["region"] and entry["region"] != region)
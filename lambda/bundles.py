@@ -0,0 +1,47 @@
+import gzip
+import json
+
+# Compacted bundles: many small objects stored as concatenated gzip members.
+# Every member is a complete gzip stream, so the bundle is itself valid gzip
+# and a single file can be fetched with one ranged GET of offset/length
+# taken from the bundle's index sidecar.
+#
+#   _bundles/<dc>/yyyy/mm/dd/hh/bundle-<run>-<n>.gz
+#   _bundles/<dc>/yyyy/mm/dd/hh/bundle-<run>-<n>.index.json
+
+BUNDLE_PREFIX = "_bundles/"
+COMPRESSION = "gzip"
+
+
+def bundle_key(dc, hour, run_id, number):
+    return f"{BUNDLE_PREFIX}{dc}/{hour.strftime('%Y/%m/%d/%H')}/bundle-{run_id}-{number:04d}.gz"
+
+
+def sidecar_key(key):
+    return key[:-len(".gz")] + ".index.json"
+
+
+def compress_member(body):
+    return gzip.compress(body, mtime = 0)
+
+
+def read_sidecar(s3, bucket, key):
+    resp = s3.get_object(Bucket = bucket, Key = sidecar_key(key))
+    return json.loads(resp["Body"].read())
+
+
+def find_member(sidecar, key):
+    for member in sidecar["members"]:
+        if member["key"] == key:
+            return member
+    return None
+
+
+def read_member(s3, bucket, key, offset, length):
+    # One ranged GET for the member, decompressed on its own
+    resp = s3.get_object(
+        Bucket = bucket,
+        Key = key,
+        Range = f"bytes={offset}-{offset + length - 1}"
+    )
+    return gzip.decompress(resp["Body"].read())
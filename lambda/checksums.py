@@ -0,0 +1,65 @@
+import base64
+import binascii
+
+# Content checksums a client may send with /gen-url(s). The checksum is signed
+# into the PUT as x-amz-checksum-<algorithm>, so S3 rejects a body that does
+# not match. Uploads carrying a SHA-256 are also recorded in the upload index
+# table (by indexer.py) under "sha256#<dc>#<checksum>" / "<size>", which lets
+# presign_url answer "already stored" for a re-sent file. CRC32C is only used
+# for integrity: 32 bits are too few to call two files the same. Compaction
+# (compactor.py) moves a recorded file's entry to its bundle location.
+SHA256 = "checksumSHA256"
+CRC32C = "checksumCRC32C"
+
+# Request field -> (signed header, decoded length in bytes)
+ALGORITHMS = {
+    SHA256: ("x-amz-checksum-sha256", 32),
+    CRC32C: ("x-amz-checksum-crc32c", 4)
+}
+
+INDEX_PREFIX = "sha256#"
+
+
+def index_key(dc, checksum, size):
+    return {"pk" : f"{INDEX_PREFIX}{dc}#{checksum}", "sk" : str(size)}
+
+
+def verified_sha256(resp):
+    # The whole-object SHA-256 S3 verified, from a HEAD or GET sent with
+    # ChecksumMode=ENABLED. Multipart uploads carry a checksum of the part
+    # checksums ("<value>-<parts>"), which can't match a client's whole-file one
+    checksum = resp.get("ChecksumSHA256")
+    if not checksum or "-" in checksum or resp.get("ChecksumType") == "COMPOSITE":
+        return None
+    return checksum
+
+
+def parse(request):
+    # request: the /gen-url body or a /gen-urls entry.
+    # Returns (None, None) without a checksum, ({"field", "value", "size"}, None)
+    # or (None, error message)
+    fields = [field for field in ALGORITHMS if field in request]
+    if not fields:
+        return None, None
+    if len(fields) > 1:
+        return None, "Send only one of " + ", ".join(ALGORITHMS)
+    field = fields[0]
+    value = request[field]
+    try:
+        valid = isinstance(value, str) \
+            and len(base64.b64decode(value, validate = True)) == ALGORITHMS[field][1]
+    except (binascii.Error, ValueError):
+        valid = False
+    if not valid:
+        return None, f"{field} must be the base64 encoded {ALGORITHMS[field][1]}-byte checksum"
+    size = request.get("size")
+    if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+        return None, "A checksum needs the object size in bytes"
+    return {"field" : field, "value" : value, "size" : size}, None
+
+
+def headers(checksum):
+    # Headers the uploader must send with the PUT (they are part of the signature)
+    if checksum is None:
+        return {}
+    return {ALGORITHMS[checksum["field"]][0] : checksum["value"]}
@@ -0,0 +1,322 @@
+import boto3
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+import json
+import os
+
+import bundles
+import checksums
+from indexer import format_time
+from report_stream import S3MultipartWriter
+
+# Hourly compaction: each hour's small objects per datacenter are merged into
+# gzip bundles with a byte-offset index sidecar (see bundles.py). The upload
+# index drives it, so only that hour's records are read, and it is updated
+# with each file's bundle location, as is the file's checksum record (see
+# checksums.py) so "already stored" answers point into the bundle. Originals
+# are deleted only after the bundle's ETag and length match what was written,
+# and only while their own ETag is still the one bundled: a key uploaded again
+# since is kept.
+#
+# Originals are fetched by a pool of COMPACT_GET_WORKERS threads, with at most
+# two bodies per worker held at once. Every (bucket, hour) is recorded as
+# pending in the index table before it is compacted and cleared once it is
+# done, so an hour cut short by an error or the Lambda timeout is retried by
+# the following runs (up to COMPACT_MAX_ATTEMPTS).
+
+PENDING_PK = "compactor#pending"
+
+def hour_items(table, dc, hour):
+    start = format_time(hour)
+    end = format_time(hour + timedelta(hours = 1))
+    query = {
+        "KeyConditionExpression" : Key("pk").eq(f"{dc}#{hour.strftime('%Y-%m-%d')}")
+            & Key("sk").between(start, end)
+    }
+    while True:
+        resp = table.query(**query)
+        yield from resp.get("Items", [])
+        if "LastEvaluatedKey" not in resp:
+            break
+        query["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+def candidates(items, bucket_name, max_object_bytes):
+    # Small, not yet bundled objects of this bucket, once per key
+    seen = set()
+    for item in items:
+        if item["bucket"] != bucket_name or "bundle" in item or item["key"] in seen:
+            continue
+        if item["key"].startswith(bundles.BUNDLE_PREFIX):
+            continue
+        if int(item.get("size", 0)) <= max_object_bytes:
+            seen.add(item["key"])
+            yield item
+
+
+def chunked(items, max_bundle_bytes):
+    chunk = []
+    chunk_bytes = 0
+    for item in items:
+        size = int(item.get("size", 0))
+        if chunk and chunk_bytes + size > max_bundle_bytes:
+            yield chunk
+            chunk = []
+            chunk_bytes = 0
+        chunk.append(item)
+        chunk_bytes += size
+    if chunk:
+        yield chunk
+
+
+def fetch_objects(s3, bucket_name, items, workers):
+    # (item, object with the body read) in item order, GETs run on `workers`
+    # threads; objects deleted since they were indexed come back as None
+    def fetch(item):
+        try:
+            obj = s3.get_object(Bucket = bucket_name, Key = item["key"], ChecksumMode = "ENABLED")
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return item, None
+            raise
+        return item, dict(obj, Body = obj["Body"].read())
+
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(pool.submit(fetch, item))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def write_bundle(s3, bucket_name, key, items, workers = 1):
+    members = []
+    with S3MultipartWriter(s3, bucket_name, key, "application/gzip") as writer:
+        for item, obj in fetch_objects(s3, bucket_name, items, workers):
+            if obj is None:
+                continue
+
+            body = obj["Body"]
+            member = bundles.compress_member(body)
+            members.append({
+                "key" : item["key"],
+                "offset" : writer.tell(),
+                "length" : len(member),
+                "size" : len(body),
+                "etag" : obj["ETag"],
+                "lastModified" : obj["LastModified"].isoformat(),
+                "item" : {"pk" : item["pk"], "sk" : item["sk"]},
+                "sha256" : checksums.verified_sha256(obj)
+            })
+            writer.write(member)
+
+    head = s3.head_object(Bucket = bucket_name, Key = key)
+    if head["ETag"] != writer.expected_etag() or head["ContentLength"] != writer.tell():
+        s3.delete_object(Bucket = bucket_name, Key = key)
+        raise RuntimeError(f"Bundle {key} failed verification, originals kept")
+    return members
+
+
+def delete_originals(s3, bucket_name, members):
+    # Conditional deletes: S3 refuses the ones whose ETag changed since the GET.
+    # Returns (keys kept that way, other errors)
+    kept = []
+    errors = []
+    for start in range(0, len(members), 1000):
+        resp = s3.delete_objects(
+            Bucket = bucket_name,
+            Delete = {"Objects" : [{"Key" : m["key"], "ETag" : m["etag"]} for m in members[start:start + 1000]],
+                      "Quiet" : True}
+        )
+        for error in resp.get("Errors", []):
+            if error.get("Code") == "PreconditionFailed":
+                kept.append(error["Key"])
+            else:
+                errors.append(error)
+    return kept, errors
+
+
+def move_checksum_record(table, dc, bucket_name, bundle, member):
+    # Only the record of this very file: the same content uploaded again
+    # under another key has taken the record over and still exists
+    try:
+        table.update_item(
+            Key = checksums.index_key(dc, member["sha256"], member["size"]),
+            UpdateExpression = "SET bundle = :b, bundle_offset = :o, bundle_length = :l",
+            ConditionExpression = Attr("bucket").eq(bucket_name) & Attr("key").eq(member["key"]),
+            ExpressionAttributeValues = {
+                ":b" : bundle,
+                ":o" : member["offset"],
+                ":l" : member["length"]
+            }
+        )
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+            raise
+
+
+def compact_hour(s3, table, bucket_name, dc, hour, run_id, limits, time_left = None):
+    # time_left: optional callable returning the seconds left in this invocation;
+    # no new bundle is started with less than limits["time_margin"] to go
+    items = list(candidates(hour_items(table, dc, hour), bucket_name, limits["max_object_bytes"]))
+    if len(items) < limits["min_objects"]:
+        return {"bucket" : bucket_name, "hour" : hour.isoformat(), "bundles" : 0, "objects" : 0, "complete" : True}
+
+    bundle_count = 0
+    object_count = 0
+    kept = []
+    errors = []
+    for number, chunk in enumerate(chunked(items, limits["max_bundle_bytes"])):
+        if time_left and time_left() < limits["time_margin"]:
+            return {"bucket" : bucket_name, "hour" : hour.isoformat(), "bundles" : bundle_count,
+                    "objects" : object_count, "keptChanged" : kept, "deleteErrors" : errors, "complete" : False}
+        key = bundles.bundle_key(dc, hour, run_id, number)
+        members = write_bundle(s3, bucket_name, key, chunk, limits.get("get_workers", 1))
+        if not members:
+            s3.delete_object(Bucket = bucket_name, Key = key)
+            continue
+
+        s3.put_object(
+            Bucket = bucket_name,
+            Key = bundles.sidecar_key(key),
+            Body = json.dumps({
+                "bundle" : key,
+                "compression" : bundles.COMPRESSION,
+                "members" : [{k : v for k, v in m.items() if k not in ("item", "sha256")} for m in members]
+            }),
+            ContentType = "application/json"
+        )
+
+        for member in members:
+            table.update_item(
+                Key = member["item"],
+                UpdateExpression = "SET bundle = :b, bundle_offset = :o, bundle_length = :l",
+                ExpressionAttributeValues = {
+                    ":b" : key,
+                    ":o" : member["offset"],
+                    ":l" : member["length"]
+                }
+            )
+            if member["sha256"]:
+                move_checksum_record(table, dc, bucket_name, key, member)
+
+        changed, failed = delete_originals(s3, bucket_name, members)
+        kept.extend(changed)
+        errors.extend(failed)
+        bundle_count += 1
+        object_count += len(members)
+
+    return {"bucket" : bucket_name, "hour" : hour.isoformat(), "bundles" : bundle_count,
+            "objects" : object_count, "keptChanged" : kept, "deleteErrors" : errors, "complete" : True}
+
+
+def pending_key(bucket_name, hour):
+    return {"pk" : PENDING_PK, "sk" : f"{format_time(hour)}#{bucket_name}"}
+
+
+def pending_hours(table):
+    # [(bucket, hour, attempts)] left by earlier runs, oldest hour first
+    query = {"KeyConditionExpression" : Key("pk").eq(PENDING_PK)}
+    pending = []
+    while True:
+        resp = table.query(**query)
+        for item in resp.get("Items", []):
+            pending.append((item["bucket"], datetime.fromisoformat(item["hour"]), int(item.get("attempts", 0))))
+        if "LastEvaluatedKey" not in resp:
+            return pending
+        query["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+def mark_pending(table, bucket_name, hour, attempts, expires):
+    table.put_item(Item = {
+        **pending_key(bucket_name, hour),
+        "bucket" : bucket_name,
+        "hour" : format_time(hour),
+        "attempts" : attempts,
+        "expires" : expires
+    })
+
+
+def lambda_handler(event, context):
+
+    WORKERS = int(os.environ.get("COMPACT_GET_WORKERS", "16"))
+    s3 = boto3.client("s3", config = Config(max_pool_connections = max(WORKERS, 10)))
+    table = boto3.resource("dynamodb").Table(os.environ.get("INDEX_TABLE_NAME"))
+
+    BUCKET_DC = json.loads(os.environ.get("BUCKET_DATACENTER_MAP"))
+    DELAY = timedelta(hours = float(os.environ.get("COMPACT_DELAY_HOURS", "48")))
+    limits = {
+        "max_object_bytes" : int(os.environ.get("COMPACT_MAX_OBJECT_BYTES", str(1024 * 1024))),
+        "min_objects" : int(os.environ.get("COMPACT_MIN_OBJECTS", "2")),
+        "max_bundle_bytes" : int(os.environ.get("COMPACT_MAX_BUNDLE_BYTES", str(256 * 1024 * 1024))),
+        "get_workers" : WORKERS,
+        "time_margin" : float(os.environ.get("COMPACT_TIME_MARGIN_SECONDS", "60"))
+    }
+    MAX_ATTEMPTS = int(os.environ.get("COMPACT_MAX_ATTEMPTS", "5"))
+    # Pending records outlive the upload index records they point at by a day
+    EXPIRES = int((datetime.now(timezone.utc) + timedelta(days = int(os.environ.get("INDEX_TTL_DAYS", "30")) + 1))
+                  .timestamp())
+
+    def time_left():
+        if context is None:
+            return float("inf")
+        return context.get_remaining_time_in_millis() / 1000
+
+    # Compact the hour that just left the delay window, or one given in the event.
+    # Re-runs only pick up records not bundled yet and write new bundle names.
+    time_now = datetime.now(timezone.utc)
+    run_id = time_now.strftime("%Y%m%dT%H%M%S")
+    if event and event.get("hour"):
+        hour = datetime.fromisoformat(event["hour"])
+    else:
+        hour = time_now - DELAY
+    hour = hour.astimezone(timezone.utc).replace(minute = 0, second = 0, microsecond = 0)
+
+    # Hours earlier runs left unfinished go first, then this run's hour
+    work = [(bucket_name, pending_hour, attempts) for bucket_name, pending_hour, attempts in pending_hours(table)
+            if bucket_name in BUCKET_DC and pending_hour != hour]
+    work += [(bucket_name, hour, 0) for bucket_name in BUCKET_DC]
+
+    results = []
+    for bucket_name, work_hour, attempts in work:
+        if attempts >= MAX_ATTEMPTS:
+            print(json.dumps({"giveUp" : bucket_name, "hour" : work_hour.isoformat(), "attempts" : attempts}))
+            table.delete_item(Key = pending_key(bucket_name, work_hour))
+            continue
+        if time_left() < limits["time_margin"]:
+            # Out of time: record the hour so the next run picks it up
+            mark_pending(table, bucket_name, work_hour, attempts, EXPIRES)
+            continue
+
+        # Written ahead, so a timeout in the middle of the hour leaves it pending
+        mark_pending(table, bucket_name, work_hour, attempts + 1, EXPIRES)
+        try:
+            result = compact_hour(s3, table, bucket_name, BUCKET_DC[bucket_name], work_hour, run_id, limits,
+                                  time_left)
+        except Exception as e:
+            print(json.dumps({"failed" : bucket_name, "hour" : work_hour.isoformat(), "error" : str(e)}))
+            results.append({"bucket" : bucket_name, "hour" : work_hour.isoformat(), "error" : str(e),
+                            "complete" : False})
+            continue
+        if result["complete"]:
+            table.delete_item(Key = pending_key(bucket_name, work_hour))
+        else:
+            # Stopped for time, not failed: the next run continues where this one stopped
+            mark_pending(table, bucket_name, work_hour, attempts, EXPIRES)
+        results.append(result)
+    print(json.dumps(results))
+
+    return {
+        "statusCode" : 200,
+        "body" : json.dumps(results)
+    }
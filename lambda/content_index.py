@@ -0,0 +1,320 @@
+import base64
+import gzip
+import hashlib
+import json
+import math
+import re
+import zlib
+from datetime import datetime, timezone, timedelta
+
+# Content index: per-object summaries of what is inside each uploaded log,
+# grouped into one compact file per datacenter and hour of log time.
+#
+#   <dc>/yyyy/mm/dd/hh.json.gz -> {"version", "datacenter", "hour",
+#                                  "objects" : {"<bucket>/<key>" : entry}}
+#
+# An entry holds minTime/maxTime of the timestamps found in the object, its
+# line count and a bloom filter of "<field>=<value>" terms (hostnames,
+# request IDs, ...), so a query can rule objects out before fetching them.
+#
+# Objects covering more than CONTENT_INDEX_MAX_SPAN_HOURS of log time go to
+# one file per month their log time ends in instead, which every query from
+# that month on reads:
+#
+#   <dc>/spans/yyyy/mm.json.gz
+#
+# Each indexer batch writes its entries as a part file in the same format,
+# under the key of the file it belongs to,
+#
+#   _parts/<dc>/yyyy/mm/dd/hh/<batch>.json.gz, _parts/<dc>/spans/yyyy/mm/<batch>.json.gz
+#
+# and a scheduled merge folds the parts into that file, then deletes them.
+# Readers take the file plus the parts not merged yet.
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".json.gz"
+PARTS_PREFIX = "_parts/"
+SPANS = "spans"
+CHUNK_BYTES = 1024 * 1024
+# Longer runs without a newline are cut into pieces of this size
+MAX_LINE_BYTES = 1024 * 1024
+
+# ISO 8601 / RFC 3339 timestamps, "T" or space separated, optional fraction and offset
+TIMESTAMP = re.compile(rb"(\d{4}-\d{2}-\d{2})[T ](\d{2}:\d{2}:\d{2})(\.\d{1,9})?(Z|[+-]\d{2}:?\d{2})?")
+# The first timestamp on each line of a block
+FIRST_TIMESTAMP = re.compile(rb"^[^\n]*?" + TIMESTAMP.pattern, re.M)
+
+# Terms extracted per line: field -> regex with one group for the value
+DEFAULT_FIELDS = {
+    "host" : r"\b(?:host|hostname)[\"']?[ \t]*[=:][ \t]*[\"']?([A-Za-z0-9_.\-]+)",
+    "request_id" : r"\b(?:request_id|requestId|req_id|x-request-id)[\"']?[ \t]*[=:][ \t]*[\"']?([A-Za-z0-9_.\-]+)"
+}
+
+
+def compile_fields(fields):
+    return {name : re.compile(pattern.encode("utf-8")) for name, pattern in fields.items()}
+
+
+def term(field, value):
+    return f"{field}={value}"
+
+
+def term_hash(value):
+    # 64-bit hash of a term (str or UTF-8 bytes); the bloom positions are derived from its two halves
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(value, digest_size = 8).digest(), "big")
+
+
+class BloomFilter:
+    def __init__(self, bits, hashes, data = None):
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray(data) if data is not None else bytearray((bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, count, fp_rate):
+        # Optimal size for `count` terms at the requested false positive rate
+        count = max(count, 1)
+        bits = max(64, int(math.ceil(-count * math.log(fp_rate) / (math.log(2) ** 2))))
+        bits = (bits + 7) // 8 * 8
+        hashes = max(1, int(round(bits / count * math.log(2))))
+        return cls(bits, hashes)
+
+    def positions(self, hashed):
+        h1 = hashed >> 32
+        h2 = (hashed & 0xFFFFFFFF) | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add_terms(self, field, values):
+        # Bulk insert of raw byte values for one field; the hot loop of a large object
+        prefix = term(field, "").encode("utf-8")
+        bits, hashes, data = self.bits, self.hashes, self.data
+        for value in values:
+            hashed = term_hash(prefix + value)
+            h1 = hashed >> 32
+            h2 = (hashed & 0xFFFFFFFF) | 1
+            for i in range(hashes):
+                position = (h1 + i * h2) % bits
+                data[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.data[position >> 3] & (1 << (position & 7))
+                   for position in self.positions(term_hash(value)))
+
+    def to_json(self):
+        return {"bits" : self.bits, "hashes" : self.hashes,
+                "data" : base64.b64encode(bytes(self.data)).decode("ascii")}
+
+    @classmethod
+    def from_json(cls, value):
+        return cls(value["bits"], value["hashes"], base64.b64decode(value["data"]))
+
+
+def iter_chunks(body, chunk_bytes = CHUNK_BYTES):
+    # Raw body chunks, gunzipped (including multi-member gzip) when the object starts with the gzip magic
+    first = body.read(chunk_bytes)
+    if first[:2] != b"\x1f\x8b":
+        while first:
+            yield first
+            first = body.read(chunk_bytes)
+        return
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    chunk = first
+    while chunk:
+        while chunk:
+            yield decompressor.decompress(chunk)
+            if not decompressor.eof:
+                break
+            # Next gzip member, if any
+            chunk = decompressor.unused_data
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunk = body.read(chunk_bytes)
+    yield decompressor.flush()
+
+
+def iter_blocks(body, chunk_bytes = CHUNK_BYTES):
+    # Runs of whole lines (each block ends on a newline, except maybe the last);
+    # memory stays around one chunk
+    pending = b""
+    for chunk in iter_chunks(body, chunk_bytes):
+        pending += chunk
+        cut = pending.rfind(b"\n") + 1
+        if cut:
+            yield pending[:cut]
+            pending = pending[cut:]
+        while len(pending) > MAX_LINE_BYTES:
+            yield pending[:MAX_LINE_BYTES] + b"\n"
+            pending = pending[MAX_LINE_BYTES:]
+    if pending:
+        yield pending
+
+
+def iter_lines(body, chunk_bytes = CHUNK_BYTES):
+    # Lines as bytes without the newline
+    for block in iter_blocks(body, chunk_bytes):
+        lines = block.split(b"\n")
+        if not lines[-1]:
+            lines.pop()
+        yield from lines
+
+
+def parse_timestamp(parts):
+    # parts: the TIMESTAMP groups (date, clock, fraction, offset)
+    date, clock, fraction, offset = (part.decode("ascii") if part else None for part in parts)
+    value = datetime.fromisoformat(f"{date}T{clock}{(fraction or '')[:7]}")
+    if offset and offset != "Z":
+        sign = 1 if offset[0] == "+" else -1
+        digits = offset[1:].replace(":", "")
+        value -= sign * timedelta(hours = int(digits[:2]), minutes = int(digits[2:]))
+    return value.replace(tzinfo = timezone.utc)
+
+
+def sortable(value):
+    # Byte form of a UTC time that orders like the raw UTC stamps in the log
+    return value.strftime("%Y-%m-%dT%H:%M:%S.%f").encode("ascii")
+
+
+def from_sortable(raw):
+    date, _, fraction = raw.decode("ascii").partition(".")
+    return datetime.fromisoformat(date + (f".{fraction[:6]}" if fraction else "")).replace(tzinfo = timezone.utc)
+
+
+def summarize(blocks, fields, fp_rate = 0.01, max_terms = 1000000):
+    # One pass over blocks of lines (iter_blocks): time range from the first
+    # timestamp of each line, line count and the distinct terms. The regexes
+    # run over whole blocks so the per-line work stays in C. Past max_terms
+    # distinct terms no bloom is kept and the object can't be ruled out by
+    # term (it still can by time).
+    stamps = []
+    line_count = 0
+    values = {name : set() for name in fields}
+    saturated = False
+
+    for block in blocks:
+        line_count += block.count(b"\n") + (0 if block.endswith(b"\n") else 1)
+        found = FIRST_TIMESTAMP.findall(block)
+        if found:
+            # UTC stamps compare as bytes, only ones with an offset are parsed
+            keys = [date + b"T" + clock + fraction for date, clock, fraction, offset in found
+                    if offset in (b"", b"Z")]
+            keys += [sortable(parse_timestamp(parts)) for parts in found if parts[3] not in (b"", b"Z")]
+            stamps = [min(stamps + keys), max(stamps + keys)]
+        if saturated:
+            continue
+        for name, pattern in fields.items():
+            values[name].update(pattern.findall(block))
+        if sum(len(seen) for seen in values.values()) > max_terms:
+            saturated = True
+            values = {}
+
+    bloom = None
+    term_count = None
+    if not saturated:
+        term_count = sum(len(seen) for seen in values.values())
+        bloom = BloomFilter.for_capacity(term_count, fp_rate)
+        for name, seen in values.items():
+            bloom.add_terms(name, seen)
+
+    return {
+        "minTime" : format_time(from_sortable(stamps[0])) if stamps else None,
+        "maxTime" : format_time(from_sortable(stamps[1])) if stamps else None,
+        "lines" : line_count,
+        "terms" : term_count,
+        "bloom" : bloom.to_json() if bloom else None
+    }
+
+
+def format_time(value):
+    return value.astimezone(timezone.utc).isoformat(timespec = "milliseconds")
+
+
+def floor_hour(value):
+    return value.replace(minute = 0, second = 0, microsecond = 0)
+
+
+def entry_hours(entry, uploaded):
+    # First and last hour of log time the object covers, or the upload hour
+    # when no timestamps were found
+    if not entry["minTime"]:
+        return floor_hour(uploaded), floor_hour(uploaded)
+    return floor_hour(datetime.fromisoformat(entry["minTime"])), floor_hour(datetime.fromisoformat(entry["maxTime"]))
+
+
+def entry_files(dc, entry, uploaded, max_span_hours):
+    # [(index file key, empty index)] the entry is written to: the hour file of
+    # every hour it covers or, past max_span_hours, the spans file of the month
+    # its log time ends in. Queries read every spans file from the month of
+    # their start on, so long objects are never pruned by mistake
+    first, last = entry_hours(entry, uploaded)
+    if last - first >= timedelta(hours = max_span_hours):
+        month = last.replace(day = 1, hour = 0)
+        return [(spans_key(dc, month), empty_index(dc, month, SPANS))]
+    files = []
+    while first <= last:
+        files.append((hour_key(dc, first), empty_index(dc, first)))
+        first += timedelta(hours = 1)
+    return files
+
+
+def hour_key(dc, hour):
+    return f"{dc}/{hour.strftime('%Y/%m/%d/%H')}.json.gz"
+
+
+def spans_prefix(dc):
+    return f"{dc}/{SPANS}/"
+
+
+def spans_key(dc, month):
+    return f"{spans_prefix(dc)}{month.strftime('%Y/%m')}.json.gz"
+
+
+def spans_month(key):
+    # First day of the month of a spans file or spans part key
+    year, month = key.split(f"/{SPANS}/", 1)[1].split("/")[:2]
+    return datetime(int(year), int(month[:2]), 1, tzinfo = timezone.utc)
+
+
+def part_prefix(index_key):
+    # Parts of an index file sit under its key without the extension
+    return f"{PARTS_PREFIX}{index_key[:-len(INDEX_SUFFIX)]}/"
+
+
+def part_key(index_key, batch_id):
+    return f"{part_prefix(index_key)}{batch_id}{INDEX_SUFFIX}"
+
+
+def part_target(key):
+    # Index file key a part is merged into
+    return key[len(PARTS_PREFIX):].rsplit("/", 1)[0] + INDEX_SUFFIX
+
+
+def object_id(bucket_name, key):
+    return f"{bucket_name}/{key}"
+
+
+def empty_index(dc, start, kind = "hour"):
+    # kind is "hour", or SPANS for a month of long objects
+    return {"version" : INDEX_VERSION, "datacenter" : dc, kind : format_time(start), "objects" : {}}
+
+
+def encode_index(index):
+    return gzip.compress(json.dumps(index, separators = (",", ":")).encode("utf-8"), mtime = 0)
+
+
+def decode_index(body):
+    return json.loads(gzip.decompress(body))
+
+
+def matches(entry, start, end, terms):
+    # False only when the entry rules the object out; unknown time or a
+    # missing bloom keep it as a candidate
+    if entry.get("minTime") and start and datetime.fromisoformat(entry["maxTime"]) < start:
+        return False
+    if entry.get("minTime") and end and datetime.fromisoformat(entry["minTime"]) > end:
+        return False
+    if terms and entry.get("bloom"):
+        bloom = BloomFilter.from_json(entry["bloom"])
+        return all(value in bloom for value in terms)
+    return True
@@ -0,0 +1,208 @@
+import boto3
+from botocore.exceptions import ClientError
+from datetime import datetime
+from urllib.parse import unquote_plus
+import json
+import os
+import random
+import time
+import uuid
+
+import content_index
+from bundles import BUNDLE_PREFIX
+
+# Content indexing of new uploads (see content_index.py). S3 "Object Created"
+# events reach this function through EventBridge and an SQS queue, so one
+# invocation handles a batch of objects and writes one part file per touched
+# hour (or spans) file; a batch never reads or rewrites the file itself. The
+# scheduled merge ({"merge": true}) folds the parts into the files read-modify-write
+# with conditional PUTs (If-Match / If-None-Match), retrying on a conflict, so
+# each hour file is rewritten once per merge run instead of once per batch.
+
+CONFLICT_CODES = ("PreconditionFailed", "ConditionalRequestConflict")
+
+# Client is built on first use and kept for the life of the container
+clients = {}
+
+
+def get_client(service):
+    client = clients.get(service)
+    if client is None:
+        client = clients[service] = boto3.client(service)
+    return client
+
+
+def error_code(e):
+    return e.response.get("Error", {}).get("Code")
+
+
+def get_object(s3, bucket_name, key):
+    # Keys arrive URL-encoded like S3 notifications; fall back to the key as sent
+    decoded = unquote_plus(key)
+    try:
+        return decoded, s3.get_object(Bucket = bucket_name, Key = decoded)
+    except ClientError as e:
+        if decoded == key or error_code(e) not in ("NoSuchKey", "404"):
+            raise
+    return key, s3.get_object(Bucket = bucket_name, Key = key)
+
+
+def index_object(s3, bucket_name, key, fields, fp_rate, max_terms):
+    key, obj = get_object(s3, bucket_name, key)
+    entry = content_index.summarize(content_index.iter_blocks(obj["Body"]), fields, fp_rate, max_terms)
+    entry.update({
+        "bucket" : bucket_name,
+        "key" : key,
+        "size" : obj["ContentLength"],
+        "etag" : obj["ETag"]
+    })
+    return entry
+
+
+def merge_index(s3, index_bucket, key, empty, entries, attempts = 8):
+    # empty: the index to start from when the file does not exist yet
+    for attempt in range(attempts):
+        try:
+            resp = s3.get_object(Bucket = index_bucket, Key = key)
+            index = content_index.decode_index(resp["Body"].read())
+            condition = {"IfMatch" : resp["ETag"]}
+        except ClientError as e:
+            if error_code(e) not in ("NoSuchKey", "404"):
+                raise
+            index = dict(empty, objects = {})
+            condition = {"IfNoneMatch" : "*"}
+
+        index["objects"].update(entries)
+        try:
+            s3.put_object(
+                Bucket = index_bucket,
+                Key = key,
+                Body = content_index.encode_index(index),
+                ContentType = "application/gzip",
+                **condition
+            )
+            return len(index["objects"])
+        except ClientError as e:
+            if error_code(e) not in CONFLICT_CODES:
+                raise
+        # Another merge wrote the file in between, re-read and merge again
+        time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+    raise RuntimeError(f"Gave up merging {key} after {attempts} conflicts")
+
+
+def write_part(s3, index_bucket, key, empty, entries):
+    index = dict(empty, objects = entries)
+    s3.put_object(
+        Bucket = index_bucket,
+        Key = content_index.part_key(key, uuid.uuid4().hex),
+        Body = content_index.encode_index(index),
+        ContentType = "application/gzip",
+        IfNoneMatch = "*"
+    )
+
+
+def merge_parts(s3, index_bucket, max_parts):
+    # Folds up to max_parts part files into their index files. Parts are
+    # deleted only after the file holding their entries is written, so readers
+    # that miss a part find its entries in the file
+    files = {}
+    listed = 0
+    pagin = s3.get_paginator("list_objects_v2")
+    for page in pagin.paginate(Bucket = index_bucket, Prefix = content_index.PARTS_PREFIX):
+        for obj in page.get("Contents", []):
+            files.setdefault(content_index.part_target(obj["Key"]), []).append(obj)
+        listed += len(page.get("Contents", []))
+        if listed >= max_parts:
+            break
+
+    merged = 0
+    failed = 0
+    for key, parts in files.items():
+        try:
+            # Oldest first, so a re-indexed object keeps its latest entry
+            entries = {}
+            for obj in sorted(parts, key = lambda obj: obj["LastModified"]):
+                resp = s3.get_object(Bucket = index_bucket, Key = obj["Key"])
+                part = content_index.decode_index(resp["Body"].read())
+                entries.update(part["objects"])
+            merge_index(s3, index_bucket, key, part, entries)
+            for start in range(0, len(parts), 1000):
+                s3.delete_objects(
+                    Bucket = index_bucket,
+                    Delete = {"Objects" : [{"Key" : obj["Key"]} for obj in parts[start:start + 1000]], "Quiet" : True}
+                )
+        except Exception as e:
+            # The parts stay, readers still see them and the next run retries
+            print(json.dumps({"file" : key, "error" : str(e)}))
+            failed += 1
+            continue
+        merged += len(parts)
+
+    print(json.dumps({"mergedParts" : merged, "indexFiles" : len(files) - failed, "failedFiles" : failed}))
+    return {"mergedParts" : merged, "indexFiles" : len(files) - failed, "failedFiles" : failed}
+
+
+def lambda_handler(event, context):
+
+    s3 = get_client("s3")
+
+    INDEX_BUCKET = os.environ.get("CONTENT_INDEX_BUCKET")
+    if event.get("merge"):
+        return merge_parts(s3, INDEX_BUCKET, int(os.environ.get("CONTENT_INDEX_MERGE_MAX_PARTS", "10000")))
+
+    BUCKET_DC = json.loads(os.environ.get("BUCKET_DATACENTER_MAP", "{}"))
+    FIELDS = content_index.compile_fields(
+        json.loads(os.environ.get("CONTENT_INDEX_FIELDS", "null")) or content_index.DEFAULT_FIELDS)
+    FP_RATE = float(os.environ.get("CONTENT_INDEX_BLOOM_FP_RATE", "0.01"))
+    MAX_TERMS = int(os.environ.get("CONTENT_INDEX_MAX_TERMS", "1000000"))
+    MAX_SPAN = int(os.environ.get("CONTENT_INDEX_MAX_SPAN_HOURS", "48"))
+
+    # index file key -> (empty index, {object id: entry}), plus the messages behind each file
+    files = {}
+    file_messages = {}
+    failed = set()
+    indexed = 0
+
+    for record in event.get("Records", []):
+        message_id = record["messageId"]
+        try:
+            s3_event = json.loads(record["body"])
+            detail = s3_event["detail"]
+            bucket_name = detail["bucket"]["name"]
+            key = detail["object"]["key"]
+            # Compaction bundles hold objects that are already indexed
+            if key.startswith(BUNDLE_PREFIX):
+                continue
+            dc = BUCKET_DC.get(bucket_name, bucket_name)
+            uploaded = datetime.fromisoformat(s3_event["time"].replace("Z", "+00:00"))
+
+            entry = index_object(s3, bucket_name, key, FIELDS, FP_RATE, MAX_TERMS)
+            # Tells the query tool which hour's bundles hold it once compacted
+            entry["uploaded"] = content_index.format_time(uploaded)
+        except ClientError as e:
+            if error_code(e) in ("NoSuchKey", "404"):
+                # Deleted (or compacted) before we got to it
+                continue
+            print(json.dumps({"messageId" : message_id, "error" : str(e)}))
+            failed.add(message_id)
+            continue
+        except Exception as e:
+            print(json.dumps({"messageId" : message_id, "error" : str(e)}))
+            failed.add(message_id)
+            continue
+
+        for index_key, empty in content_index.entry_files(dc, entry, uploaded, MAX_SPAN):
+            files.setdefault(index_key, (empty, {}))[1][content_index.object_id(bucket_name, entry["key"])] = entry
+            file_messages.setdefault(index_key, set()).add(message_id)
+        indexed += 1
+
+    for index_key, (empty, entries) in files.items():
+        try:
+            write_part(s3, INDEX_BUCKET, index_key, empty, entries)
+        except Exception as e:
+            print(json.dumps({"file" : index_key, "error" : str(e)}))
+            failed.update(file_messages[index_key])
+
+    print(json.dumps({"indexed" : indexed, "indexFiles" : len(files), "failed" : len(failed)}))
+    # Only the failed messages go back to the queue (ReportBatchItemFailures)
+    return {"batchItemFailures" : [{"itemIdentifier" : message_id} for message_id in sorted(failed)]}
@@ -0,0 +1,78 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+
+# CloudWatch Embedded Metric Format: one JSON log line per record, turned into
+# metrics by CloudWatch Logs without any PutMetricData calls. Only emitted when
+# METRICS_NAMESPACE is set (the stack sets it), so tests and benchmarks stay quiet.
+
+MILLISECONDS = "Milliseconds"
+COUNT = "Count"
+BYTES = "Bytes"
+
+# True until the first invocation of this container has asked
+container_state = {"cold": True}
+
+
+def cold_start():
+    # 1 for the first invocation of a container, 0 afterwards
+    cold = container_state["cold"]
+    container_state["cold"] = False
+    return 1 if cold else 0
+
+
+class Metrics:
+    def __init__(self, dimensions, dimension_sets = None):
+        # dimension_sets: lists of dimension names every metric is published under
+        self.namespace = os.environ.get("METRICS_NAMESPACE")
+        self.dimensions = dict(dimensions)
+        self.dimension_sets = dimension_sets or [list(self.dimensions)]
+        self.values = {}
+        self.units = {}
+        self.properties = {}
+
+    def put(self, name, value, unit = COUNT):
+        self.values[name] = self.values.get(name, 0) + value
+        self.units[name] = unit
+
+    def put_time(self, name, seconds):
+        self.put(name, round(seconds * 1000, 3), MILLISECONDS)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.put_time(name, time.perf_counter() - start)
+
+    def set_property(self, name, value):
+        # Searchable in Logs Insights, not a metric
+        self.properties[name] = value
+
+    def set_dimension(self, name, value):
+        self.dimensions[name] = value
+
+    def record(self):
+        dimension_sets = [names for names in self.dimension_sets
+                          if all(self.dimensions.get(name) is not None for name in names)]
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": dimension_sets,
+                    "Metrics": [{"Name": name, "Unit": self.units[name]} for name in self.values]
+                }]
+            },
+            **self.properties,
+            **{name: value for name, value in self.dimensions.items() if value is not None},
+            **self.values
+        }
+
+    def flush(self):
+        if self.namespace and self.values:
+            print(json.dumps(self.record(), default = str))
+        self.values = {}
+        self.units = {}
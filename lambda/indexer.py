@@ -0,0 +1,112 @@
+import boto3
+from botocore.exceptions import ClientError
+from datetime import datetime, timezone, timedelta
+from urllib.parse import unquote_plus
+import json
+import os
+
+from bundles import BUNDLE_PREFIX
+import checksums
+
+# Writes one compact record per uploaded object into the upload index table
+# Partition key: "<dc>#<yyyy-mm-dd>", sort key: "<uploaded iso>#<bucket>/<key>"
+# so the reporter can query only the days/datacenters inside its cutoff window
+
+def index_partition(dc, uploaded):
+    return f"{dc}#{uploaded.strftime('%Y-%m-%d')}"
+
+
+def index_sort_key(uploaded, bucket_name, key):
+    return f"{format_time(uploaded)}#{bucket_name}/{key}"
+
+
+def format_time(value):
+    return value.astimezone(timezone.utc).isoformat(timespec = "milliseconds")
+
+
+# Table resource is built on first use and kept for the life of the container
+tables = {}
+
+
+def get_table(name):
+    table = tables.get(name)
+    if table is None:
+        table = tables[name] = boto3.resource("dynamodb").Table(name)
+    return table
+
+
+# S3 client for the checksum HEADs, also built on first use
+clients = {}
+
+
+def get_client(service):
+    client = clients.get(service)
+    if client is None:
+        client = clients[service] = boto3.client(service)
+    return client
+
+
+def sha256_checksum(bucket_name, key):
+    # The SHA-256 S3 verified on upload; objects deleted since the event have none
+    try:
+        resp = get_client("s3").head_object(Bucket = bucket_name, Key = key, ChecksumMode = "ENABLED")
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+            return None
+        raise
+    return checksums.verified_sha256(resp)
+
+
+def lambda_handler(event, context):
+
+    table = get_table(os.environ.get("INDEX_TABLE_NAME"))
+
+    BUCKET_DC = json.loads(os.environ.get("BUCKET_DATACENTER_MAP"))
+    TTL_DAYS = int(os.environ.get("INDEX_TTL_DAYS", "30"))
+    # Checksum records answer "already stored" for as long as the log bucket
+    # keeps the object (5 year expiration), not just the upload index's 30 days
+    CHECKSUM_TTL_DAYS = int(os.environ.get("CHECKSUM_TTL_DAYS", str(365 * 5)))
+    CHECKSUM_INDEX = os.environ.get("CHECKSUM_INDEX", "false") == "true"
+
+    indexed = 0
+    with table.batch_writer(overwrite_by_pkeys = ["pk", "sk"]) as batch:
+        for record in event.get("Records", []):
+            if not record.get("eventName", "").startswith("ObjectCreated"):
+                continue
+
+            bucket_name = record["s3"]["bucket"]["name"]
+            obj = record["s3"]["object"]
+            key = unquote_plus(obj["key"])
+            # Compaction bundles are not uploads
+            if key.startswith(BUNDLE_PREFIX):
+                continue
+            dc = BUCKET_DC.get(bucket_name, bucket_name)
+            uploaded = datetime.fromisoformat(record["eventTime"].replace("Z", "+00:00"))
+
+            batch.put_item(Item = {
+                "pk" : index_partition(dc, uploaded),
+                "sk" : index_sort_key(uploaded, bucket_name, key),
+                "bucket" : bucket_name,
+                "key" : key,
+                "size" : obj.get("size", 0),
+                "etag" : obj.get("eTag", ""),
+                "uploaded" : format_time(uploaded),
+                "expires" : int((uploaded + timedelta(days = TTL_DAYS)).timestamp())
+            })
+            indexed += 1
+
+            # Checksum entry presign_url looks up to answer "already stored"
+            checksum = sha256_checksum(bucket_name, key) if CHECKSUM_INDEX else None
+            if checksum:
+                batch.put_item(Item = {
+                    **checksums.index_key(dc, checksum, obj.get("size", 0)),
+                    "bucket" : bucket_name,
+                    "key" : key,
+                    "uploaded" : format_time(uploaded),
+                    "expires" : int((uploaded + timedelta(days = CHECKSUM_TTL_DAYS)).timestamp())
+                })
+
+    return {
+        "statusCode" : 200,
+        "body" : f"Indexed {indexed} objects"
+    }
@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+# Server-side object key layouts, configured per datacenter in TripoliStack
+# "hourly": <dc>/yyyy/mm/dd/hh/<client-key>
+# "flat":   <client-key> (signed as sent)
+FLAT = "flat"
+HOURLY = "hourly"
+
+
+def partition_prefix(dc, when):
+    return f"{dc}/{when.strftime('%Y/%m/%d/%H')}/"
+
+
+def build_key(layout, dc, when, key):
+    if layout == HOURLY:
+        return partition_prefix(dc, when) + key
+    return key
+
+
+def window_prefixes(dc, start, end):
+    # Every hourly prefix overlapping [start, end], oldest first
+    hour = start.replace(minute = 0, second = 0, microsecond = 0)
+    prefixes = []
+    while hour <= end:
+        prefixes.append(partition_prefix(dc, hour))
+        hour += timedelta(hours = 1)
+    return prefixes
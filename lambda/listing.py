@@ -0,0 +1,170 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+# Concurrent, prefix-sharded bucket listing for the reporter.
+# A shard is one (bucket, prefix) pair; whole buckets are split further into
+# their top-level prefixes with Delimiter. Shards are listed on a thread pool
+# sharing one S3 client and merged back in shard order, so the output is the
+# same as a sequential walk. Shards stream page by page: each keeps at most
+# QUEUE_PAGES listed pages waiting for the consumer, so memory stays bounded
+# however many objects a shard (e.g. a flat bucket with no "/") holds.
+
+# Listed pages buffered per shard before it pauses
+QUEUE_PAGES = 2
+
+counters_lock = threading.Lock()
+
+
+def count_pages(counters, pages, scanned):
+    # counters: optional {"pages", "scanned"} totals shared by the workers
+    if counters is not None:
+        with counters_lock:
+            counters["pages"] += pages
+            counters["scanned"] += scanned
+
+def object_row(bucket_name, obj):
+    return {
+        "bucketname" : bucket_name,
+        "filename" : obj["Key"],
+        "uploaded" : obj["LastModified"],
+        "size" : obj.get("Size", 0),
+        "storageclass" : obj.get("StorageClass", "STANDARD")
+    }
+
+
+def shard_pages(s3, bucket_name, prefix, time_prev, split = False, exclude_prefixes = (), counters = None):
+    # (rows, sub-shard prefixes) per listing page. A split walk is delimited:
+    # objects directly under prefix are rows, each common prefix becomes its
+    # own shard unless it is excluded
+    params = {"Bucket" : bucket_name, "Prefix" : prefix}
+    if split:
+        params["Delimiter"] = "/"
+    pagin = s3.get_paginator("list_objects_v2")
+    for page in pagin.paginate(**params):
+        contents = page.get("Contents", [])
+        count_pages(counters, 1, len(contents))
+        rows = [object_row(bucket_name, obj) for obj in contents if obj["LastModified"] >= time_prev]
+        shards = [common["Prefix"] for common in page.get("CommonPrefixes", [])
+                  if common["Prefix"] not in exclude_prefixes]
+        yield rows, shards
+
+
+class ShardStream:
+    # Lists a shard on the pool. A stream with QUEUE_PAGES pages waiting parks
+    # instead of blocking a worker, and is rescheduled when the consumer takes
+    # a page, so slow consumers never tie up the pool.
+
+    def __init__(self, pool, pages, stop, depth = QUEUE_PAGES):
+        self.pool = pool
+        self.pages = pages
+        self.stop = stop
+        self.depth = depth
+        self.buffer = deque()
+        self.running = False
+        self.done = False
+        self.error = None
+        self.cond = threading.Condition()
+
+    def start(self):
+        with self.cond:
+            self._schedule()
+
+    def _schedule(self):
+        # Called with self.cond held
+        if self.running or self.done or self.stop.is_set() or len(self.buffer) >= self.depth:
+            return
+        self.running = True
+        try:
+            self.pool.submit(self._fetch)
+        except RuntimeError:
+            # Pool shut down after the consumer went away
+            self.running = False
+            self.done = True
+
+    def _fetch(self):
+        # Keeps listing until the buffer is full, then gives the worker back
+        while True:
+            error = None
+            try:
+                page = next(self.pages, None)
+            except Exception as e:
+                page, error = None, e
+            with self.cond:
+                if page is None:
+                    self.done = True
+                    self.error = error
+                else:
+                    self.buffer.append(page)
+                self.cond.notify_all()
+                if self.done or self.stop.is_set() or len(self.buffer) >= self.depth:
+                    self.running = False
+                    return
+
+    def get(self):
+        # Next (rows, shards) page, or None once the shard is exhausted
+        with self.cond:
+            while not self.buffer and not self.done:
+                self.cond.wait()
+            if self.buffer:
+                page = self.buffer.popleft()
+                self._schedule()
+                return page
+            if self.error:
+                raise self.error
+            return None
+
+
+def list_objects(s3, buckets, time_prev, prefixes = None, workers = 8, exclude_prefixes = (), counters = None):
+    # Yields rows for every bucket, in bucket order then shard order
+    prefixes = prefixes or {}
+    workers = max(workers, 1)
+    # Shards listed ahead of the one being consumed
+    window = workers * 2
+    stop = threading.Event()
+
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        # [bucket, prefix, split, stream] in output order; whole-bucket listings
+        # ("" prefix) are split at the top level, their sub-shards are inserted
+        # right after them as the split walk finds them
+        plan = deque()
+        for bucket_name in buckets:
+            bucket_prefixes = prefixes.get(bucket_name, [""])
+            if bucket_prefixes == [""]:
+                plan.append([bucket_name, "", True, None])
+            else:
+                plan.extend([bucket_name, prefix, False, None] for prefix in bucket_prefixes)
+        active = 0
+
+        def start_ahead():
+            nonlocal active
+            for n, shard in enumerate(plan):
+                if shard[3] is None and (n == 0 or active < window):
+                    bucket_name, prefix, split, _ = shard
+                    shard[3] = ShardStream(pool, shard_pages(s3, bucket_name, prefix, time_prev, split,
+                                                             exclude_prefixes, counters), stop)
+                    shard[3].start()
+                    active += 1
+                if active >= window:
+                    return
+
+        try:
+            while plan:
+                start_ahead()
+                bucket_name, _, _, stream = plan[0]
+                inserted = 0
+                while True:
+                    page = stream.get()
+                    if page is None:
+                        break
+                    rows, shards = page
+                    for prefix in shards:
+                        inserted += 1
+                        plan.insert(inserted, [bucket_name, prefix, False, None])
+                    if shards:
+                        start_ahead()
+                    yield from rows
+                plan.popleft()
+                active -= 1
+        finally:
+            stop.set()
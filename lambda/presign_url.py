@@ -1,49 +1,551 @@
 import json
 import os
-import boto3
+import time
+from datetime import datetime, timezone
 
-ssm = boto3.client("ssm")
-s3 = boto3.client("s3")
+import checksums
+import emf
+import key_layout
+import sigv4
 
-def main(event, context):
-    # Get bucketMap with env and SSM
+# boto3 is imported lazily: the hot path signs with the stdlib presigner
+# (PRESIGN_SIGNER=stdlib) and only the SSM refresh and multipart calls need
+# clients, which are then kept for the life of the container. S3 clients for
+# a datacenter's own region/endpoint are cached under (service, region, endpoint).
+clients = {}
+
+S3_ENDPOINT_OPTIONS = {
+    sigv4.GLOBAL: {},
+    sigv4.REGIONAL: {"addressing_style": "virtual", "us_east_1_regional_endpoint": "regional"},
+    sigv4.ACCELERATE: {"use_accelerate_endpoint": True}
+}
+
+
+def get_client(service, region=None, endpoint=None):
+    cacheKey = service if region is None and endpoint is None else (service, region, endpoint)
+    client = clients.get(cacheKey)
+    if client is None:
+        import boto3
+        from botocore.config import Config
+        config = None
+        if service == "s3":
+            config = Config(signature_version="s3v4", s3=S3_ENDPOINT_OPTIONS[endpoint or sigv4.GLOBAL])
+        client = clients[cacheKey] = boto3.client(service, region_name=region, config=config)
+    return client
+
+
+def s3_client(entry):
+    # Keys without a region/endpoint in the map keep using the stack region's client
+    region = entry.get("region")
+    endpoint = entry.get("endpoint", sigv4.GLOBAL)
+    if region is None and endpoint == sigv4.GLOBAL:
+        return get_client("s3")
+    return get_client("s3", region, endpoint)
+
+# Warm-container cache of the API key -> bucket map held in SSM
+# TTL controls how long a loaded map is trusted before SSM is asked again
+CACHE_TTL_SECONDS = float(os.environ.get("SSM_CACHE_TTL_SECONDS", 60))
+# Minimum gap between forced refreshes triggered by unknown API keys
+CACHE_MIN_REFRESH_SECONDS = float(os.environ.get("SSM_CACHE_MIN_REFRESH_SECONDS", 5))
+# How long to keep serving a stale map after SSM throttles us
+CACHE_THROTTLE_BACKOFF_SECONDS = float(os.environ.get("SSM_CACHE_THROTTLE_BACKOFF_SECONDS", 10))
+
+# S3 object keys are limited to 1024 bytes of UTF-8
+MAX_KEY_BYTES = 1024
+# S3 multipart uploads allow part numbers 1-10000
+MAX_PART_NUMBER = 10000
+
+# DynamoDB BatchGetItem reads at most 100 keys per call
+BATCH_GET_MAX_KEYS = 100
+# Rounds of UnprocessedKeys retries before the rest are signed as new uploads
+BATCH_GET_ATTEMPTS = 3
+# Signed checksum header -> generate_presigned_url parameter
+CHECKSUM_PARAMS = {
+    "x-amz-checksum-sha256": "ChecksumSHA256",
+    "x-amz-checksum-crc32c": "ChecksumCRC32C"
+}
+
+THROTTLE_CODES = ("ThrottlingException", "TooManyRequestsException", "RequestLimitExceeded")
+
+bucketMapCache = {
+    "map": None,
+    "version": None,
+    "expires": 0.0,
+    "lastRefresh": 0.0
+}
+
+cacheStats = {
+    "hits": 0,
+    "misses": 0,
+    "refreshes": 0,
+    "reparses": 0,
+    "staleServed": 0,
+    "lastRefreshMs": None
+}
+
+
+def get_cache_stats():
+    return dict(cacheStats)
+
+
+def refresh_bucket_map(paramName):
+    # Ask SSM for the parameter, only re-parse the JSON when its Version moved
+    from botocore.exceptions import ClientError
+
+    start = time.perf_counter()
+    try:
+        resp = get_client("ssm").get_parameter(Name=paramName)
+    except ClientError as e:
+        code = e.response.get("Error", {}).get("Code")
+        if code in THROTTLE_CODES and bucketMapCache["map"] is not None:
+            # Fall back to the stale map and back off before asking again
+            cacheStats["staleServed"] += 1
+            bucketMapCache["expires"] = time.monotonic() + CACHE_THROTTLE_BACKOFF_SECONDS
+            print(json.dumps({"cache": "stale", "reason": code, "stats": cacheStats}))
+            return bucketMapCache["map"]
+        raise
+    finally:
+        cacheStats["lastRefreshMs"] = round((time.perf_counter() - start) * 1000, 3)
+
+    param = resp["Parameter"]
+    version = param.get("Version")
+    if bucketMapCache["map"] is None or version != bucketMapCache["version"]:
+        bucketMapCache["map"] = json.loads(param["Value"])
+        bucketMapCache["version"] = version
+        cacheStats["reparses"] += 1
+
+    now = time.monotonic()
+    bucketMapCache["expires"] = now + CACHE_TTL_SECONDS
+    bucketMapCache["lastRefresh"] = now
+    cacheStats["refreshes"] += 1
+    print(json.dumps({"cache": "refresh", "version": version, "stats": cacheStats}))
+    return bucketMapCache["map"]
+
+
+def get_bucket_map(paramName):
+    if bucketMapCache["map"] is not None and time.monotonic() < bucketMapCache["expires"]:
+        cacheStats["hits"] += 1
+        return bucketMapCache["map"]
+    cacheStats["misses"] += 1
+    return refresh_bucket_map(paramName)
+
+
+def bucket_entry(value):
+    # Map values are {"bucket", "datacenter", "keyLayout", "region", "endpoint"};
+    # plain bucket names are still accepted
+    if isinstance(value, str):
+        return {"bucket": value, "datacenter": None, "keyLayout": key_layout.FLAT}
+    return value
+
+
+def lookup_bucket(paramName, keyID):
+    bucketMap = get_bucket_map(paramName)
+    entry = bucketMap.get(keyID)
+    if entry:
+        return bucket_entry(entry)
+
+    # Unknown key may be a freshly added datacenter, re-check the Version early
+    if time.monotonic() - bucketMapCache["lastRefresh"] >= CACHE_MIN_REFRESH_SECONDS:
+        cacheStats["misses"] += 1
+        bucketMap = refresh_bucket_map(paramName)
+        entry = bucketMap.get(keyID)
+        return bucket_entry(entry) if entry else None
+    return None
+
+
+def response(statusCode, payload):
+    return {
+        "statusCode": statusCode,
+        "body": json.dumps(payload)
+    }
+
+
+def resolve_bucket(event, metrics):
+    # Returns (bucketEntry, None) or (None, errorResponse)
     paramName = os.environ["SSM_logBucketMap_PARAM"]
-    resp = ssm.get_parameter(Name=paramName)
-    bucketMap = json.loads(resp["Parameter"]["Value"])
 
     # Get API key ID from request context
     keyID = event.get("requestContext", {}).get("identity", {}).get("apiKeyId")
     if not keyID:
-        return {
-            "statusCode": 403,
-            "body": json.dumps({"error": "API key missing"})
-        }
-
-    # Get bucketName from key ID
-    bucketName = bucketMap.get(keyID)
-    if not bucketName:
-        return {
-            "statusCode": 403,
-            "body": json.dumps({"error": "Invalid API key"})
-        }
+        return None, response(403, {"error": "API key missing"})
+
+    # Get bucket entry from key ID (cached bucketMap from SSM)
+    with metrics.timer("MapLoadTime"):
+        entry = lookup_bucket(paramName, keyID)
+    if not entry:
+        return None, response(403, {"error": "Invalid API key"})
+    metrics.set_dimension("Datacenter", entry.get("datacenter") or "unknown")
+    return entry, None
+
+
+def final_key(entry, key, when):
+    # Apply the datacenter's server-side key layout to the client key
+    return key_layout.build_key(entry.get("keyLayout", key_layout.FLAT), entry.get("datacenter"), when, key)
+
+
+def parse_body(event):
+    try:
+        body = json.loads(event.get("body") or "{}")
+    except ValueError:
+        return None
+    return body if isinstance(body, dict) else None
+
+
+def key_error(key):
+    if not isinstance(key, str) or not key:
+        return "Missing key in request"
+    if len(key.encode("utf-8")) > MAX_KEY_BYTES:
+        return f"Key longer than {MAX_KEY_BYTES} bytes"
+    return None
+
+
+def presign(clientMethod, entry, key, params=None, metrics=None, headers=None):
+    start = time.perf_counter()
+    try:
+        return sign(clientMethod, entry, key, params, headers)
+    finally:
+        if metrics:
+            metrics.put_time("SignTime", time.perf_counter() - start)
+            metrics.put("UrlsSigned", 1)
+
+
+def sign(clientMethod, entry, key, params, headers=None):
+    # Same URL either way; the stdlib signer skips building a boto3 S3 client.
+    # Buckets in another region are signed for that region and its endpoint.
+    # headers (a content checksum) are signed too, the uploader must send them.
+    bucketName = entry["bucket"]
+    expiresIn = int(os.environ.get("URL_EXPIRATION", 3600))
+    credentials = sigv4.env_credentials()
+    region = entry.get("region") or os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION")
+    if os.environ.get("PRESIGN_SIGNER", "stdlib") == "stdlib" and credentials and region \
+            and sigv4.virtual_hostable(bucketName):
+        host = sigv4.endpoint_host(bucketName, region, entry.get("endpoint", sigv4.GLOBAL))
+        return sigv4.presign_s3("PUT", bucketName, key, region, credentials, expiresIn, params=params,
+                                headers=headers, host=host)
+
+    boto3Params = {"Bucket": bucketName, "Key": key}
+    if params:
+        boto3Params.update({"UploadId": params["uploadId"], "PartNumber": params["partNumber"]})
+    for name, value in (headers or {}).items():
+        boto3Params[CHECKSUM_PARAMS[name]] = value
+    return s3_client(entry).generate_presigned_url(
+        ClientMethod=clientMethod,
+        Params=boto3Params,
+        ExpiresIn=expiresIn
+    )
+
+
+def presign_put(entry, key, metrics=None, checksum=None):
+    return presign("put_object", entry, key, metrics=metrics, headers=checksums.headers(checksum))
+
+
+def stored_objects(entry, wanted, metrics):
+    # Looks the SHA-256 checksums up in the upload index; returns
+    # (checksum, size) -> {"bucket", "key", "uploaded"} for files already stored,
+    # plus "bundleLocation" once compaction has moved the file into a bundle.
+    # A failed lookup only means the files are signed as new uploads.
+    tableName = os.environ.get("CHECKSUM_INDEX_TABLE")
+    wanted = [c for c in wanted if c and c["field"] == checksums.SHA256]
+    if not tableName or not wanted:
+        return {}
+
+    dc = entry.get("datacenter") or entry["bucket"]
+    keys = {}
+    for checksum in wanted:
+        key = checksums.index_key(dc, checksum["value"], checksum["size"])
+        keys[(key["pk"], key["sk"])] = {name: {"S": value} for name, value in key.items()}
+    keys = list(keys.values())
+
+    from botocore.exceptions import ClientError
+    found = {}
+    with metrics.timer("ChecksumLookupTime"):
+        try:
+            for first in range(0, len(keys), BATCH_GET_MAX_KEYS):
+                request = {tableName: {
+                    "Keys": keys[first:first + BATCH_GET_MAX_KEYS],
+                    "ProjectionExpression": "pk, sk, #b, #k, uploaded, bundle, bundle_offset, bundle_length",
+                    "ExpressionAttributeNames": {"#b": "bucket", "#k": "key"}
+                }}
+                for _ in range(BATCH_GET_ATTEMPTS):
+                    resp = get_client("dynamodb").batch_get_item(RequestItems=request)
+                    for item in resp.get("Responses", {}).get(tableName, []):
+                        checksum = item["pk"]["S"].rsplit("#", 1)[1]
+                        stored = {"bucket": item["bucket"]["S"], "key": item["key"]["S"],
+                                  "uploaded": item["uploaded"]["S"]}
+                        if "bundle" in item:
+                            stored["bundleLocation"] = "{}:{}:{}".format(
+                                item["bundle"]["S"], item["bundle_offset"]["N"], item["bundle_length"]["N"])
+                        found[(checksum, int(item["sk"]["S"]))] = stored
+                    request = resp.get("UnprocessedKeys")
+                    if not request:
+                        break
+        except ClientError as e:
+            print(json.dumps({"checksumLookup": "failed", "reason": e.response.get("Error", {}).get("Code")}))
+    metrics.put("AlreadyStored", len(found))
+    return found
+
+
+def already_stored(stored, checksum):
+    if checksum is None:
+        return None
+    return stored.get((checksum["value"], checksum["size"]))
+
+
+def gen_url(event, metrics):
+    entry, error = resolve_bucket(event, metrics)
+    if error:
+        return error
+    bucketName = entry["bucket"]
 
     # Get key from body
-    body = json.loads(event.get("body", "{}"))
+    body = parse_body(event)
+    if body is None:
+        return response(400, {"error": "Request body must be a JSON object"})
     key = body.get("key")
-    if not key:
-        return {
-            "statusCode": 400,
-            "body": json.dumps({"error": "Missing key in request"})
-        }
+    error = key_error(key)
+    if error:
+        return response(400, {"error": error})
+    checksum, error = checksums.parse(body)
+    if error:
+        return response(400, {"error": error})
+
+    # The same content may already be stored for this datacenter
+    stored = already_stored(stored_objects(entry, [checksum], metrics), checksum)
+    if stored:
+        return response(200, {"alreadyStored": True, **stored})
 
     # Generate pre-signed PUT URL
-    url = s3.generate_presigned_url(
-        ClientMethod="put_object",
-        Params={"Bucket": bucketName, "Key": key},
-        ExpiresIn=int(os.environ.get("URL_EXPIRATION", 3600))
-    )
+    key = final_key(entry, key, datetime.now(timezone.utc))
+    error = key_error(key)
+    if error:
+        return response(400, {"error": error})
+    url = presign_put(entry, key, metrics, checksum)
+    payload = {"url": url, "bucket": bucketName, "key": key}
+    if checksum:
+        payload["headers"] = checksums.headers(checksum)
+    return response(200, payload)
 
-    return {
-        "statusCode": 200,
-        "body": json.dumps({"url": url, "bucket": bucketName, "key": key})
-    }
\ No newline at end of file
+
+def gen_urls(event, metrics):
+    # Batch variant: one bucket lookup, then sign every key in the same pass
+    entry, error = resolve_bucket(event, metrics)
+    if error:
+        return error
+    bucketName = entry["bucket"]
+
+    body = parse_body(event)
+    if body is None:
+        return response(400, {"error": "Request body must be a JSON object"})
+    keys = body.get("keys")
+    if not isinstance(keys, list) or not keys:
+        return response(400, {"error": "Missing keys list in request"})
+
+    maxKeys = int(os.environ.get("BATCH_MAX_KEYS", 1000))
+    if len(keys) > maxKeys:
+        return response(400, {"error": f"Too many keys, limit is {maxKeys} per request"})
+
+    # Entries are keys, or {"key", "checksumSHA256" | "checksumCRC32C", "size"}
+    now = datetime.now(timezone.utc)
+    errors = []
+    accepted = []
+    seen = set()
+    for item in keys:
+        key = item.get("key") if isinstance(item, dict) else item
+        error = key_error(key)
+        if not error and key in seen:
+            error = "Duplicate key in request"
+        checksum = None
+        if not error and isinstance(item, dict):
+            checksum, error = checksums.parse(item)
+        if error:
+            errors.append({"key": key, "error": error})
+            continue
+        seen.add(key)
+        accepted.append((key, checksum))
+
+    # One index lookup for every checksum in the batch
+    found = stored_objects(entry, [checksum for _, checksum in accepted], metrics)
+    urls = []
+    stored = []
+    for key, checksum in accepted:
+        existing = already_stored(found, checksum)
+        if existing:
+            stored.append({"key": key, "finalKey": existing["key"],
+                           **{name: value for name, value in existing.items() if name != "key"}})
+            continue
+        signedKey = final_key(entry, key, now)
+        error = key_error(signedKey)
+        if error:
+            errors.append({"key": key, "error": error})
+            continue
+        try:
+            url = {"key": key, "finalKey": signedKey, "url": presign_put(entry, signedKey, metrics, checksum)}
+        except Exception as e:
+            # One key that fails to sign must not fail the whole batch
+            errors.append({"key": key, "error": str(e)})
+            continue
+        if checksum:
+            url["headers"] = checksums.headers(checksum)
+        urls.append(url)
+
+    return response(200, {"bucket": bucketName, "urls": urls, "stored": stored, "errors": errors})
+
+
+def multipart_request(event, metrics):
+    # Returns (bucketEntry, body, None) or (None, None, errorResponse)
+    entry, error = resolve_bucket(event, metrics)
+    if error:
+        return None, None, error
+
+    body = parse_body(event)
+    if body is None:
+        return None, None, response(400, {"error": "Request body must be a JSON object"})
+    error = key_error(body.get("key"))
+    if error:
+        return None, None, response(400, {"error": error})
+    return entry, body, None
+
+
+def upload_id_error(body):
+    uploadId = body.get("uploadId")
+    if not isinstance(uploadId, str) or not uploadId:
+        return response(400, {"error": "Missing uploadId in request"})
+    return None
+
+
+def client_error(e):
+    err = e.response.get("Error", {})
+    status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 500)
+    return response(status if 400 <= status < 500 else 502,
+        {"error": err.get("Code", "S3Error"), "message": err.get("Message", "")})
+
+
+def multipart_initiate(event, metrics):
+    entry, body, error = multipart_request(event, metrics)
+    if error:
+        return error
+    bucketName = entry["bucket"]
+
+    # Later multipart calls must send back the returned (final) key
+    key = final_key(entry, body["key"], datetime.now(timezone.utc))
+    from botocore.exceptions import ClientError
+    try:
+        resp = s3_client(entry).create_multipart_upload(Bucket=bucketName, Key=key)
+    except ClientError as e:
+        return client_error(e)
+    return response(200, {"bucket": bucketName, "key": key, "uploadId": resp["UploadId"]})
+
+
+def multipart_sign_parts(event, metrics):
+    entry, body, error = multipart_request(event, metrics)
+    if error:
+        return error
+    bucketName = entry["bucket"]
+    error = upload_id_error(body)
+    if error:
+        return error
+
+    # Either explicit part numbers (retries) or a part count (first pass)
+    maxParts = int(os.environ.get("BATCH_MAX_KEYS", 1000))
+    partNumbers = body.get("partNumbers")
+    partCount = body.get("partCount")
+    if partNumbers is None and isinstance(partCount, int) and 0 < partCount <= maxParts:
+        partNumbers = list(range(1, partCount + 1))
+    if not isinstance(partNumbers, list) or not partNumbers:
+        return response(400, {"error": f"Missing partNumbers or partCount (1-{maxParts}) in request"})
+    if len(partNumbers) > maxParts:
+        return response(400, {"error": f"Too many parts, limit is {maxParts} per request"})
+
+    urls = []
+    errors = []
+    for partNumber in partNumbers:
+        if not isinstance(partNumber, int) or isinstance(partNumber, bool) \
+                or not 1 <= partNumber <= MAX_PART_NUMBER:
+            errors.append({"partNumber": partNumber, "error": f"Part number must be 1-{MAX_PART_NUMBER}"})
+            continue
+        url = presign("upload_part", entry, body["key"],
+                      {"uploadId": body["uploadId"], "partNumber": partNumber}, metrics)
+        urls.append({"partNumber": partNumber, "url": url})
+
+    return response(200, {"bucket": bucketName, "key": body["key"], "uploadId": body["uploadId"],
+                          "urls": urls, "errors": errors})
+
+
+def multipart_complete(event, metrics):
+    entry, body, error = multipart_request(event, metrics)
+    if error:
+        return error
+    bucketName = entry["bucket"]
+    error = upload_id_error(body)
+    if error:
+        return error
+
+    parts = body.get("parts")
+    if not isinstance(parts, list) or not parts:
+        return response(400, {"error": "Missing parts list in request"})
+    try:
+        partList = sorted(
+            ({"PartNumber": int(p["partNumber"]), "ETag": str(p["etag"])} for p in parts),
+            key=lambda p: p["PartNumber"])
+    except (KeyError, TypeError, ValueError):
+        return response(400, {"error": "Each part needs a partNumber and etag"})
+
+    from botocore.exceptions import ClientError
+    try:
+        resp = s3_client(entry).complete_multipart_upload(
+            Bucket=bucketName,
+            Key=body["key"],
+            UploadId=body["uploadId"],
+            MultipartUpload={"Parts": partList}
+        )
+    except ClientError as e:
+        return client_error(e)
+    return response(200, {"bucket": bucketName, "key": body["key"], "etag": resp.get("ETag")})
+
+
+def multipart_abort(event, metrics):
+    entry, body, error = multipart_request(event, metrics)
+    if error:
+        return error
+    bucketName = entry["bucket"]
+    error = upload_id_error(body)
+    if error:
+        return error
+
+    from botocore.exceptions import ClientError
+    try:
+        s3_client(entry).abort_multipart_upload(Bucket=bucketName, Key=body["key"], UploadId=body["uploadId"])
+    except ClientError as e:
+        return client_error(e)
+    return response(200, {"bucket": bucketName, "key": body["key"], "aborted": True})
+
+
+# API Gateway resource path -> handler, all sharing the warm bucketMap cache
+ROUTES = {
+    "/gen-url": gen_url,
+    "/gen-urls": gen_urls,
+    "/multipart/initiate": multipart_initiate,
+    "/multipart/sign-parts": multipart_sign_parts,
+    "/multipart/complete": multipart_complete,
+    "/multipart/abort": multipart_abort
+}
+
+
+def main(event, context):
+    resource = event.get("resource") if event.get("resource") in ROUTES else "/gen-url"
+    # One EMF record per request: stage timings, per-datacenter counts, cold starts
+    metrics = emf.Metrics(
+        {"FunctionName": os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "local"), "Datacenter": None},
+        [["FunctionName"], ["FunctionName", "Datacenter"]])
+    metrics.set_property("route", resource)
+    metrics.put("ColdStart", emf.cold_start())
+    start = time.perf_counter()
+    try:
+        resp = ROUTES[resource](event, metrics)
+        metrics.set_property("statusCode", resp["statusCode"])
+        metrics.put("ErrorResponses", 1 if resp["statusCode"] >= 400 else 0)
+        return resp
+    finally:
+        metrics.put_time("RequestTime", time.perf_counter() - start)
+        metrics.put("Requests", 1)
+        metrics.flush()
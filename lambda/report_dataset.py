@@ -0,0 +1,198 @@
+from collections import OrderedDict
+from datetime import timedelta
+import heapq
+import json
+
+from report_stream import S3GzipStream
+
+# Columnar-ish report output: gzip JSON lines partitioned Hive-style by
+# datacenter and upload hour (datacenter=<dc>/hour=<yyyy-mm-dd-hh>/part-<n>.jsonl.gz),
+# so Athena / pandas read only the partitions they need, plus a summary of
+# per-datacenter counts, bytes, largest files and hours without uploads.
+
+HOUR = timedelta(hours = 1)
+
+
+def hour_of(when):
+    return when.replace(minute = 0, second = 0, microsecond = 0)
+
+
+def partition_prefix(prefix, dc, hour):
+    return f"{prefix}datacenter={dc}/hour={hour.strftime('%Y-%m-%d-%H')}/"
+
+
+def partition_count(datacenters, start, end):
+    # Partitions a window can produce: every hour it touches, per datacenter
+    return len(datacenters) * (int((hour_of(end) - hour_of(start)) / HOUR) + 1)
+
+
+def json_row(row):
+    return {
+        "bucket" : row["bucketname"],
+        "key" : row["filename"],
+        "uploaded" : row["uploaded"].isoformat(),
+        "size" : row["size"],
+        "storageClass" : row["storageclass"],
+        "bundleLocation" : row.get("bundle", "")
+    }
+
+
+class PartitionedJsonWriter:
+    # Keeps up to max_open partition files open. Index rows arrive in time order
+    # per datacenter, listed rows in key order, which interleaves the hours; the
+    # caller sizes max_open with partition_count() so each partition stays one
+    # file. Past max_open the least recently used file is closed and the
+    # partition continues in a new part file, keeping memory bounded.
+
+    def __init__(self, s3, bucket, prefix, part_size = 8 * 1024 * 1024, max_open = 16):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.part_size = part_size
+        self.max_open = max(max_open, 1)
+        self.open = OrderedDict()
+        self.parts = {}
+        self.files = []
+        self.upload_seconds = 0.0
+        self.bytes_out = 0
+
+    def write(self, dc, row):
+        partition = (dc, hour_of(row["uploaded"]))
+        entry = self.open.get(partition)
+        if entry is None:
+            if len(self.open) >= self.max_open:
+                self._close(*self.open.popitem(last = False))
+            part = self.parts.get(partition, 0)
+            self.parts[partition] = part + 1
+            key = f"{partition_prefix(self.prefix, *partition)}part-{part:04d}.jsonl.gz"
+            entry = self.open[partition] = {
+                "stream" : S3GzipStream(self.s3, self.bucket, key, "application/gzip", self.part_size),
+                "objects" : 0
+            }
+        else:
+            self.open.move_to_end(partition)
+        entry["stream"].write(json.dumps(json_row(row), separators = (",", ":")) + "\n")
+        entry["objects"] += 1
+
+    def _close(self, partition, entry):
+        stream = entry["stream"]
+        stream.close()
+        self.upload_seconds += stream.upload_seconds
+        self.bytes_out += stream.bytes_out
+        self.files.append({"key" : stream.key, "datacenter" : partition[0],
+                           "hour" : partition[1].isoformat(), "objects" : entry["objects"]})
+
+    def close(self):
+        while self.open:
+            self._close(*self.open.popitem(last = False))
+        self.files.sort(key = lambda f: f["key"])
+        return self.files
+
+    def abort(self):
+        while self.open:
+            self.open.popitem(last = False)[1]["stream"].abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+class ReportSummary:
+    # Per-datacenter aggregates built while the rows stream past. Gaps are the
+    # whole hours inside the window in which a datacenter uploaded nothing.
+
+    def __init__(self, datacenters, start, end, top = 5):
+        self.start = start
+        self.end = end
+        self.top = top
+        self.datacenters = {dc : {"objects" : 0, "bytes" : 0, "largest" : [], "hours" : set()}
+                            for dc in datacenters}
+
+    def add(self, dc, row):
+        stats = self.datacenters.setdefault(dc, {"objects" : 0, "bytes" : 0, "largest" : [], "hours" : set()})
+        stats["objects"] += 1
+        stats["bytes"] += row["size"]
+        stats["hours"].add(hour_of(row["uploaded"]))
+        item = (row["size"], row["bucketname"], row["filename"])
+        if len(stats["largest"]) < self.top:
+            heapq.heappush(stats["largest"], item)
+        elif item > stats["largest"][0]:
+            heapq.heapreplace(stats["largest"], item)
+
+    def whole_hours(self):
+        hour = hour_of(self.start)
+        if hour < self.start:
+            hour += HOUR
+        while hour + HOUR <= self.end:
+            yield hour
+            hour += HOUR
+
+    def gaps(self, hours):
+        # Consecutive empty hours merged into [start, end) ranges
+        ranges = []
+        for hour in self.whole_hours():
+            if hour in hours:
+                continue
+            if ranges and ranges[-1][1] == hour:
+                ranges[-1][1] = hour + HOUR
+            else:
+                ranges.append([hour, hour + HOUR])
+        return [{"start" : start.isoformat(), "end" : end.isoformat(), "hours" : int((end - start) / HOUR)}
+                for start, end in ranges]
+
+    def to_dict(self):
+        datacenters = {}
+        for dc, stats in sorted(self.datacenters.items()):
+            datacenters[dc] = {
+                "objects" : stats["objects"],
+                "bytes" : stats["bytes"],
+                "largest" : [{"bucket" : bucket_name, "key" : key, "size" : size}
+                             for size, bucket_name, key in sorted(stats["largest"], reverse = True)],
+                "gaps" : self.gaps(stats["hours"])
+            }
+        return {
+            "windowStart" : self.start.isoformat(),
+            "windowEnd" : self.end.isoformat(),
+            "objects" : sum(stats["objects"] for stats in datacenters.values()),
+            "bytes" : sum(stats["bytes"] for stats in datacenters.values()),
+            "datacenters" : datacenters
+        }
+
+
+def format_bytes(size):
+    if size < 1024:
+        return f"{size} B"
+    for unit in ("KB", "MB", "GB", "TB"):
+        size /= 1024
+        if size < 1024 or unit == "TB":
+            return f"{size:.1f} {unit}"
+
+
+def format_summary(summary, largest = 3):
+    # Plain-text version of ReportSummary.to_dict() for the SNS message
+    lines = [f"Total: {summary['objects']:,} objects, {format_bytes(summary['bytes'])}"]
+    for dc, stats in summary["datacenters"].items():
+        lines.append("")
+        lines.append(f"{dc}: {stats['objects']:,} objects, {format_bytes(stats['bytes'])}")
+        for item in stats["largest"][:largest]:
+            lines.append(f"  largest: {item['key']} ({format_bytes(item['size'])})")
+        if stats["gaps"]:
+            hours = sum(gap["hours"] for gap in stats["gaps"])
+            lines.append(f"  no uploads for {hours} hour(s): "
+                         + ", ".join(f"{gap['start']} - {gap['end']}" for gap in stats["gaps"]))
+    return "\n".join(lines)
+
+
+def truncate_utf8(text, max_bytes, note = ""):
+    # At most max_bytes once UTF-8 encoded (note included), cut on a character boundary
+    data = text.encode("utf-8")
+    if len(data) <= max_bytes:
+        return text
+    room = max(0, max_bytes - len(note.encode("utf-8")))
+    return data[:room].decode("utf-8", "ignore") + note
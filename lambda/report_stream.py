@@ -0,0 +1,138 @@
+import gzip
+import hashlib
+import io
+import time
+
+# S3 multipart parts must be at least 5 MB (except the last one)
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class S3MultipartWriter:
+    # File-like binary sink: ships what is written to S3 in multipart chunks,
+    # so memory stays around one part no matter the size. Small outputs that
+    # never fill a part are sent with a single put_object. The S3 ETag the
+    # upload should end up with is computed on the way for verification.
+
+    def __init__(self, s3, bucket, key, content_type, part_size = 8 * 1024 * 1024):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.buffer = io.BytesIO()
+        self.upload_id = None
+        self.parts = []
+        self.part_md5s = []
+        self.bytes_out = 0
+        # Time spent in S3 calls, for the caller's metrics
+        self.upload_seconds = 0.0
+
+    def write(self, data):
+        self.buffer.write(data)
+        self._maybe_upload_part()
+        return len(data)
+
+    def tell(self):
+        return self.bytes_out + self.buffer.tell()
+
+    def _maybe_upload_part(self):
+        if self.buffer.tell() >= self.part_size:
+            self._upload_part()
+
+    def _upload_part(self):
+        start = time.perf_counter()
+        if self.upload_id is None:
+            resp = self.s3.create_multipart_upload(
+                Bucket = self.bucket,
+                Key = self.key,
+                ContentType = self.content_type
+            )
+            self.upload_id = resp["UploadId"]
+
+        body = self.buffer.getvalue()
+        part_number = len(self.parts) + 1
+        resp = self.s3.upload_part(
+            Bucket = self.bucket,
+            Key = self.key,
+            UploadId = self.upload_id,
+            PartNumber = part_number,
+            Body = body
+        )
+        self.parts.append({"PartNumber" : part_number, "ETag" : resp["ETag"]})
+        self.part_md5s.append(hashlib.md5(body).digest())
+        self.bytes_out += len(body)
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.upload_seconds += time.perf_counter() - start
+
+    def expected_etag(self):
+        # Single PUT: md5 of the body, multipart: md5 of the part md5s + "-<parts>"
+        if len(self.part_md5s) == 1 and self.upload_id is None:
+            return f'"{self.part_md5s[0].hex()}"'
+        return f'"{hashlib.md5(b"".join(self.part_md5s)).hexdigest()}-{len(self.part_md5s)}"'
+
+    def close(self):
+        if self.upload_id is None:
+            start = time.perf_counter()
+            body = self.buffer.getvalue()
+            self.part_md5s.append(hashlib.md5(body).digest())
+            self.bytes_out += len(body)
+            self.s3.put_object(
+                Bucket = self.bucket,
+                Key = self.key,
+                Body = body,
+                ContentType = self.content_type
+            )
+            self.buffer.seek(0)
+            self.buffer.truncate()
+            self.upload_seconds += time.perf_counter() - start
+            return
+
+        if self.buffer.tell():
+            self._upload_part()
+        start = time.perf_counter()
+        self.s3.complete_multipart_upload(
+            Bucket = self.bucket,
+            Key = self.key,
+            UploadId = self.upload_id,
+            MultipartUpload = {"Parts" : self.parts}
+        )
+        self.upload_seconds += time.perf_counter() - start
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.s3.abort_multipart_upload(
+                Bucket = self.bucket,
+                Key = self.key,
+                UploadId = self.upload_id
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+class S3GzipStream(S3MultipartWriter):
+    # File-like text sink: gzips what is written on its way to S3
+
+    def __init__(self, s3, bucket, key, content_type, part_size = 8 * 1024 * 1024):
+        super().__init__(s3, bucket, key, content_type, part_size)
+        self.gz = gzip.GzipFile(fileobj = self.buffer, mode = "wb")
+        self.bytes_in = 0
+
+    def write(self, text):
+        data = text.encode("utf-8")
+        self.bytes_in += len(data)
+        self.gz.write(data)
+        self._maybe_upload_part()
+        return len(text)
+
+    def close(self):
+        self.gz.close()
+        super().close()
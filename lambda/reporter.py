@@ -1,79 +1,367 @@
 import boto3
+from boto3.dynamodb.conditions import Key
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from datetime import datetime, timezone, timedelta
-import io
 import csv
+import itertools
+import json
 import os
+import time
+
+import bucket_map
+import emf
+from indexer import format_time
+from bundles import BUNDLE_PREFIX
+import key_layout
+import listing
+import report_dataset
+from report_stream import S3GzipStream
+
+# Clients are built on first use and kept for the life of the container
+clients = {}
+
+# Room left for the rest of the SNS message (256 KB limit, in UTF-8 bytes)
+SUMMARY_TEXT_MAX_BYTES = 200 * 1024
+
+
+def get_client(service, workers = 8):
+    client = clients.get(service)
+    if client is None:
+        config = None
+        if service == "s3":
+            # One S3 client shared by every listing worker: pool sized to the workers
+            config = Config(
+                signature_version = "s3v4",
+                max_pool_connections = max(workers, 10),
+                retries = {"mode" : "adaptive", "max_attempts" : 10}
+            )
+        client = clients[service] = boto3.client(service, config = config)
+    return client
+
+
+def get_table(name):
+    table = clients.get(("dynamodb", name))
+    if table is None:
+        table = clients[("dynamodb", name)] = boto3.resource("dynamodb").Table(name)
+    return table
+
+
+def bundle_location(item):
+    # "<bundle key>:<offset>:<length>" once compaction has moved the file into a bundle
+    if "bundle" not in item:
+        return ""
+    return f"{item['bundle']}:{int(item['bundle_offset'])}:{int(item['bundle_length'])}"
+
+
+def list_from_index(table, datacenters, time_prev, time_now, counters = None):
+    # Query only the per-day/per-DC partitions that overlap the cutoff window,
+    # and only the sort keys inside it (both edges included, "$" sorts after
+    # the "#" that ends the time part)
+    days = (time_now.date() - time_prev.date()).days
+
+    for dc in datacenters:
+        for offset in range(days + 1):
+            day = time_prev.date() + timedelta(days = offset)
+            query = {
+                "KeyConditionExpression" : Key("pk").eq(f"{dc}#{day.isoformat()}")
+                    & Key("sk").between(format_time(time_prev), format_time(time_now) + "$")
+            }
+            while True:
+                resp = table.query(**query)
+                listing.count_pages(counters, 1, len(resp.get("Items", [])))
+                for item in resp.get("Items", []):
+                    # Nothing transitions inside the report window, new uploads are STANDARD
+                    yield {
+                        "bucketname" : item["bucket"],
+                        "filename" : item["key"],
+                        "uploaded" : datetime.fromisoformat(item["uploaded"]),
+                        "size" : int(item.get("size", 0)),
+                        "storageclass" : item.get("storage_class", "STANDARD"),
+                        "bundle" : bundle_location(item)
+                    }
+                if "LastEvaluatedKey" not in resp:
+                    break
+                query["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+def bucket_prefixes(dc, layout, time_prev, time_now, slack):
+    # Hourly layouts only need the prefixes overlapping the window; the key hour is
+    # the signing time, so reach back by the URL lifetime to catch late uploads
+    if layout == key_layout.HOURLY:
+        return key_layout.window_prefixes(dc, time_prev - slack, time_now)
+    return [""]
+
+
+def load_checkpoint(s3, bucket, key):
+    # {"watermark": iso time, "lastKeys": {bucket: last key reported at the watermark}},
+    # returned with the object's ETag so the save can be made conditional on it
+    try:
+        resp = s3.get_object(Bucket = bucket, Key = key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+            return None
+        raise
+    checkpoint = json.loads(resp["Body"].read())
+    return {
+        "watermark" : datetime.fromisoformat(checkpoint["watermark"]),
+        "lastKeys" : checkpoint.get("lastKeys", {}),
+        "etag" : resp["ETag"]
+    }
+
+
+def save_checkpoint(s3, bucket, key, checkpoint, etag = None):
+    # Only over the checkpoint this run started from (etag, or none yet): False
+    # when another run saved one in between, and this one must not continue
+    condition = {"IfMatch" : etag} if etag else {"IfNoneMatch" : "*"}
+    try:
+        s3.put_object(
+            Bucket = bucket,
+            Key = key,
+            Body = json.dumps({
+                "watermark" : checkpoint["watermark"].isoformat(),
+                "lastKeys" : checkpoint["lastKeys"]
+            }),
+            ContentType = "application/json",
+            **condition
+        )
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("PreconditionFailed", "ConditionalRequestConflict"):
+            return False
+        raise
+    return True
+
+
+def after_checkpoint(rows, watermark, last_keys, window_end, boundary_keys):
+    # Only rows in (watermark, window_end], plus rows tied with the watermark whose
+    # key sorts after the last one reported for that bucket. The next run resumes
+    # at window_end, so boundary_keys collects the last key per bucket among the
+    # rows reported exactly at window_end.
+    for row in rows:
+        uploaded = row["uploaded"]
+        bucket_name = row["bucketname"]
+        if uploaded > window_end or uploaded < watermark:
+            continue
+        if uploaded == watermark and row["filename"] <= last_keys.get(bucket_name, ""):
+            continue
+
+        if uploaded == window_end:
+            boundary_keys[bucket_name] = max(row["filename"], boundary_keys.get(bucket_name, ""))
+        yield row
+
+
+def timed_rows(rows, timings):
+    # Time spent waiting on the index/listing for the next row ("scan" seconds)
+    rows = iter(rows)
+    while True:
+        start = time.perf_counter()
+        row = next(rows, None)
+        timings["scan"] += time.perf_counter() - start
+        if row is None:
+            return
+        yield row
+
 
 def lambda_handler(event, context):
 
-    s3 = boto3.client("s3")
-    sns = boto3.client("sns")
+    metrics = emf.Metrics({"FunctionName" : os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "local")})
+    metrics.put("ColdStart", emf.cold_start())
+    handler_start = time.perf_counter()
 
-    IN_BUCKET = os.environ.get("INPUT_BUCKET_NAME").split(",")
+    WORKERS = int(os.environ.get("LIST_WORKERS", "8"))
+    s3 = get_client("s3", WORKERS)
+    sns = get_client("sns")
+
+    # Buckets, datacenters and key layouts come from the presign SSM map
+    with metrics.timer("BucketMapLoadTime"):
+        BUCKETS = bucket_map.load(get_client("ssm"), os.environ.get("SSM_logBucketMap_PARAM", "/tripoli/buckets"))
+    IN_BUCKET = sorted(BUCKETS)
     OUT_BUCKET = os.environ.get("OUTPUT_BUCKET_NAME")
     SNS_ARN  = os.environ.get("REPORTER_SNS_ARN")
+    INDEX_TABLE = os.environ.get("INDEX_TABLE_NAME")
 
     CUTOFF = os.environ.get("CUTOFF_HOUR")
     EXPIRE = os.environ.get("REPORT_URL_EXPIRATION_SECONDS")
-    
+
     CUTOFF_FLOAT = float(CUTOFF)
     EXPIRE_INT = int(EXPIRE)
-    
-    time_prev = datetime.now(timezone.utc) - timedelta(hours = CUTOFF_FLOAT)
-    filename_list = []
-
-    for bucket_name in IN_BUCKET:
-        pagin = s3.get_paginator("list_objects_v2")
-        pages = pagin.paginate(Bucket = bucket_name)
-
-        for page in pages:
-            if "Contents" in page:
-                for obj in page["Contents"]:
-                    last_mod = obj["LastModified"]
-                    if last_mod > time_prev:
-                        filename_list.append({
-                            "bucketname" : bucket_name,
-                            "filename" : obj["Key"], 
-                            "uploaded" : last_mod 
-                        })
-    
-    stream = io.StringIO()
-    writer = csv.writer(stream)
-    header = ["Bucket_Name", "File_Name", "Date_Uploaded"]
-    writer.writerow(header)
-
-    for row in filename_list:
-        writer.writerow([row["bucketname"], row["filename"], row["uploaded"]])
-
-    content = stream.getvalue()
+
+    CHECKPOINT_KEY = os.environ.get("CHECKPOINT_KEY", "state/reporter-checkpoint.json")
+    MAX_WINDOW = timedelta(hours = float(os.environ.get("BACKFILL_MAX_WINDOW_HOURS", "24")))
+    SETTLE = timedelta(seconds = int(os.environ.get("SETTLE_SECONDS", "300")))
+    SELF_INVOKE = os.environ.get("BACKFILL_SELF_INVOKE", "true").lower() == "true"
 
     time_now = datetime.now(timezone.utc)
-    bucket_key = f"report-{time_now}.csv"
-    
-    s3.put_object(
-        Bucket = OUT_BUCKET,
-        Key = bucket_key,
-        Body = content,
-        ContentType = "text/csv"
-    )
-
-    url = s3.generate_presigned_url(
-        ClientMethod = "get_object",
-        Params = {"Bucket": OUT_BUCKET, "Key": bucket_key},
-        ExpiresIn = EXPIRE_INT
-    )
+
+    # Resume from the last successful report; first run falls back to CUTOFF_HOUR.
+    # Each run covers at most BACKFILL_MAX_WINDOW_HOURS, skipped runs catch up
+    # over several invocations. SETTLE leaves room for late index writes.
+    with metrics.timer("CheckpointLoadTime"):
+        checkpoint = load_checkpoint(s3, OUT_BUCKET, CHECKPOINT_KEY)
+    if checkpoint:
+        time_prev = checkpoint["watermark"]
+        last_keys = checkpoint["lastKeys"]
+    else:
+        time_prev = time_now - timedelta(hours = CUTOFF_FLOAT)
+        last_keys = {}
+    window_end = max(time_prev, min(time_now - SETTLE, time_prev + MAX_WINDOW))
+    behind = window_end < time_now - SETTLE
+
+    BUCKET_DC = {bucket_name : entry["datacenter"] for bucket_name, entry in BUCKETS.items()}
+    KEY_LAYOUT = {entry["datacenter"] : entry["keyLayout"] for entry in BUCKETS.values()}
+    SLACK = timedelta(seconds = int(os.environ.get("KEY_LAYOUT_SLACK_SECONDS", "3600")))
+
+    # Buckets in another region have no index (notifications stay in-region), list them
+    REGION = os.environ.get("AWS_REGION")
+    UNINDEXED = [bucket_name for bucket_name, entry in BUCKETS.items() if bucket_map.other_region(entry, REGION)]
+
+    def list_buckets(bucket_names):
+        prefixes = {}
+        for bucket_name in bucket_names:
+            dc = BUCKET_DC.get(bucket_name, bucket_name)
+            prefixes[bucket_name] = bucket_prefixes(dc,
+                KEY_LAYOUT.get(dc, key_layout.FLAT), time_prev, window_end, SLACK)
+        return listing.list_objects(s3, bucket_names, time_prev, prefixes, WORKERS, (BUNDLE_PREFIX,), counters)
+
+    counters = {"pages" : 0, "scanned" : 0}
+    if INDEX_TABLE:
+        table = get_table(INDEX_TABLE)
+        datacenters = [BUCKET_DC.get(bucket_name, bucket_name) for bucket_name in IN_BUCKET
+                       if bucket_name not in UNINDEXED]
+        rows = list_from_index(table, datacenters, time_prev, window_end, counters)
+        unindexed = [bucket_name for bucket_name in IN_BUCKET if bucket_name in UNINDEXED]
+        if unindexed:
+            rows = itertools.chain(rows, list_buckets(unindexed))
+    else:
+        rows = list_buckets(IN_BUCKET)
+
+    # The window end is the next watermark; an empty window (window_end == time_prev)
+    # keeps the keys already reported at the watermark
+    progress = {"watermark" : window_end, "lastKeys" : dict(last_keys) if window_end == time_prev else {}}
+    rows = after_checkpoint(rows, time_prev, last_keys, window_end, progress["lastKeys"])
+
+    # Stream rows -> CSV (or JSON lines partitioned by datacenter and hour) -> gzip
+    # -> S3 multipart, memory stays around one part per open file. The summary
+    # (counts, bytes, largest files, hours without uploads) is built on the way.
+    PART_SIZE = int(float(os.environ.get("REPORT_PART_SIZE_MB", "8")) * 1024 * 1024)
+    FORMAT = os.environ.get("REPORT_FORMAT", "csv").lower()
+    timings = {"scan" : 0.0}
+    reported = {bucket_name : 0 for bucket_name in IN_BUCKET}
+    summary = report_dataset.ReportSummary(sorted(set(BUCKET_DC.values())), time_prev, window_end,
+                                           int(os.environ.get("REPORT_SUMMARY_TOP_FILES", "5")))
+    write_start = time.perf_counter()
+
+    if FORMAT == "jsonl":
+        dataset_prefix = f"report-{time_now.strftime('%Y%m%dT%H%M%SZ')}/"
+        summary_key = f"{dataset_prefix}summary.json"
+        # One open file per partition the window can hold, up to the memory cap
+        max_open = min(int(os.environ.get("REPORT_MAX_OPEN_PARTITIONS", "512")),
+                       report_dataset.partition_count(set(BUCKET_DC.values()), time_prev, window_end))
+        with report_dataset.PartitionedJsonWriter(s3, OUT_BUCKET, dataset_prefix, PART_SIZE, max_open) as stream:
+            for row in timed_rows(rows, timings):
+                dc = BUCKET_DC.get(row["bucketname"], row["bucketname"])
+                stream.write(dc, row)
+                summary.add(dc, row)
+                reported[row["bucketname"]] = reported.get(row["bucketname"], 0) + 1
+    else:
+        bucket_key = f"report-{time_now}.csv.gz"
+        summary_key = f"report-{time_now}.summary.json"
+        with S3GzipStream(s3, OUT_BUCKET, bucket_key, "application/gzip", PART_SIZE) as stream:
+            writer = csv.writer(stream)
+            header = ["Bucket_Name", "File_Name", "Date_Uploaded", "Size_Bytes", "Storage_Class", "Bundle_Location"]
+            writer.writerow(header)
+
+            for row in timed_rows(rows, timings):
+                writer.writerow([row["bucketname"], row["filename"], row["uploaded"],
+                                 row["size"], row["storageclass"], row.get("bundle", "")])
+                summary.add(BUCKET_DC.get(row["bucketname"], row["bucketname"]), row)
+                reported[row["bucketname"]] = reported.get(row["bucketname"], 0) + 1
+
+    # Rows are pulled while the report is written, so split the loop into waiting
+    # on the scan, S3 calls, and the CSV/JSON/gzip work left over
+    write_seconds = time.perf_counter() - write_start
+    metrics.put_time("ScanTime", timings["scan"])
+    metrics.put_time("UploadTime", stream.upload_seconds)
+    metrics.put_time("CsvWriteTime", max(0.0, write_seconds - timings["scan"] - stream.upload_seconds))
+    metrics.put("ListPages", counters["pages"])
+    metrics.put("ObjectsScanned", counters["scanned"])
+    metrics.put("ObjectsReported", sum(reported.values()))
+    metrics.put("ReportBytes", stream.bytes_out, emf.BYTES)
+
+    def presign(key):
+        return s3.generate_presigned_url(
+            ClientMethod = "get_object",
+            Params = {"Bucket": OUT_BUCKET, "Key": key},
+            ExpiresIn = EXPIRE_INT
+        )
+
+    # The summary sits next to the report; for the JSON-lines dataset it also
+    # lists every partition file with a download link
+    summary_doc = summary.to_dict()
+    if FORMAT == "jsonl":
+        summary_doc["dataset"] = {
+            "location" : f"s3://{OUT_BUCKET}/{dataset_prefix}",
+            "files" : [dict(entry, url = presign(entry["key"])) for entry in stream.files]
+        }
+    else:
+        summary_doc["report"] = {"location" : f"s3://{OUT_BUCKET}/{bucket_key}"}
+    with metrics.timer("SummaryWriteTime"):
+        s3.put_object(
+            Bucket = OUT_BUCKET,
+            Key = summary_key,
+            Body = json.dumps(summary_doc),
+            ContentType = "application/json"
+        )
 
     subject = f"File Report {time_now}"
-    body = f"{url}"
+    if FORMAT == "jsonl":
+        body = (f"{presign(summary_key)}\n\nDataset ({len(stream.files)} files, partitioned by datacenter "
+                f"and hour): {summary_doc['dataset']['location']}")
+    else:
+        body = f"{presign(bucket_key)}\n\nSummary: {presign(summary_key)}"
+    body += f"\n\nUploads from {time_prev} to {window_end}"
+    if behind:
+        body += "\nBackfill in progress, more reports will follow."
+    # SNS messages top out at 256 KB, the summary file has everything
+    summary_text = report_dataset.truncate_utf8(report_dataset.format_summary(summary_doc), SUMMARY_TEXT_MAX_BYTES,
+                                                "\n... (truncated, see the summary file)")
+    body += "\n\n" + summary_text
+
+    with metrics.timer("PublishTime"):
+        sns.publish(
+            TopicArn = SNS_ARN,
+            Message = body,
+            Subject = subject
+        )
+
+    # Only advance the checkpoint once the report is out. Reserved concurrency 1
+    # keeps runs from overlapping; should one still get in between (say a manual
+    # invoke), this run stops instead of moving the checkpoint back.
+    saved = save_checkpoint(s3, OUT_BUCKET, CHECKPOINT_KEY, progress, checkpoint["etag"] if checkpoint else None)
+    if not saved:
+        print(json.dumps({"checkpointConflict" : CHECKPOINT_KEY, "windowEnd" : window_end.isoformat()}))
+
+    if saved and behind and SELF_INVOKE and context is not None:
+        get_client("lambda").invoke(
+            FunctionName = context.invoked_function_arn,
+            InvocationType = "Event",
+            Payload = json.dumps({"backfill" : True})
+        )
 
-    sns.publish(
-        TopicArn = SNS_ARN,
-        Message = body,
-        Subject = subject
-    )
+    metrics.set_property("windowStart", time_prev.isoformat())
+    metrics.set_property("windowEnd", window_end.isoformat())
+    metrics.put("Backfilling", 1 if behind else 0)
+    metrics.put_time("TotalTime", time.perf_counter() - handler_start)
+    metrics.flush()
+    for bucket_name, count in reported.items():
+        dc = BUCKET_DC.get(bucket_name, bucket_name)
+        dc_metrics = emf.Metrics({"FunctionName" : metrics.dimensions["FunctionName"], "Datacenter" : dc})
+        dc_metrics.put("ObjectsReported", count)
+        dc_metrics.put("UploadGapHours", sum(gap["hours"] for gap in summary_doc["datacenters"][dc]["gaps"]))
+        dc_metrics.flush()
 
     return {
         "statusCode" : 200,
         "headers" : {"Content-Type" : "text/plain"},
-        "body" : "Report published!"
-    }
\ No newline at end of file
+        "body" : "Report published!" + (" Backfill continuing." if behind else "")
+    }
@@ -0,0 +1,561 @@
+import boto3
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from datetime import datetime, timezone, timedelta
+from urllib.parse import unquote_plus
+import csv
+import itertools
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+import bucket_map
+import key_layout
+import listing
+from bundles import BUNDLE_PREFIX
+from indexer import format_time
+from report_stream import S3GzipStream
+
+# Bulk restores of archived logs (Glacier / Deep Archive):
+#
+#   start_handler   invoked with {"action": "start", "datacenter", "start"/"end"
+#                   or "prefix", "tier", "days"}: lists the matching objects,
+#                   records a job and queues the archived ones on SQS
+#   submit_handler  drains the queue at RESTORE_REQUESTS_PER_SECOND per
+#                   invocation (SQS max concurrency caps the invocations)
+#   track_handler   "Object Restore Completed" events mark objects restored;
+#                   a schedule polls HEAD for the rest (other regions, missed events)
+#
+# The job finishes when every object is restored or failed: a CSV manifest of
+# presigned GET URLs goes to the report bucket and its link to the SNS topic.
+#
+# Restore table: job item   pk "job#<id>", sk "job"   (counters, "open" while running)
+#                object item pk "job#<id>", sk "obj#<bucket>/<key>"
+# GSIs: ObjectIndex on "object" (<bucket>/<key>) finds the jobs waiting on an
+# object, OpenJobs on the sparse "open" attribute lists running jobs.
+
+ARCHIVED_CLASSES = ("GLACIER", "DEEP_ARCHIVE")
+TIERS = ("Bulk", "Standard", "Expedited")
+JOB_SK = "job"
+OBJECT_PREFIX = "obj#"
+
+QUEUED = "queued"
+SUBMITTED = "submitted"
+RESTORED = "restored"
+FAILED = "failed"
+
+EPOCH = datetime(1970, 1, 1, tzinfo = timezone.utc)
+# Presigned URLs can't outlive SigV4's 7 day limit
+MAX_URL_SECONDS = 7 * 24 * 3600
+RESTORE_HEADER = re.compile(r'ongoing-request="(\w+)"(?:,\s*expiry-date="([^"]+)")?')
+
+# Clients are built on first use and kept for the life of the container
+clients = {}
+
+
+def get_client(service, region = None):
+    client = clients.get((service, region))
+    if client is None:
+        config = None
+        if service == "s3":
+            config = Config(signature_version = "s3v4", retries = {"mode" : "adaptive", "max_attempts" : 10})
+        client = clients[(service, region)] = boto3.client(service, region_name = region, config = config)
+    return client
+
+
+def get_table(name):
+    table = clients.get(("dynamodb", name))
+    if table is None:
+        table = clients[("dynamodb", name)] = boto3.resource("dynamodb").Table(name)
+    return table
+
+
+def settings():
+    return {
+        "table" : os.environ.get("RESTORE_TABLE_NAME"),
+        "queue" : os.environ.get("RESTORE_QUEUE_URL"),
+        "out_bucket" : os.environ.get("OUTPUT_BUCKET_NAME"),
+        "sns_arn" : os.environ.get("REPORTER_SNS_ARN"),
+        # bucket -> {"datacenter", "keyLayout", "region", ...} from the presign SSM map
+        "buckets" : bucket_map.load(get_client("ssm"), os.environ.get("SSM_logBucketMap_PARAM", "/tripoli/buckets")),
+        "region" : os.environ.get("AWS_REGION"),
+        "workers" : int(os.environ.get("LIST_WORKERS", "8")),
+        "max_objects" : int(os.environ.get("RESTORE_MAX_OBJECTS", "100000")),
+        "objects_per_message" : int(os.environ.get("RESTORE_OBJECTS_PER_MESSAGE", "25")),
+        "rate" : float(os.environ.get("RESTORE_REQUESTS_PER_SECOND", "10")),
+        "poll_margin" : int(os.environ.get("RESTORE_POLL_TIME_MARGIN_SECONDS", "20")),
+        "url_seconds" : int(os.environ.get("RESTORE_URL_EXPIRATION_SECONDS", "86400"))
+    }
+
+
+def bucket_client(config, bucket_name):
+    # Buckets placed in another region are restored, polled and signed there
+    entry = config["buckets"].get(bucket_name)
+    return get_client("s3", entry["region"] if entry and bucket_map.other_region(entry, config["region"]) else None)
+
+
+def error_code(e):
+    return e.response.get("Error", {}).get("Code")
+
+
+class RateLimiter:
+    # Spaces calls evenly at `rate` per second
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next - now
+            self.next = max(now, self.next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def job_key(job_id):
+    return {"pk" : f"job#{job_id}", "sk" : JOB_SK}
+
+
+def object_key(job_pk, bucket_name, key):
+    return {"pk" : job_pk, "sk" : f"{OBJECT_PREFIX}{bucket_name}/{key}"}
+
+
+def parse_time(value):
+    if not value:
+        return None
+    when = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return when.replace(tzinfo = timezone.utc) if when.tzinfo is None else when
+
+
+def parse_request(event, config):
+    dc = event.get("datacenter")
+    buckets = sorted(bucket_name for bucket_name, entry in config["buckets"].items() if entry["datacenter"] == dc)
+    if not buckets:
+        raise ValueError(f"Unknown datacenter {dc!r}")
+    start = parse_time(event.get("start"))
+    end = parse_time(event.get("end"))
+    prefix = event.get("prefix")
+    if not prefix and not (start and end):
+        raise ValueError("Either prefix or start and end are required")
+    if start and end and end < start:
+        raise ValueError("end is before start")
+    tier = event.get("tier", "Bulk")
+    if tier not in TIERS:
+        raise ValueError(f"tier must be one of {', '.join(TIERS)}")
+    days = int(event.get("days", 7))
+    if not 1 <= days <= 30:
+        raise ValueError("days must be 1-30")
+    return {"datacenter" : dc, "buckets" : buckets, "start" : start, "end" : end,
+            "prefix" : prefix, "tier" : tier, "days" : days}
+
+
+def matching_objects(s3, request, config):
+    # Rows (listing.object_row) for the request. Flat layouts list the whole
+    # bucket filtered on LastModified. Hourly layouts list the window's prefixes,
+    # plus the same filtered listing outside <dc>/ for flat keys uploaded before
+    # the datacenter switched layouts (anything old enough to be archived).
+    # Compaction bundles of the window's hours are included as well.
+    dc = request["datacenter"]
+    buckets = request["buckets"]
+    start, end = request["start"], request["end"]
+    workers = config["workers"]
+
+    if request["prefix"]:
+        rows = listing.list_objects(s3, buckets, start or EPOCH,
+                                    {bucket_name : [request["prefix"]] for bucket_name in buckets}, workers)
+        yield from (row for row in rows if not end or row["uploaded"] <= end)
+        return
+
+    hours = key_layout.window_prefixes(dc, start, end)
+    exclude = (BUNDLE_PREFIX,)
+    if config["buckets"][buckets[0]]["keyLayout"] == key_layout.HOURLY:
+        yield from listing.list_objects(s3, buckets, EPOCH, {bucket_name : hours for bucket_name in buckets}, workers)
+        exclude += (f"{dc}/",)
+    rows = listing.list_objects(s3, buckets, start, {}, workers, exclude)
+    yield from (row for row in rows if row["uploaded"] <= end)
+    yield from listing.list_objects(s3, buckets, EPOCH,
+        {bucket_name : [BUNDLE_PREFIX + prefix for prefix in hours] for bucket_name in buckets}, workers)
+
+
+def object_tier(storage_class, tier):
+    # Deep Archive has no Expedited retrieval
+    if storage_class == "DEEP_ARCHIVE" and tier == "Expedited":
+        return "Standard"
+    return tier
+
+
+def start_job(s3, table, sqs, request, config):
+    job_id = f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}-{uuid.uuid4().hex[:8]}"
+    job_pk = job_key(job_id)["pk"]
+    now = datetime.now(timezone.utc)
+    expires = int((now + timedelta(days = request["days"] + 30)).timestamp())
+
+    # Listing stops at the first object past the limit
+    objects = list(itertools.islice(matching_objects(s3, request, config), config["max_objects"] + 1))
+    if len(objects) > config["max_objects"]:
+        raise ValueError(f"More than {config['max_objects']} objects match, the limit per job; narrow the range")
+
+    queued = []
+    ready = 0
+    with table.batch_writer() as batch:
+        for row in objects:
+            archived = row["storageclass"] in ARCHIVED_CLASSES
+            item = object_key(job_pk, row["bucketname"], row["filename"])
+            item.update({
+                "object" : f"{row['bucketname']}/{row['filename']}",
+                "bucket" : row["bucketname"],
+                "key" : row["filename"],
+                "size" : row["size"],
+                "storage_class" : row["storageclass"],
+                "status" : QUEUED if archived else RESTORED,
+                "expires" : expires
+            })
+            if archived:
+                item["tier"] = object_tier(row["storageclass"], request["tier"])
+                queued.append({"bucket" : item["bucket"], "key" : item["key"], "tier" : item["tier"]})
+            else:
+                # Instant tiers (Standard, IA, Glacier Instant Retrieval) are readable as is
+                ready += 1
+            batch.put_item(Item = item)
+
+    table.put_item(Item = {
+        **job_key(job_id),
+        "open" : "1",
+        "status" : "restoring",
+        "datacenter" : request["datacenter"],
+        "tier" : request["tier"],
+        "days" : request["days"],
+        "request" : {name : (value.isoformat() if isinstance(value, datetime) else value)
+                     for name, value in request.items() if name != "buckets" and value},
+        "total" : len(objects),
+        "submitted" : 0,
+        "restored" : ready,
+        "failed" : 0,
+        "bytes" : sum(row["size"] for row in objects),
+        "createdAt" : format_time(now),
+        "expires" : expires
+    })
+
+    # Several objects per message, ten messages per SendMessageBatch call
+    size = config["objects_per_message"]
+    messages = [{"job" : job_id, "days" : request["days"], "objects" : queued[i:i + size]}
+                for i in range(0, len(queued), size)]
+    for i in range(0, len(messages), 10):
+        resp = sqs.send_message_batch(QueueUrl = config["queue"], Entries = [
+            {"Id" : str(n), "MessageBody" : json.dumps(message)} for n, message in enumerate(messages[i:i + 10])])
+        if resp.get("Failed"):
+            raise RuntimeError(f"Could not queue {len(resp['Failed'])} restore messages: {resp['Failed'][0]}")
+
+    finish_job(table, job_id, config)
+    return {"job" : job_id, "total" : len(objects), "queued" : len(queued), "ready" : ready}
+
+
+def set_status(table, job_pk, bucket_name, key, status, allowed, extra = None):
+    # Moves an object item to `status`; False if it wasn't in one of `allowed`
+    # (already moved on by a duplicate event, retry or poll)
+    names = {"#s" : "status"}
+    values = {":s" : status}
+    assignments = ["#s = :s"]
+    for n, (name, value) in enumerate((extra or {}).items()):
+        names[f"#e{n}"] = name
+        values[f":e{n}"] = value
+        assignments.append(f"#e{n} = :e{n}")
+    try:
+        table.update_item(
+            Key = object_key(job_pk, bucket_name, key),
+            UpdateExpression = "SET " + ", ".join(assignments),
+            ConditionExpression = Attr("status").is_in(allowed),
+            ExpressionAttributeNames = names,
+            ExpressionAttributeValues = values
+        )
+    except ClientError as e:
+        if error_code(e) == "ConditionalCheckFailedException":
+            return False
+        raise
+    return True
+
+
+def add_counts(table, job_pk, **counts):
+    names = {f"#c{n}" : name for n, name in enumerate(counts)}
+    values = {f":c{n}" : value for n, value in enumerate(counts.values())}
+    resp = table.update_item(
+        Key = {"pk" : job_pk, "sk" : JOB_SK},
+        UpdateExpression = "ADD " + ", ".join(f"#c{n} :c{n}" for n in range(len(counts))),
+        ExpressionAttributeNames = names,
+        ExpressionAttributeValues = values,
+        ReturnValues = "ALL_NEW"
+    )
+    return resp["Attributes"]
+
+
+def job_objects(table, job_pk, after = None):
+    # Object items in key order, those after sort key `after` if given
+    query = {"KeyConditionExpression" : Key("pk").eq(job_pk) & Key("sk").begins_with(OBJECT_PREFIX)}
+    if after:
+        query["ExclusiveStartKey"] = {"pk" : job_pk, "sk" : after}
+    while True:
+        resp = table.query(**query)
+        yield from resp.get("Items", [])
+        if "LastEvaluatedKey" not in resp:
+            break
+        query["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+def manifest_key(job_id):
+    return f"restores/{job_id}/manifest.csv.gz"
+
+
+def write_manifest(table, job, config):
+    # One row per object, with a GET URL for everything that can be read now
+    job_id = job["pk"][len("job#"):]
+    seconds = min(config["url_seconds"], int(job["days"]) * 86400, MAX_URL_SECONDS)
+    key = manifest_key(job_id)
+    out = get_client("s3")
+    with S3GzipStream(out, config["out_bucket"], key, "application/gzip") as stream:
+        writer = csv.writer(stream)
+        writer.writerow(["Bucket_Name", "File_Name", "Size_Bytes", "Storage_Class", "Status", "Restored_Until", "Url"])
+        for item in job_objects(table, job["pk"]):
+            url = ""
+            if item["status"] == RESTORED:
+                url = bucket_client(config, item["bucket"]).generate_presigned_url(
+                    ClientMethod = "get_object",
+                    Params = {"Bucket" : item["bucket"], "Key" : item["key"]},
+                    ExpiresIn = seconds
+                )
+            writer.writerow([item["bucket"], item["key"], item["size"], item["storage_class"], item["status"],
+                             item.get("restored_until", ""), url])
+    return key
+
+
+def finish_job(table, job_id, config, job = None):
+    # Once every object is restored or failed: manifest, close the job, notify.
+    # The conditional close makes sure only one finisher publishes.
+    if job is None:
+        job = table.get_item(Key = job_key(job_id)).get("Item")
+    if not job or "open" not in job or int(job["restored"]) + int(job["failed"]) < int(job["total"]):
+        return False
+
+    key = write_manifest(table, job, config)
+    try:
+        table.update_item(
+            Key = job_key(job_id),
+            UpdateExpression = "SET #s = :s, manifest = :m, finishedAt = :f REMOVE #o",
+            ConditionExpression = Attr("open").exists(),
+            ExpressionAttributeNames = {"#s" : "status", "#o" : "open"},
+            ExpressionAttributeValues = {":s" : "complete", ":m" : key, ":f" : format_time(datetime.now(timezone.utc))}
+        )
+    except ClientError as e:
+        if error_code(e) == "ConditionalCheckFailedException":
+            return False
+        raise
+
+    url = manifest_url(key, config)
+    get_client("sns").publish(
+        TopicArn = config["sns_arn"],
+        Subject = f"Restore {job_id} ready",
+        Message = f"{url}\n\n{job['restored']} of {job['total']} objects from {job['datacenter']} "
+                  f"readable for {job['days']} days, {job['failed']} failed."
+    )
+    return True
+
+
+def manifest_url(key, config):
+    return get_client("s3").generate_presigned_url(
+        ClientMethod = "get_object",
+        Params = {"Bucket" : config["out_bucket"], "Key" : key},
+        ExpiresIn = min(config["url_seconds"], MAX_URL_SECONDS)
+    )
+
+
+def mark_restored(table, job_pk, bucket_name, key, restored_until, config):
+    if set_status(table, job_pk, bucket_name, key, RESTORED, [QUEUED, SUBMITTED],
+                  {"restored_until" : restored_until or ""}):
+        job = add_counts(table, job_pk, restored = 1)
+        finish_job(table, job_pk[len("job#"):], config, job)
+
+
+def mark_failed(table, job_pk, bucket_name, key, reason, config):
+    if set_status(table, job_pk, bucket_name, key, FAILED, [QUEUED, SUBMITTED], {"error" : reason}):
+        job = add_counts(table, job_pk, failed = 1)
+        finish_job(table, job_pk[len("job#"):], config, job)
+
+
+def submit(table, job_pk, obj, days, limiter, config):
+    limiter.wait()
+    try:
+        bucket_client(config, obj["bucket"]).restore_object(
+            Bucket = obj["bucket"],
+            Key = obj["key"],
+            RestoreRequest = {"Days" : days, "GlacierJobParameters" : {"Tier" : obj["tier"]}}
+        )
+    except ClientError as e:
+        code = error_code(e)
+        if code == "ObjectAlreadyInActiveTierError":
+            mark_restored(table, job_pk, obj["bucket"], obj["key"], None, config)
+            return
+        if code in ("NoSuchKey", "InvalidObjectState"):
+            mark_failed(table, job_pk, obj["bucket"], obj["key"], code, config)
+            return
+        if code != "RestoreAlreadyInProgress":
+            raise
+    if set_status(table, job_pk, obj["bucket"], obj["key"], SUBMITTED, [QUEUED]):
+        add_counts(table, job_pk, submitted = 1)
+
+
+def start_handler(event, context):
+
+    config = settings()
+    table = get_table(config["table"])
+    action = event.get("action", "start")
+
+    try:
+        if action == "start":
+            request = parse_request(event, config)
+            result = start_job(get_client("s3"), table, get_client("sqs"), request, config)
+            return {"statusCode" : 200, "body" : result}
+        if action == "status":
+            job = table.get_item(Key = job_key(event.get("job", ""))).get("Item")
+            if not job:
+                return {"statusCode" : 404, "body" : {"error" : "Unknown job"}}
+            body = {name : job.get(name) for name in
+                    ("status", "datacenter", "tier", "days", "total", "submitted", "restored", "failed", "createdAt")}
+            if job.get("manifest"):
+                body["manifestUrl"] = manifest_url(job["manifest"], config)
+            return {"statusCode" : 200, "body" : json.loads(json.dumps(body, default = str))}
+    except ValueError as e:
+        return {"statusCode" : 400, "body" : {"error" : str(e)}}
+    return {"statusCode" : 400, "body" : {"error" : f"Unknown action {action!r}"}}
+
+
+def submit_handler(event, context):
+
+    config = settings()
+    table = get_table(config["table"])
+    limiter = RateLimiter(config["rate"])
+
+    failures = []
+    submitted = 0
+    for record in event.get("Records", []):
+        message = json.loads(record["body"])
+        job_pk = job_key(message["job"])["pk"]
+        try:
+            for obj in message["objects"]:
+                submit(table, job_pk, obj, int(message["days"]), limiter, config)
+                submitted += 1
+        except ClientError as e:
+            # Throttled past the SDK's retries: the message comes back after its
+            # visibility timeout, objects already submitted are skipped then
+            print(json.dumps({"messageId" : record["messageId"], "error" : str(e)}))
+            failures.append({"itemIdentifier" : record["messageId"]})
+
+    print(json.dumps({"submitted" : submitted, "failedMessages" : len(failures)}))
+    return {"batchItemFailures" : failures}
+
+
+def restore_state(head):
+    # (finished, expiry) from the Restore header of a HEAD response
+    match = RESTORE_HEADER.match(head.get("Restore") or "")
+    if not match:
+        return False, None
+    return match.group(1) == "false", match.group(2)
+
+
+def open_jobs(table):
+    query = {"IndexName" : "OpenJobs", "KeyConditionExpression" : Key("open").eq("1")}
+    while True:
+        resp = table.query(**query)
+        yield from resp.get("Items", [])
+        if "LastEvaluatedKey" not in resp:
+            break
+        query["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+def save_poll_cursor(table, job_pk, cursor):
+    # Where the next poll of the job picks up; None starts it over
+    try:
+        if cursor:
+            table.update_item(
+                Key = {"pk" : job_pk, "sk" : JOB_SK},
+                UpdateExpression = "SET pollCursor = :c",
+                ConditionExpression = Attr("open").exists(),
+                ExpressionAttributeValues = {":c" : cursor}
+            )
+        else:
+            table.update_item(
+                Key = {"pk" : job_pk, "sk" : JOB_SK},
+                UpdateExpression = "REMOVE pollCursor",
+                ConditionExpression = Attr("open").exists()
+            )
+    except ClientError as e:
+        # Finished meanwhile, nothing left to poll
+        if error_code(e) != "ConditionalCheckFailedException":
+            raise
+
+
+def poll_jobs(table, config, time_left = None):
+    # Fallback for buckets without restore events (other regions) and missed events.
+    # HEADs are rate limited, so a run may not get through big jobs: each open job
+    # gets an even share of the time left (time_left: optional callable, seconds)
+    # and continues from its pollCursor, wrapping around once it reaches the end.
+    limiter = RateLimiter(config["rate"])
+    polled = 0
+    restored = 0
+    jobs = list(open_jobs(table))
+    for n, job in enumerate(jobs):
+        stop_at = None
+        if time_left:
+            left = time_left()
+            if left <= config["poll_margin"]:
+                break
+            stop_at = left - (left - config["poll_margin"]) / (len(jobs) - n)
+        cursor = job.get("pollCursor")
+        last = cursor
+        for item in job_objects(table, job["pk"], cursor):
+            if stop_at is not None and time_left() <= stop_at:
+                break
+            last = item["sk"]
+            if item["status"] != SUBMITTED:
+                continue
+            limiter.wait()
+            polled += 1
+            head = bucket_client(config, item["bucket"]).head_object(Bucket = item["bucket"], Key = item["key"])
+            finished, expiry = restore_state(head)
+            if finished:
+                mark_restored(table, job["pk"], item["bucket"], item["key"], expiry, config)
+                restored += 1
+        else:
+            last = None
+        if last != cursor:
+            save_poll_cursor(table, job["pk"], last)
+    return {"polled" : polled, "restored" : restored}
+
+
+def track_handler(event, context):
+
+    config = settings()
+    table = get_table(config["table"])
+
+    if event.get("detail-type") != "Object Restore Completed":
+        time_left = (lambda: context.get_remaining_time_in_millis() / 1000) if context is not None else None
+        result = poll_jobs(table, config, time_left)
+        print(json.dumps(result))
+        return result
+
+    detail = event["detail"]
+    bucket_name = detail["bucket"]["name"]
+    raw_key = detail["object"]["key"]
+    expiry = detail.get("restore-expiry-time")
+    marked = 0
+    # Keys may arrive URL-encoded like S3 notifications
+    for key in dict.fromkeys([unquote_plus(raw_key), raw_key]):
+        resp = table.query(IndexName = "ObjectIndex", KeyConditionExpression = Key("object").eq(f"{bucket_name}/{key}"))
+        for item in resp.get("Items", []):
+            mark_restored(table, item["pk"], bucket_name, key, expiry, config)
+            marked += 1
+    return {"marked" : marked}
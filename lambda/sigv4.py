@@ -0,0 +1,113 @@
+import hashlib
+import hmac
+import os
+import re
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+# Stdlib-only SigV4 query-string presigner for S3, used on the presign hot path
+# so a cold start doesn't have to build a boto3 S3 client. Output matches
+# boto3's generate_presigned_url with signature_version="s3v4" byte for byte
+# for virtual-hostable buckets (lowercase, no dots, 3-63 chars), which is what
+# CDK generates; anything else should go through boto3.
+
+ALGORITHM = "AWS4-HMAC-SHA256"
+UNSIGNED_PAYLOAD = "UNSIGNED-PAYLOAD"
+VIRTUAL_HOST_BUCKET = re.compile(r"^[a-z0-9][a-z0-9\-]{1,61}[a-z0-9]$")
+IP_ADDRESS = re.compile(r"^\d+\.\d+\.\d+\.\d+$")
+
+# Endpoint modes carried per API key in the SSM bucket map
+GLOBAL = "global"
+REGIONAL = "regional"
+ACCELERATE = "accelerate"
+
+signingKeys = {}
+
+
+def env_credentials():
+    # Lambda exposes the execution role's credentials in the environment
+    accessKey = os.environ.get("AWS_ACCESS_KEY_ID")
+    secretKey = os.environ.get("AWS_SECRET_ACCESS_KEY")
+    if not accessKey or not secretKey:
+        return None
+    return {"accessKey": accessKey, "secretKey": secretKey, "token": os.environ.get("AWS_SESSION_TOKEN")}
+
+
+def virtual_hostable(bucket):
+    return bool(VIRTUAL_HOST_BUCKET.match(bucket)) and not IP_ADDRESS.match(bucket)
+
+
+def endpoint_host(bucket, region, endpoint=GLOBAL):
+    # Same hosts boto3 picks for virtual-hosted addressing in each mode
+    if endpoint == ACCELERATE:
+        return f"{bucket}.s3-accelerate.amazonaws.com"
+    if endpoint == REGIONAL:
+        return f"{bucket}.s3.{region}.amazonaws.com"
+    return f"{bucket}.s3.amazonaws.com"
+
+
+def encode(value, safe="-_.~"):
+    return quote(str(value).encode("utf-8"), safe=safe)
+
+
+def signing_key(secretKey, date, region, service):
+    # Derived keys only change once a day per region, keep them for the container
+    cacheKey = (secretKey, date, region, service)
+    key = signingKeys.get(cacheKey)
+    if key is None:
+        key = hmac.new(f"AWS4{secretKey}".encode("utf-8"), date.encode("utf-8"), hashlib.sha256).digest()
+        for part in (region, service, "aws4_request"):
+            key = hmac.new(key, part.encode("utf-8"), hashlib.sha256).digest()
+        if len(signingKeys) > 16:
+            signingKeys.clear()
+        signingKeys[cacheKey] = key
+    return key
+
+
+def presign_s3(method, bucket, key, region, credentials, expiresIn, params=None, headers=None,
+               host=None, now=None):
+    # params: operation query parameters in boto3's order (e.g. uploadId, partNumber)
+    # headers: extra headers the uploader must send, signed alongside host
+    now = now or datetime.now(timezone.utc)
+    timestamp = now.strftime("%Y%m%dT%H%M%SZ")
+    date = timestamp[:8]
+    host = host or endpoint_host(bucket, region)
+    path = "/" + encode(key, safe="/~")
+    scope = f"{date}/{region}/s3/aws4_request"
+
+    signedHeaders = {"host": host}
+    for name, value in (headers or {}).items():
+        signedHeaders[name.lower()] = str(value).strip()
+    signedHeaderNames = ";".join(sorted(signedHeaders))
+
+    query = list((params or {}).items())
+    query += [
+        ("X-Amz-Algorithm", ALGORITHM),
+        ("X-Amz-Credential", f"{credentials['accessKey']}/{scope}"),
+        ("X-Amz-Date", timestamp),
+        ("X-Amz-Expires", str(expiresIn)),
+        ("X-Amz-SignedHeaders", signedHeaderNames)
+    ]
+    if credentials.get("token"):
+        query.append(("X-Amz-Security-Token", credentials["token"]))
+    encodedQuery = [(encode(name), encode(value)) for name, value in query]
+
+    canonicalRequest = "\n".join([
+        method,
+        path,
+        "&".join(f"{name}={value}" for name, value in sorted(encodedQuery)),
+        "".join(f"{name}:{signedHeaders[name]}\n" for name in sorted(signedHeaders)),
+        signedHeaderNames,
+        UNSIGNED_PAYLOAD
+    ])
+    stringToSign = "\n".join([
+        ALGORITHM,
+        timestamp,
+        scope,
+        hashlib.sha256(canonicalRequest.encode("utf-8")).hexdigest()
+    ])
+    signature = hmac.new(signing_key(credentials["secretKey"], date, region, "s3"),
+                         stringToSign.encode("utf-8"), hashlib.sha256).hexdigest()
+
+    queryString = "&".join(f"{name}={value}" for name, value in encodedQuery)
+    return f"https://{host}{path}?{queryString}&X-Amz-Signature={signature}"
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The Lambda modules (lambda/) import each other as top-level modules, so the
+# tests and fakes import them the same way
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
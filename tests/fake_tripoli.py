@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+import checksums
+import presign_url
+from tests.stub_s3 import StubS3
+from tests.stub_aws import StubDynamoDB, StubSSM, StubTable
+
+# Local fake of the whole upload path for client tests: API routes are served
+# by the real presign_url.main (bucket map in a StubSSM), and the presigned
+# URLs point back at this server, which stores PUTs in a StubS3. Failures can
+# be injected per route to exercise client retries. PUTs with a SHA-256 are
+# verified and recorded in the checksum index, as the indexer Lambda would.
+
+PARAM_NAME = "/tripoli/buckets"
+INDEX_TABLE = "uploads"
+
+
+class LocalS3(StubS3):
+    def __init__(self, base_url):
+        super().__init__()
+        self.base_url = base_url
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn = 3600, **kwargs):
+        url = f"{self.base_url}/s3/{Params['Bucket']}/{quote(Params['Key'])}?X-Amz-Expires={ExpiresIn}"
+        if ClientMethod == "upload_part":
+            url += f"&uploadId={Params['UploadId']}&partNumber={Params['PartNumber']}"
+        return url
+
+
+class FakeTripoli:
+    def __init__(self, datacenters = ("valdez",), key_layout = "hourly"):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.endpoint = f"http://127.0.0.1:{self.server.server_port}/prod"
+        self.s3 = LocalS3(f"http://127.0.0.1:{self.server.server_port}")
+        self.api_keys = {f"key-{dc}": f"id-{dc}" for dc in datacenters}
+        self.bucket_map = {f"id-{dc}": {"bucket": f"{dc}-logs", "datacenter": dc, "keyLayout": key_layout}
+                           for dc in datacenters}
+        self.index = StubTable()
+        self.requests = {}
+        self.failures = {}
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    def fail(self, route, status = 503, times = 1):
+        # The next `times` requests to route ("gen-urls", "s3", ...) get `status`
+        self.failures[route] = [status] * times
+
+    def __enter__(self):
+        os.environ["SSM_logBucketMap_PARAM"] = PARAM_NAME
+        os.environ["PRESIGN_SIGNER"] = "boto3"
+        presign_url.clients["ssm"] = StubSSM({PARAM_NAME: self.bucket_map})
+        presign_url.clients["s3"] = self.s3
+        presign_url.clients["dynamodb"] = StubDynamoDB({INDEX_TABLE: self.index})
+        os.environ["CHECKSUM_INDEX_TABLE"] = INDEX_TABLE
+        presign_url.bucketMapCache.update({"map": None, "version": None, "expires": 0.0, "lastRefresh": 0.0})
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+        presign_url.clients.pop("ssm", None)
+        presign_url.clients.pop("s3", None)
+        presign_url.clients.pop("dynamodb", None)
+        os.environ.pop("CHECKSUM_INDEX_TABLE", None)
+        return False
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                with fake.lock:
+                    fake.connections += 1
+
+            def reply(self, status, body = b"", headers = None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def injected(self, route):
+                with fake.lock:
+                    fake.requests[route] = fake.requests.get(route, 0) + 1
+                    pending = fake.failures.get(route)
+                    status = pending.pop() if pending else None
+                if status:
+                    self.reply(status, json.dumps({"message": "injected failure"}).encode())
+                return status
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                route = urlsplit(self.path).path[len("/prod/"):]
+                if self.injected(route):
+                    return
+                key_id = fake.api_keys.get(self.headers.get("x-api-key"))
+                if key_id is None:
+                    return self.reply(403, b'{"message": "Forbidden"}')
+                resp = presign_url.main({
+                    "resource": f"/{route}",
+                    "requestContext": {"identity": {"apiKeyId": key_id}},
+                    "body": body.decode("utf-8")
+                }, None)
+                self.reply(resp["statusCode"], resp["body"].encode("utf-8"), {"Content-Type": "application/json"})
+
+            def do_PUT(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.injected("s3"):
+                    return
+                parts = urlsplit(self.path)
+                bucket, key = parts.path[len("/s3/"):].split("/", 1)
+                key = unquote(key)
+                query = {name: values[0] for name, values in parse_qs(parts.query).items()}
+                if "uploadId" in query:
+                    resp = fake.s3.upload_part(Bucket = bucket, Key = key, UploadId = query["uploadId"],
+                                               PartNumber = int(query["partNumber"]), Body = body)
+                else:
+                    checksum = self.headers.get("x-amz-checksum-sha256")
+                    try:
+                        resp = fake.s3.put_object(Bucket = bucket, Key = key, Body = body, ChecksumSHA256 = checksum)
+                    except Exception:
+                        return self.reply(400, b"<Error><Code>BadDigest</Code></Error>")
+                    if checksum:
+                        dc = next(e["datacenter"] for e in fake.bucket_map.values() if e["bucket"] == bucket)
+                        fake.index.put_item(Item = {**checksums.index_key(dc, checksum, len(body)), "bucket": bucket,
+                                                    "key": key, "uploaded": datetime.now(timezone.utc).isoformat()})
+                self.reply(200, headers = {"ETag": resp["ETag"]})
+
+        return Handler
@@ -0,0 +1,242 @@
+import bisect
+import json
+import re
+import threading
+
+from tests.stub_s3 import client_error
+
+# In-memory stand-ins for the SSM, SNS, Lambda and DynamoDB calls the Lambdas
+# make, counting every API call like tests.stub_s3.StubS3.
+
+
+class StubClient:
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def _call(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+
+class StubSSM(StubClient):
+    def __init__(self, parameters = None):
+        super().__init__()
+        self.parameters = {}
+        for name, value in (parameters or {}).items():
+            self.put_parameter(name, value)
+
+    def put_parameter(self, name, value):
+        version = self.parameters.get(name, {}).get("Version", 0) + 1
+        self.parameters[name] = {
+            "Name": name,
+            "Value": value if isinstance(value, str) else json.dumps(value),
+            "Version": version
+        }
+
+    def get_parameter(self, Name, **kwargs):
+        self._call("get_parameter")
+        return {"Parameter": dict(self.parameters[Name])}
+
+
+class StubSNS(StubClient):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def publish(self, TopicArn, Message, Subject = None, **kwargs):
+        self._call("publish")
+        self.messages.append({"TopicArn": TopicArn, "Subject": Subject, "Message": Message})
+        return {"MessageId": str(len(self.messages))}
+
+
+class StubSQS(StubClient):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def send_message_batch(self, QueueUrl, Entries, **kwargs):
+        self._call("send_message_batch")
+        for entry in Entries:
+            self.messages.append({"messageId": f"m{len(self.messages)}", "body": entry["MessageBody"]})
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries]}
+
+
+class StubLambda(StubClient):
+    def __init__(self):
+        super().__init__()
+        self.invocations = []
+
+    def invoke(self, FunctionName, InvocationType = "RequestResponse", Payload = b"", **kwargs):
+        self._call("invoke")
+        self.invocations.append({"FunctionName": FunctionName, "Payload": Payload})
+        return {"StatusCode": 202}
+
+
+def key_conditions(condition):
+    # Flatten a boto3.dynamodb.conditions Key expression into (name, operator, values)
+    expression = condition.get_expression()
+    if expression["operator"] == "AND":
+        return key_conditions(expression["values"][0]) + key_conditions(expression["values"][1])
+    values = expression["values"]
+    return [(values[0].name, expression["operator"], values[1:])]
+
+
+def update_clauses(expression):
+    # "SET a = :a REMOVE b" -> [("SET", " a = :a "), ("REMOVE", " b")]
+    parts = re.split(r"\b(SET|ADD|REMOVE)\b", expression)
+    return list(zip(parts[1::2], parts[2::2]))
+
+
+def matches(condition, item):
+    # Evaluate the boto3.dynamodb.conditions Attr expressions the Lambdas use
+    expression = condition.get_expression()
+    operator, values = expression["operator"], expression["values"]
+    if operator == "AND":
+        return matches(values[0], item) and matches(values[1], item)
+    if operator == "attribute_exists":
+        return values[0].name in item
+    if operator == "attribute_not_exists":
+        return values[0].name not in item
+    if operator == "=":
+        return item.get(values[0].name) == values[1]
+    if operator == "IN":
+        return item.get(values[0].name) in values[1]
+    raise NotImplementedError(operator)
+
+
+class StubTable(StubClient):
+    # Items per partition key, kept sorted by sort key
+    def __init__(self, partition_key = "pk", sort_key = "sk", page_size = 1000):
+        super().__init__()
+        self.partition_key = partition_key
+        self.sort_key = sort_key
+        self.page_size = page_size
+        self.partitions = {}
+
+    def put_item(self, Item, **kwargs):
+        self._call("put_item")
+        self._put(Item)
+
+    def _put(self, item):
+        partition = self.partitions.setdefault(item[self.partition_key], ([], {}))
+        sk = item[self.sort_key]
+        if sk not in partition[1]:
+            bisect.insort(partition[0], sk)
+        partition[1][sk] = dict(item)
+
+    def get_item(self, Key, **kwargs):
+        self._call("get_item")
+        item = self.partitions.get(Key[self.partition_key], ([], {}))[1].get(Key[self.sort_key])
+        return {"Item": dict(item)} if item else {}
+
+    def delete_item(self, Key, **kwargs):
+        self._call("delete_item")
+        with self.lock:
+            keys, items = self.partitions.get(Key[self.partition_key], ([], {}))
+            if items.pop(Key[self.sort_key], None) is not None:
+                keys.remove(Key[self.sort_key])
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues = None, ExpressionAttributeNames = None,
+                    ConditionExpression = None, ReturnValues = None, **kwargs):
+        # SET a = :x, ADD n :y and REMOVE a clauses; conditions as boto3 Attr expressions
+        self._call("update_item")
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        with self.lock:
+            partition = self.partitions.get(Key[self.partition_key], ([], {}))
+            item = partition[1].get(Key[self.sort_key])
+            if ConditionExpression is not None and not matches(ConditionExpression, item or {}):
+                raise client_error("ConditionalCheckFailedException", "UpdateItem")
+            if item is None:
+                item = dict(Key)
+                self._put(item)
+                item = self.partitions[Key[self.partition_key]][1][Key[self.sort_key]]
+            for action, body in update_clauses(UpdateExpression):
+                for assignment in body.split(","):
+                    if action == "SET":
+                        name, placeholder = [part.strip() for part in assignment.split("=")]
+                        item[names.get(name, name)] = values[placeholder]
+                    elif action == "ADD":
+                        name, placeholder = assignment.split()
+                        name = names.get(name, name)
+                        item[name] = item.get(name, 0) + values[placeholder]
+                    else:
+                        item.pop(names.get(assignment.strip(), assignment.strip()), None)
+            return {"Attributes": dict(item)} if ReturnValues == "ALL_NEW" else {}
+
+    def batch_writer(self, overwrite_by_pkeys = None):
+        table = self
+
+        class Writer:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def put_item(self, Item):
+                table._call("batch_write_item")
+                table._put(Item)
+
+        return Writer()
+
+    def query(self, KeyConditionExpression, ExclusiveStartKey = None, IndexName = None, **kwargs):
+        self._call("query")
+        if IndexName:
+            # Global secondary index: every item whose attribute equals the key, one page
+            [(name, _, values)] = key_conditions(KeyConditionExpression)
+            items = [dict(item) for _, partition in self.partitions.values() for item in partition.values()
+                     if item.get(name) == values[0]]
+            return {"Items": items, "Count": len(items)}
+
+        pk = None
+        low, high, low_inclusive = None, None, True
+        for name, operator, values in key_conditions(KeyConditionExpression):
+            if name == self.partition_key:
+                pk = values[0]
+            elif operator == ">":
+                low, low_inclusive = values[0], False
+            elif operator == ">=":
+                low = values[0]
+            elif operator == "BETWEEN":
+                low, high = values
+            elif operator == "begins_with":
+                low, high = values[0], values[0] + "\U0010ffff"
+
+        keys, items = self.partitions.get(pk, ([], {}))
+        if ExclusiveStartKey:
+            start = bisect.bisect_right(keys, ExclusiveStartKey[self.sort_key])
+        elif low is None:
+            start = 0
+        elif low_inclusive:
+            start = bisect.bisect_left(keys, low)
+        else:
+            start = bisect.bisect_right(keys, low)
+        end = len(keys) if high is None else bisect.bisect_right(keys, high)
+
+        page = keys[start:min(end, start + self.page_size)]
+        resp = {"Items": [dict(items[sk]) for sk in page], "Count": len(page)}
+        if start + len(page) < end:
+            resp["LastEvaluatedKey"] = {self.partition_key: pk, self.sort_key: page[-1]}
+        return resp
+
+
+class StubDynamoDB(StubClient):
+    # Low-level client view (typed {"S": ...} attributes) over StubTables by name
+    def __init__(self, tables):
+        super().__init__()
+        self.tables = tables
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        self._call("batch_get_item")
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.tables[name]
+            items = responses.setdefault(name, [])
+            for key in request["Keys"]:
+                item = table.get_item(Key = {attr: value["S"] for attr, value in key.items()}).get("Item")
+                if item:
+                    items.append({attr: {"N" if isinstance(value, int) else "S": str(value)}
+                                  for attr, value in item.items()})
+        return {"Responses": responses, "UnprocessedKeys": {}}
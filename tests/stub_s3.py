@@ -0,0 +1,232 @@
+import base64
+import bisect
+import hashlib
+import io
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+
+# In-memory stand-in for the parts of the S3 client the Lambdas use.
+# `latency` is slept per API call to mimic a real round trip; calls are counted.
+# Objects are kept as small tuples so benchmarks can hold millions of them.
+
+LAST_MODIFIED, SIZE, STORAGE_CLASS, BODY, ETAG = range(5)
+
+
+def client_error(code, operation):
+    try:
+        from botocore.exceptions import ClientError
+    except ImportError:
+        class ClientError(Exception):
+            def __init__(self, response, operation_name):
+                super().__init__(f"{response['Error']['Code']} ({operation_name})")
+                self.response = response
+    return ClientError({"Error": {"Code": code, "Message": code}}, operation)
+
+
+class StubPaginator:
+    def __init__(self, s3, operation):
+        self.s3 = s3
+        self.operation = operation
+
+    def paginate(self, **kwargs):
+        token = None
+        while True:
+            if token:
+                kwargs["ContinuationToken"] = token
+            page = getattr(self.s3, self.operation)(**kwargs)
+            yield page
+            if not page.get("IsTruncated"):
+                break
+            token = page["NextContinuationToken"]
+
+
+class StubS3:
+    def __init__(self, latency = 0.0, page_size = 1000):
+        self.latency = latency
+        self.page_size = page_size
+        self.buckets = {}
+        self.sorted_keys = {}
+        self.uploads = {}
+        self.restores = {}
+        self.checksums = {}
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def _call(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _object(self, bucket, key, operation):
+        try:
+            return self.buckets[bucket][key]
+        except KeyError:
+            raise client_error("NoSuchKey", operation) from None
+
+    def add_object(self, bucket, key, last_modified, size = 0, storage_class = "STANDARD", body = b"", etag = ""):
+        objects = self.buckets.setdefault(bucket, {})
+        self.sorted_keys.pop(bucket, None)
+        objects[key] = (last_modified, size or len(body), storage_class, body, etag)
+
+    def put_object(self, Bucket, Key, Body, ContentType = None, IfMatch = None, IfNoneMatch = None,
+                   ChecksumSHA256 = None, **kwargs):
+        self._call("put_object")
+        body = Body.encode() if isinstance(Body, str) else bytes(Body)
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        # S3 verifies a sent SHA-256 and returns it from HeadObject with ChecksumMode=ENABLED
+        if ChecksumSHA256 and base64.b64encode(hashlib.sha256(body).digest()).decode() != ChecksumSHA256:
+            raise client_error("BadDigest", "PutObject")
+        with self.lock:
+            if ChecksumSHA256:
+                self.checksums[(Bucket, Key)] = ChecksumSHA256
+            else:
+                self.checksums.pop((Bucket, Key), None)
+            # Conditional writes: If-None-Match "*" creates only, If-Match replaces only that ETag
+            existing = self.buckets.get(Bucket, {}).get(Key)
+            if (IfNoneMatch == "*" and existing) or (IfMatch and (not existing or existing[ETAG] != IfMatch)):
+                raise client_error("PreconditionFailed", "PutObject")
+            self.add_object(Bucket, Key, datetime.now(timezone.utc), body = body, etag = etag)
+        return {"ETag": etag}
+
+    def get_object(self, Bucket, Key, Range = None, **kwargs):
+        self._call("get_object")
+        obj = self._object(Bucket, Key, "GetObject")
+        body = obj[BODY]
+        if Range:
+            first, last = Range[len("bytes="):].split("-")
+            body = body[int(first):int(last) + 1]
+        resp = {"Body": io.BytesIO(body), "ContentLength": len(body),
+                "ETag": obj[ETAG], "LastModified": obj[LAST_MODIFIED]}
+        checksum = self.checksums.get((Bucket, Key))
+        if checksum and not Range and kwargs.get("ChecksumMode") == "ENABLED":
+            resp.update({"ChecksumSHA256": checksum, "ChecksumType": "FULL_OBJECT"})
+        return resp
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._call("head_object")
+        obj = self._object(Bucket, Key, "HeadObject")
+        head = {"ContentLength": obj[SIZE], "ETag": obj[ETAG], "LastModified": obj[LAST_MODIFIED]}
+        checksum = self.checksums.get((Bucket, Key))
+        if checksum and kwargs.get("ChecksumMode") == "ENABLED":
+            head.update({"ChecksumSHA256": checksum, "ChecksumType": "FULL_OBJECT"})
+        restore = self.restores.get((Bucket, Key))
+        if restore:
+            head["Restore"] = 'ongoing-request="true"' if not restore["expiry"] else \
+                f'ongoing-request="false", expiry-date="{restore["expiry"]}"'
+        return head
+
+    def restore_object(self, Bucket, Key, RestoreRequest, **kwargs):
+        # Archived objects only; finish_restore() plays the part of Glacier
+        self._call("restore_object")
+        obj = self._object(Bucket, Key, "RestoreObject")
+        if obj[STORAGE_CLASS] not in ("GLACIER", "DEEP_ARCHIVE"):
+            raise client_error("ObjectAlreadyInActiveTierError", "RestoreObject")
+        restore = self.restores.get((Bucket, Key))
+        if restore and not restore["expiry"]:
+            raise client_error("RestoreAlreadyInProgress", "RestoreObject")
+        self.restores[(Bucket, Key)] = {"request": RestoreRequest, "expiry": None}
+        return {}
+
+    def finish_restore(self, bucket, key, expiry = "Fri, 23 Oct 2026 00:00:00 GMT"):
+        self.restores[(bucket, key)]["expiry"] = expiry
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._call("delete_object")
+        self.buckets.get(Bucket, {}).pop(Key, None)
+        self.sorted_keys.pop(Bucket, None)
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        # Per-object ETag conditions fail with PreconditionFailed, as in S3
+        self._call("delete_objects")
+        errors = []
+        objects = self.buckets.get(Bucket, {})
+        for obj in Delete["Objects"]:
+            current = objects.get(obj["Key"])
+            if current and "ETag" in obj and current[ETAG] != obj["ETag"]:
+                errors.append({"Key": obj["Key"], "Code": "PreconditionFailed"})
+                continue
+            objects.pop(obj["Key"], None)
+        self.sorted_keys.pop(Bucket, None)
+        return {"Errors": errors} if errors else {}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self._call("create_multipart_upload")
+        upload_id = f"upload-{len(self.uploads) + 1}"
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        self._call("upload_part")
+        self.uploads[UploadId][PartNumber] = bytes(Body)
+        return {"ETag": f'"{hashlib.md5(Body).hexdigest()}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        self._call("complete_multipart_upload")
+        parts = self.uploads.pop(UploadId)
+        bodies = [parts[p["PartNumber"]] for p in MultipartUpload["Parts"]]
+        digest = hashlib.md5(b"".join(hashlib.md5(b).digest() for b in bodies)).hexdigest()
+        etag = f'"{digest}-{len(bodies)}"'
+        self.add_object(Bucket, Key, datetime.now(timezone.utc), body = b"".join(bodies), etag = etag)
+        return {"ETag": etag}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self._call("abort_multipart_upload")
+        self.uploads.pop(UploadId, None)
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn = 3600, **kwargs):
+        return f"https://{Params['Bucket']}.s3.stub/{Params['Key']}?X-Amz-Expires={ExpiresIn}"
+
+    def get_paginator(self, operation):
+        return StubPaginator(self, operation)
+
+    def list_objects_v2(self, Bucket, Prefix = "", Delimiter = None, ContinuationToken = None, **kwargs):
+        self._call("list_objects_v2")
+        keys = self.sorted_keys.get(Bucket)
+        if keys is None:
+            keys = self.sorted_keys[Bucket] = sorted(self.buckets.get(Bucket, {}))
+        start = bisect.bisect_left(keys, ContinuationToken or Prefix)
+        if ContinuationToken:
+            start = bisect.bisect_right(keys, ContinuationToken)
+
+        contents = []
+        common = []
+        last = None
+        i = start
+        while i < len(keys) and len(contents) + len(common) < self.page_size:
+            key = keys[i]
+            if not key.startswith(Prefix):
+                break
+            rest = key[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                cp = Prefix + rest[:rest.index(Delimiter) + 1]
+                common.append({"Prefix": cp})
+                # skip everything under this common prefix
+                i = bisect.bisect_left(keys, cp + "\U0010ffff")
+                last = keys[i - 1]
+                continue
+            obj = self.buckets[Bucket][key]
+            contents.append({"Key": key, "LastModified": obj[LAST_MODIFIED], "Size": obj[SIZE],
+                             "StorageClass": obj[STORAGE_CLASS], "ETag": obj[ETAG]})
+            last = key
+            i += 1
+
+        page = {"KeyCount": len(contents) + len(common)}
+        if contents:
+            page["Contents"] = contents
+        if common:
+            page["CommonPrefixes"] = common
+        if i < len(keys) and keys[i].startswith(Prefix):
+            page["IsTruncated"] = True
+            page["NextContinuationToken"] = last
+        return page
+
+
+def populate(s3, buckets, objects_per_bucket, prefixes = 16, start = None):
+    # Spread objects over `prefixes` top-level prefixes with increasing LastModified
+    start = start or datetime(2026, 1, 1, tzinfo = timezone.utc)
+    for bucket in buckets:
+        for n in range(objects_per_bucket):
+            key = f"host{n % prefixes:03d}/file-{n:08d}.log"
+            s3.add_object(bucket, key, start + timedelta(seconds = n), size = 1024)
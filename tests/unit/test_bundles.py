@@ -0,0 +1,46 @@
+import os
+
+import bundles
+from report_stream import S3MultipartWriter, MIN_PART_SIZE
+from tests.stub_s3 import StubS3
+
+
+def write(s3, key, files, part_size=MIN_PART_SIZE):
+    members = []
+    with S3MultipartWriter(s3, "valdez", key, "application/gzip", part_size) as writer:
+        for name, body in files:
+            member = bundles.compress_member(body)
+            members.append({"key": name, "offset": writer.tell(), "length": len(member)})
+            writer.write(member)
+    return writer, members
+
+
+def test_single_member_reads_back_with_one_ranged_get():
+    s3 = StubS3()
+    files = [(f"valdez/f{n}.log", f"line {n}\n".encode() * (n + 1)) for n in range(50)]
+    writer, members = write(s3, "_bundles/b.gz", files)
+
+    assert s3.head_object(Bucket="valdez", Key="_bundles/b.gz")["ETag"] == writer.expected_etag()
+    sidecar = {"members": members}
+    member = bundles.find_member(sidecar, "valdez/f7.log")
+    calls = s3.calls.get("get_object", 0)
+    assert bundles.read_member(s3, "valdez", "_bundles/b.gz", member["offset"], member["length"]) == files[7][1]
+    assert s3.calls["get_object"] == calls + 1
+
+
+def test_multipart_bundle_etag_matches():
+    s3 = StubS3()
+    files = [(f"f{n}", os.urandom(1024 * 1024)) for n in range(12)]
+    writer, members = write(s3, "_bundles/big.gz", files)
+
+    assert len(writer.parts) > 1
+    assert s3.head_object(Bucket="valdez", Key="_bundles/big.gz")["ETag"] == writer.expected_etag()
+    last = members[-1]
+    assert bundles.read_member(s3, "valdez", "_bundles/big.gz", last["offset"], last["length"]) == files[-1][1]
+
+
+def test_bundle_keys_and_sidecars():
+    from datetime import datetime, timezone
+    key = bundles.bundle_key("vegas", datetime(2026, 3, 4, 5, tzinfo=timezone.utc), "20260306T051500", 2)
+    assert key == "_bundles/vegas/2026/03/04/05/bundle-20260306T051500-0002.gz"
+    assert bundles.sidecar_key(key) == "_bundles/vegas/2026/03/04/05/bundle-20260306T051500-0002.index.json"
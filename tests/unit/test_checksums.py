@@ -0,0 +1,149 @@
+import base64
+import hashlib
+import json
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import checksums
+import presign_url
+from tests.stub_s3 import StubS3
+from tests.stub_aws import StubDynamoDB, StubSSM, StubTable
+
+BODY = b"2026-10-18T06:00:00Z app started\n"
+SHA256 = base64.b64encode(hashlib.sha256(BODY).digest()).decode()
+
+
+@pytest.fixture
+def presign(monkeypatch):
+    for name, value in {
+        "SSM_logBucketMap_PARAM": "/tripoli/buckets", "CHECKSUM_INDEX_TABLE": "uploads",
+        "AWS_ACCESS_KEY_ID": "AKIDEXAMPLE", "AWS_SECRET_ACCESS_KEY": "secret", "AWS_REGION": "us-east-1",
+        "PRESIGN_SIGNER": "stdlib"
+    }.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.delenv("AWS_SESSION_TOKEN", raising = False)
+    table = StubTable()
+    monkeypatch.setitem(presign_url.clients, "ssm", StubSSM({"/tripoli/buckets": {
+        "id-1": {"bucket": "valdez-logs", "datacenter": "valdez", "keyLayout": "hourly"}}}))
+    monkeypatch.setitem(presign_url.clients, "dynamodb", StubDynamoDB({"uploads": table}))
+    presign_url.bucketMapCache.update({"map": None, "version": None, "expires": 0.0, "lastRefresh": 0.0})
+
+    def call(resource, body):
+        resp = presign_url.main({"resource": resource, "requestContext": {"identity": {"apiKeyId": "id-1"}},
+                                 "body": json.dumps(body)}, None)
+        return resp["statusCode"], json.loads(resp["body"])
+    call.table = table
+    return call
+
+
+def test_checksum_is_signed_into_the_put(presign):
+    status, body = presign("/gen-url", {"key": "app.log", "checksumSHA256": SHA256, "size": len(BODY)})
+
+    assert status == 200 and body["headers"] == {"x-amz-checksum-sha256": SHA256}
+    query = parse_qs(urlsplit(body["url"]).query)
+    assert query["X-Amz-SignedHeaders"] == ["host;x-amz-checksum-sha256"]
+    assert body["key"].startswith("valdez/") and body["key"].endswith("/app.log")
+
+
+def test_already_stored_content_is_not_signed_again(presign):
+    presign.table.put_item(Item = {**checksums.index_key("valdez", SHA256, len(BODY)), "bucket": "valdez-logs",
+                                   "key": "valdez/2026/10/18/05/app.log", "uploaded": "2026-10-18T05:00:00.000+00:00"})
+
+    status, body = presign("/gen-url", {"key": "app.log", "checksumSHA256": SHA256, "size": len(BODY)})
+    assert status == 200 and "url" not in body
+    assert body == {"alreadyStored": True, "bucket": "valdez-logs", "key": "valdez/2026/10/18/05/app.log",
+                    "uploaded": "2026-10-18T05:00:00.000+00:00"}
+
+    # Same checksum with another size, CRC32C and plain keys are all signed
+    crc = base64.b64encode(b"\x01\x02\x03\x04").decode()
+    status, body = presign("/gen-urls", {"keys": [
+        {"key": "again.log", "checksumSHA256": SHA256, "size": len(BODY)},
+        {"key": "longer.log", "checksumSHA256": SHA256, "size": len(BODY) + 1},
+        {"key": "crc.log", "checksumCRC32C": crc, "size": 4},
+        "plain.log"
+    ]})
+    assert status == 200 and body["errors"] == []
+    assert body["stored"] == [{"key": "again.log", "finalKey": "valdez/2026/10/18/05/app.log",
+                               "bucket": "valdez-logs", "uploaded": "2026-10-18T05:00:00.000+00:00"}]
+    urls = {entry["key"]: entry for entry in body["urls"]}
+    assert sorted(urls) == ["crc.log", "longer.log", "plain.log"]
+    assert urls["crc.log"]["headers"] == {"x-amz-checksum-crc32c": crc}
+    assert "headers" not in urls["plain.log"]
+    # One index lookup per request, not per key
+    assert presign_url.clients["dynamodb"].calls == {"batch_get_item": 2}
+
+
+@pytest.mark.parametrize("body,error", [
+    ({"key": "a.log", "checksumSHA256": SHA256}, "size"),
+    ({"key": "a.log", "checksumSHA256": "not base64!", "size": 1}, "base64"),
+    ({"key": "a.log", "checksumSHA256": base64.b64encode(b"short").decode(), "size": 1}, "32-byte"),
+    ({"key": "a.log", "checksumSHA256": SHA256, "checksumCRC32C": "AQIDBA==", "size": 1}, "only one")
+])
+def test_bad_checksums_are_rejected(presign, body, error):
+    status, resp = presign("/gen-url", body)
+    assert status == 400 and error in resp["error"]
+
+
+def test_indexer_records_verified_sha256(monkeypatch):
+    pytest.importorskip("boto3")
+    import indexer
+
+    s3, table = StubS3(), StubTable()
+    s3.put_object(Bucket = "valdez-logs", Key = "valdez/2026/10/18/06/app.log", Body = BODY, ChecksumSHA256 = SHA256)
+    s3.put_object(Bucket = "valdez-logs", Key = "valdez/2026/10/18/06/plain.log", Body = BODY)
+    monkeypatch.setattr(indexer, "clients", {"s3": s3})
+    monkeypatch.setattr(indexer, "tables", {"uploads": table})
+    monkeypatch.setenv("INDEX_TABLE_NAME", "uploads")
+    monkeypatch.setenv("BUCKET_DATACENTER_MAP", json.dumps({"valdez-logs": "valdez"}))
+    monkeypatch.setenv("CHECKSUM_INDEX", "true")
+
+    event = {"Records": [{
+        "eventName": "ObjectCreated:Put",
+        "eventTime": "2026-10-18T06:00:00.000Z",
+        "s3": {"bucket": {"name": "valdez-logs"}, "object": {"key": key, "size": len(BODY)}}
+    } for key in ["valdez/2026/10/18/06/app.log", "valdez/2026/10/18/06/plain.log"]]}
+    indexer.lambda_handler(event, None)
+
+    item = table.get_item(Key = checksums.index_key("valdez", SHA256, len(BODY)))["Item"]
+    assert item["key"] == "valdez/2026/10/18/06/app.log" and item["bucket"] == "valdez-logs"
+    # Kept as long as the log bucket keeps the object, not the upload index's 30 days
+    assert item["expires"] == int(datetime(2031, 10, 17, 6, tzinfo = timezone.utc).timestamp())
+    # Two upload records and one checksum record
+    assert sum(len(items) for _, items in table.partitions.values()) == 3
+
+
+def test_compacted_file_is_still_already_stored(presign, monkeypatch):
+    pytest.importorskip("boto3")
+    import bundles
+    import compactor
+    import indexer
+
+    s3, table = StubS3(), presign.table
+    hour = datetime(2026, 10, 18, 6, tzinfo = timezone.utc)
+    keys = ["valdez/2026/10/18/06/app.log", "valdez/2026/10/18/06/other.log"]
+    s3.put_object(Bucket = "valdez-logs", Key = keys[0], Body = BODY, ChecksumSHA256 = SHA256)
+    s3.put_object(Bucket = "valdez-logs", Key = keys[1], Body = b"other\n")
+    monkeypatch.setattr(indexer, "clients", {"s3": s3})
+    monkeypatch.setattr(indexer, "tables", {"uploads": table})
+    monkeypatch.setenv("INDEX_TABLE_NAME", "uploads")
+    monkeypatch.setenv("BUCKET_DATACENTER_MAP", json.dumps({"valdez-logs": "valdez"}))
+    monkeypatch.setenv("CHECKSUM_INDEX", "true")
+    indexer.lambda_handler({"Records": [{
+        "eventName": "ObjectCreated:Put",
+        "eventTime": "2026-10-18T06:00:00.000Z",
+        "s3": {"bucket": {"name": "valdez-logs"}, "object": {"key": key, "size": size}}
+    } for key, size in zip(keys, [len(BODY), len(b"other\n")])]}, None)
+
+    result = compactor.compact_hour(s3, table, "valdez-logs", "valdez", hour, "run", {
+        "max_object_bytes": 1024, "min_objects": 2, "max_bundle_bytes": 1024 * 1024})
+    assert result["objects"] == 2 and keys[0] not in s3.buckets["valdez-logs"]
+
+    status, body = presign("/gen-url", {"key": "app.log", "checksumSHA256": SHA256, "size": len(BODY)})
+    assert status == 200 and body["alreadyStored"] and body["key"] == keys[0]
+    bundle, offset, length = body["bundleLocation"].split(":")
+    assert bundles.read_member(s3, "valdez-logs", bundle, int(offset), int(length)) == BODY
+
+    status, body = presign("/gen-urls", {"keys": [{"key": "again.log", "checksumSHA256": SHA256, "size": len(BODY)}]})
+    assert body["urls"] == [] and body["stored"][0]["bundleLocation"] == f"{bundle}:{offset}:{length}"
@@ -0,0 +1,188 @@
+import os
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("botocore")
+
+from tests.fake_tripoli import FakeTripoli
+from tripoli_client import HttpPool, TripoliApi, Uploader, collect_files, watch
+from tripoli_client.uploader import MIB, ByteBudget, url_expired
+
+
+def make_uploader(fake, **kwargs):
+    pool = HttpPool(timeout = 10)
+    kwargs.setdefault("backoff", 0.01)
+    return Uploader(TripoliApi(fake.endpoint, "key-valdez", pool), pool, **kwargs)
+
+
+def write_files(directory, count, size = 100):
+    for n in range(count):
+        sub = directory / f"host-{n % 3}"
+        sub.mkdir(exist_ok = True)
+        (sub / f"app-{n}.log").write_bytes(bytes([n % 256]) * size)
+
+
+def stored(fake, bucket = "valdez-logs"):
+    return fake.s3.buckets.get(bucket, {})
+
+
+def test_batch_upload_reuses_connections(tmp_path):
+    write_files(tmp_path, 25)
+    with FakeTripoli() as fake, make_uploader(fake, workers = 4, batch_size = 10) as uploader:
+        results = uploader.upload(collect_files([str(tmp_path)], "rack-1/"))
+
+        assert all("error" not in r for r in results)
+        assert fake.requests["gen-urls"] == 3
+        assert fake.requests["s3"] == 25
+        # One keep-alive connection per worker plus the caller's
+        assert fake.connections <= 5
+
+        objects = stored(fake)
+        assert len(objects) == 25
+        for result in results:
+            assert result["finalKey"].startswith("valdez/")
+            assert result["finalKey"].endswith(result["key"])
+            with open(result["path"], "rb") as f:
+                assert objects[result["finalKey"]][3] == f.read()
+        assert uploader.stats.summary()["files"] == 25
+
+
+def test_large_file_goes_multipart(tmp_path):
+    path = tmp_path / "big.log"
+    data = os.urandom(11 * MIB)
+    path.write_bytes(data)
+    with FakeTripoli() as fake, make_uploader(fake, multipart_threshold = 6 * MIB, part_size = 5 * MIB,
+                                              max_inflight_bytes = 10 * MIB) as uploader:
+        [result] = uploader.upload([(str(path), "big.log")])
+
+        assert "error" not in result
+        assert result["etag"].endswith('-3"')
+        assert fake.requests["multipart/initiate"] == 1
+        assert fake.requests["s3"] == 3
+        assert stored(fake)[result["finalKey"]][3] == data
+        assert uploader.budget.peak <= 10 * MIB
+
+
+def test_refused_part_is_signed_again(tmp_path):
+    path = tmp_path / "big.log"
+    data = os.urandom(11 * MIB)
+    path.write_bytes(data)
+    with FakeTripoli() as fake, make_uploader(fake, multipart_threshold = 6 * MIB, part_size = 5 * MIB) as uploader:
+        # As S3 answers a PUT to an expired URL
+        fake.fail("s3", 403)
+        [result] = uploader.upload([(str(path), "big.log")])
+
+        assert "error" not in result
+        assert fake.requests["multipart/sign-parts"] == 2
+        assert stored(fake)[result["finalKey"]][3] == data
+
+
+def test_part_url_expiry():
+    signed = lambda ago, expires: (f"https://s3/b/k?X-Amz-Date={time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(time.time() - ago))}"
+                                   f"&X-Amz-Expires={expires}&X-Amz-Signature=x")
+    assert not url_expired(signed(0, 900))
+    assert url_expired(signed(880, 900))
+    assert url_expired(signed(3600, 900))
+    assert not url_expired("http://127.0.0.1/s3/b/k?X-Amz-Expires=900")
+
+
+def test_pool_close_closes_every_threads_connections(tmp_path):
+    write_files(tmp_path, 12)
+    with FakeTripoli() as fake:
+        uploader = make_uploader(fake, workers = 4)
+        uploader.upload(collect_files([str(tmp_path)]))
+        connections = set(uploader.pool.open_connections)
+        assert len(connections) > 1
+        uploader.close()
+
+        assert not uploader.pool.open_connections
+        assert all(conn.sock is None for conn in connections)
+
+
+def test_checksums_skip_already_stored_files(tmp_path):
+    for name in ["first", "again"]:
+        (tmp_path / name).mkdir()
+        write_files(tmp_path / name, 3)
+    with FakeTripoli() as fake, make_uploader(fake, checksums = True) as uploader:
+        first = uploader.upload(collect_files([str(tmp_path / "first")]))
+        # Same content under other names: nothing is PUT a second time
+        again = uploader.upload(collect_files([str(tmp_path / "again")], "resent/"))
+
+        assert all("error" not in r and "alreadyStored" not in r for r in first)
+        assert [r["finalKey"] for r in again] == [r["finalKey"] for r in first]
+        assert all(r["alreadyStored"] for r in again)
+        assert fake.requests["s3"] == 3 and len(stored(fake)) == 3
+        summary = uploader.stats.summary()
+        assert (summary["files"], summary["alreadyStored"]) == (3, 3)
+        assert "3 already stored" in uploader.stats.format()
+
+
+def test_checksum_mismatch_fails_the_put(tmp_path):
+    write_files(tmp_path, 1)
+    [(path, key)] = collect_files([str(tmp_path)])
+    with FakeTripoli() as fake, make_uploader(fake, checksums = True) as uploader:
+        _, [entry] = uploader.batch_entries([(0, path, key, 100)], [None])
+        signed = uploader.api.gen_urls([entry])["urls"][0]
+        with open(path, "wb") as f:
+            f.write(b"changed after hashing".ljust(100))
+        uploader.budget.acquire(100)
+        result = uploader.put_file(path, key, 100, signed)
+
+        assert "error" in result and not stored(fake)
+
+
+def test_retries_throttling_and_server_errors(tmp_path):
+    write_files(tmp_path, 4)
+    with FakeTripoli() as fake, make_uploader(fake) as uploader:
+        fake.fail("gen-urls", 429)
+        fake.fail("s3", 503, times = 2)
+        results = uploader.upload(collect_files([str(tmp_path)]))
+
+        assert all("error" not in r for r in results)
+        assert len(stored(fake)) == 4
+        assert uploader.stats.retries == 3
+
+
+def test_client_errors_are_not_retried(tmp_path):
+    write_files(tmp_path, 2)
+    with FakeTripoli() as fake, make_uploader(fake) as uploader:
+        fake.fail("s3", 403)
+        results = uploader.upload(collect_files([str(tmp_path)]))
+
+        assert sum("error" in r for r in results) == 1
+        assert uploader.stats.retries == 0
+        assert uploader.stats.failed == 1
+
+
+def test_byte_budget_bounds_in_flight():
+    budget = ByteBudget(100)
+    budget.acquire(60)
+    blocked = threading.Thread(target = budget.acquire, args = (60,))
+    blocked.start()
+    blocked.join(0.05)
+    assert blocked.is_alive()
+    budget.release(60)
+    blocked.join(1)
+    assert not blocked.is_alive() and budget.peak == 60
+
+    # Larger than the whole budget is let through once nothing else is in flight
+    budget.release(60)
+    budget.acquire(500)
+    assert budget.in_flight == 500
+
+
+def test_watch_uploads_settled_files_once(tmp_path):
+    (tmp_path / "a.log").write_bytes(b"a" * 10)
+    state = tmp_path.parent / f"{tmp_path.name}-state.json"
+    with FakeTripoli() as fake, make_uploader(fake) as uploader:
+        # First scan only records sizes, the second uploads, the third has nothing new
+        watch(uploader, str(tmp_path), interval = 0, state_path = str(state), max_scans = 3, log = lambda line: None)
+        assert fake.requests["s3"] == 1
+
+        # A restarted watcher remembers a.log through the state file
+        (tmp_path / "b.log").write_bytes(b"b" * 10)
+        watch(uploader, str(tmp_path), interval = 0, state_path = str(state), max_scans = 2, log = lambda line: None)
+        assert fake.requests["s3"] == 2
+        assert sorted(key.rsplit("/", 1)[1] for key in stored(fake)) == ["a.log", "b.log"]
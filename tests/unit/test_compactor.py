@@ -0,0 +1,154 @@
+import json
+from datetime import datetime, timezone, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("boto3")
+
+import bundles
+import compactor
+import indexer
+from tests.stub_s3 import StubS3
+from tests.stub_aws import StubTable
+
+HOUR = datetime(2026, 10, 16, 6, tzinfo=timezone.utc)
+
+
+class FlakyS3(StubS3):
+    # get_object fails `failures` times, as a throttled or timed-out GET would
+    def __init__(self, failures=0):
+        super().__init__()
+        self.failures = failures
+
+    def get_object(self, **kwargs):
+        with self.lock:
+            fail, self.failures = self.failures > 0, self.failures - 1
+        if fail:
+            raise RuntimeError("GET timed out")
+        return super().get_object(**kwargs)
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    s3, table = FlakyS3(), StubTable()
+    monkeypatch.setattr(compactor, "boto3", SimpleNamespace(
+        client=lambda *args, **kwargs: s3,
+        resource=lambda *args, **kwargs: SimpleNamespace(Table=lambda name: table)))
+    for name, value in {
+        "INDEX_TABLE_NAME": "uploads", "BUCKET_DATACENTER_MAP": '{"valdez-logs": "valdez"}',
+        "COMPACT_GET_WORKERS": "8", "COMPACT_MAX_BUNDLE_BYTES": "1000", "COMPACT_TIME_MARGIN_SECONDS": "60"
+    }.items():
+        monkeypatch.setenv(name, value)
+
+    for n in range(40):
+        key = f"host-1/app-{n:02d}.log"
+        uploaded = HOUR + timedelta(minutes=n)
+        s3.put_object(Bucket="valdez-logs", Key=key, Body=f"line {n}\n".encode() * 10)
+        table.put_item(Item={
+            "pk": indexer.index_partition("valdez", uploaded),
+            "sk": indexer.index_sort_key(uploaded, "valdez-logs", key),
+            "bucket": "valdez-logs", "key": key, "size": 80, "uploaded": indexer.format_time(uploaded)
+        })
+    return s3, table
+
+
+def context(seconds):
+    # Remaining time per call, the last value repeats
+    left = list(seconds)
+    return SimpleNamespace(get_remaining_time_in_millis=lambda: (left.pop(0) if len(left) > 1 else left[0]) * 1000)
+
+
+def run(hour, ctx=None):
+    return compactor.lambda_handler({"hour": hour.isoformat()}, ctx)
+
+
+def index_items(table):
+    return [item for pk, (_, items) in table.partitions.items() if pk != compactor.PENDING_PK
+            for item in items.values()]
+
+
+def test_hour_is_bundled_in_order_with_parallel_gets(aws):
+    s3, table = aws
+    run(HOUR)
+
+    items = index_items(table)
+    assert all("bundle" in item for item in items)
+    assert not [key for key in s3.buckets["valdez-logs"] if not key.startswith(bundles.BUNDLE_PREFIX)]
+    sidecars = [key for key in s3.buckets["valdez-logs"] if key.endswith(".index.json")]
+    assert len(sidecars) == 4
+    members = [m["key"] for key in sorted(sidecars)
+               for m in bundles.read_sidecar(s3, "valdez-logs", key[:-len(".index.json")] + ".gz")["members"]]
+    assert members == [f"host-1/app-{n:02d}.log" for n in range(40)]
+    assert table.partitions.get(compactor.PENDING_PK, ([], {}))[0] == []
+
+
+def test_failed_hour_is_retried_by_the_next_run(aws):
+    s3, table = aws
+    s3.failures = 1
+    run(HOUR)
+
+    [pending] = table.partitions[compactor.PENDING_PK][1].values()
+    assert pending["bucket"] == "valdez-logs" and pending["attempts"] == 1
+    assert not any("bundle" in item for item in index_items(table))
+
+    # The next hourly run has nothing of its own and finishes the failed hour
+    run(HOUR + timedelta(hours=1))
+    assert all("bundle" in item for item in index_items(table))
+    assert table.partitions[compactor.PENDING_PK][0] == []
+
+
+def test_hour_cut_short_by_the_timeout_is_continued(aws):
+    s3, table = aws
+    # Enough time for the run check and the first bundle, then under the margin
+    run(HOUR, context([120, 120, 10]))
+
+    bundled = [item for item in index_items(table) if "bundle" in item]
+    assert 0 < len(bundled) < 40
+    [pending] = table.partitions[compactor.PENDING_PK][1].values()
+    assert pending["attempts"] == 0
+
+    run(HOUR + timedelta(hours=1), context([900]))
+    assert all("bundle" in item for item in index_items(table))
+    assert table.partitions[compactor.PENDING_PK][0] == []
+
+
+def test_hour_is_given_up_after_max_attempts(aws, monkeypatch):
+    s3, table = aws
+    monkeypatch.setenv("COMPACT_MAX_ATTEMPTS", "2")
+    s3.failures = 1000
+    run(HOUR)
+    run(HOUR + timedelta(hours=1))
+    assert table.partitions[compactor.PENDING_PK][1][compactor.pending_key("valdez-logs", HOUR)["sk"]]["attempts"] == 2
+
+    run(HOUR + timedelta(hours=2))
+    assert table.partitions[compactor.PENDING_PK][0] == []
+
+
+class ReuploadS3(FlakyS3):
+    # The key is uploaded again right after the compactor fetched it
+    def __init__(self, key):
+        super().__init__()
+        self.key = key
+
+    def get_object(self, **kwargs):
+        resp = super().get_object(**kwargs)
+        if kwargs["Key"] == self.key:
+            self.key = None
+            super().put_object(Bucket=kwargs["Bucket"], Key=kwargs["Key"], Body=b"newer\n")
+        return resp
+
+
+def test_originals_changed_since_the_fetch_are_kept(aws, monkeypatch):
+    s3, table = aws
+    racing = ReuploadS3("host-1/app-07.log")
+    racing.buckets = s3.buckets
+    monkeypatch.setattr(compactor, "boto3", SimpleNamespace(
+        client=lambda *args, **kwargs: racing,
+        resource=lambda *args, **kwargs: SimpleNamespace(Table=lambda name: table)))
+    result = run(HOUR)
+
+    assert [r["keptChanged"] for r in json.loads(result["body"])] == [["host-1/app-07.log"]]
+    originals = [key for key in racing.buckets["valdez-logs"] if not key.startswith(bundles.BUNDLE_PREFIX)]
+    assert originals == ["host-1/app-07.log"]
+    assert racing.buckets["valdez-logs"]["host-1/app-07.log"][3] == b"newer\n"
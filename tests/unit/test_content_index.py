@@ -0,0 +1,208 @@
+import gzip
+import io
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip("boto3")
+
+import bundles
+import content_index
+import content_indexer
+from tests.stub_s3 import StubS3
+from tripoli_query.query import find_objects, matching_lines
+
+FIELDS = content_index.compile_fields(content_index.DEFAULT_FIELDS)
+START = datetime(2026, 10, 18, 2, tzinfo=timezone.utc)
+END = datetime(2026, 10, 18, 3, tzinfo=timezone.utc)
+
+
+def log(hour, hosts, count=200):
+    return "".join(
+        f"2026-10-18T{hour:02d}:{n % 60:02d}:{n % 50:02d}.{n:03d}Z INFO host={hosts[n % len(hosts)]} "
+        f"request_id=req-{hour}-{n} done\n" for n in range(count)).encode()
+
+
+def sqs_event(*objects):
+    return {"Records": [{
+        "messageId": f"m{n}",
+        "body": json.dumps({"time": "2026-10-18T04:00:00Z", "detail": {
+            "bucket": {"name": bucket}, "object": {"key": key}}})
+    } for n, (bucket, key) in enumerate(objects)]}
+
+
+def test_summary_streams_multi_member_gzip():
+    body = log(2, ["web-1"], 100)
+    # Two gzip members, read in tiny chunks so lines straddle chunk boundaries
+    data = gzip.compress(body[:1234]) + gzip.compress(body[1234:])
+    summary = content_index.summarize(content_index.iter_blocks(io.BytesIO(data), chunk_bytes=64), FIELDS)
+
+    assert summary["lines"] == 100
+    assert summary["minTime"] == "2026-10-18T02:00:00.000+00:00"
+    assert summary["maxTime"] == "2026-10-18T02:59:09.059+00:00"
+    assert summary["terms"] == 101
+    bloom = content_index.BloomFilter.from_json(summary["bloom"])
+    assert "host=web-1" in bloom and "request_id=req-2-42" in bloom
+    false_positives = sum(f"host=web-{n}" in bloom for n in range(2, 2002))
+    assert false_positives < 60
+
+
+def test_offsets_are_converted_to_utc():
+    blocks = [b"2026-10-18 05:30:00+03:00 a\n2026-10-18T01:00:00Z b\n", b"no timestamp, then 2026-10-18T09:00:00Z\n"]
+    summary = content_index.summarize(blocks, FIELDS)
+    assert summary["minTime"] == "2026-10-18T01:00:00.000+00:00"
+    assert summary["maxTime"] == "2026-10-18T09:00:00.000+00:00"
+    assert summary["lines"] == 3
+
+
+def test_indexer_writes_hour_files_and_query_prunes(monkeypatch):
+    s3 = StubS3()
+    monkeypatch.setitem(content_indexer.clients, "s3", s3)
+    monkeypatch.setenv("CONTENT_INDEX_BUCKET", "content-index")
+    monkeypatch.setenv("BUCKET_DATACENTER_MAP", json.dumps({"valdez-logs": "valdez"}))
+    when = datetime(2026, 10, 18, 4, tzinfo=timezone.utc)
+    s3.add_object("valdez-logs", "valdez/a.log", when, body=log(2, ["web-1", "web-2"]))
+    s3.add_object("valdez-logs", "valdez/b.log.gz", when, body=gzip.compress(log(2, ["web-3"])))
+    s3.add_object("valdez-logs", "valdez/c.log", when, body=log(5, ["web-1"]))
+    s3.add_object("valdez-logs", "valdez/d+e.log", when, body=b"plain text, no time\n")
+
+    resp = content_indexer.lambda_handler(sqs_event(("valdez-logs", "valdez/a.log"),
+                                                    ("valdez-logs", "valdez/b.log.gz")), None)
+    assert resp == {"batchItemFailures": []}
+    # A second batch adds its own part files, no hour file is read or rewritten
+    resp = content_indexer.lambda_handler(sqs_event(("valdez-logs", "valdez/c.log"),
+                                                    ("valdez-logs", "valdez/d%2Be.log"),
+                                                    ("valdez-logs", "valdez/gone.log")), None)
+    assert resp == {"batchItemFailures": []}
+    parts = sorted(key.rsplit("/", 1)[0] for key in s3.buckets["content-index"])
+    assert parts == ["_parts/valdez/2026/10/18/02", "_parts/valdez/2026/10/18/04", "_parts/valdez/2026/10/18/05"]
+
+    def query():
+        stats = {}
+        found = list(find_objects(s3, "content-index", ["valdez"], START, END, [("host", "web-1")], stats))
+        assert [entry["key"] for entry in found] == ["valdez/a.log"]
+        assert stats["hourFiles"] == 1 and stats["indexed"] == 2
+        return found
+
+    # Parts are visible before the merge, and the hour files hold them after it
+    query()
+    assert content_indexer.lambda_handler({"merge": True}, None) == {
+        "mergedParts": 3, "indexFiles": 3, "failedFiles": 0}
+    assert sorted(s3.buckets["content-index"]) == [
+        "valdez/2026/10/18/02.json.gz", "valdez/2026/10/18/04.json.gz", "valdez/2026/10/18/05.json.gz"]
+    found = query()
+
+    lines = list(matching_lines(s3, found[0], START, END, [("host", "web-1")], FIELDS))
+    assert len(lines) == 100 and all("host=web-1 " in line for line in lines)
+
+
+def test_lines_of_compacted_objects_are_read_from_their_bundle(monkeypatch):
+    s3 = StubS3()
+    monkeypatch.setitem(content_indexer.clients, "s3", s3)
+    monkeypatch.setenv("CONTENT_INDEX_BUCKET", "content-index")
+    monkeypatch.setenv("BUCKET_DATACENTER_MAP", json.dumps({"valdez-logs": "valdez"}))
+    body = gzip.compress(log(2, ["web-1", "web-2"]))
+    s3.put_object(Bucket="valdez-logs", Key="valdez/a.log.gz", Body=body)
+    content_indexer.lambda_handler(sqs_event(("valdez-logs", "valdez/a.log.gz")), None)
+    [entry] = find_objects(s3, "content-index", ["valdez"], START, END, [("host", "web-1")])
+
+    # Compacted with the rest of its upload hour (04:00); the first bundle holds
+    # an older upload of the same key, which must not be read
+    hour = datetime(2026, 10, 18, 4, tzinfo=timezone.utc)
+    for number, members in enumerate([[(b"2026-10-18T02:00:00Z host=web-1 old\n", '"old"')],
+                                      [(b"other\n", '"x"'), (body, entry["etag"])]]):
+        key = bundles.bundle_key("valdez", hour, "run", number)
+        data, sidecar = b"", []
+        for member_body, etag in members:
+            member = bundles.compress_member(member_body)
+            sidecar.append({"key": "valdez/a.log.gz", "offset": len(data), "length": len(member), "etag": etag})
+            data += member
+        s3.put_object(Bucket="valdez-logs", Key=key, Body=data)
+        s3.put_object(Bucket="valdez-logs", Key=bundles.sidecar_key(key),
+                      Body=json.dumps({"bundle": key, "members": sidecar}))
+    s3.delete_object(Bucket="valdez-logs", Key="valdez/a.log.gz")
+
+    lines = list(matching_lines(s3, entry, START, END, [("host", "web-1")], FIELDS))
+    assert len(lines) == 100 and all("host=web-1 " in line for line in lines)
+
+
+class RacingS3(StubS3):
+    # Another batch rewrites the hour file right after our first read of it
+    def __init__(self, racer):
+        super().__init__()
+        self.racer = racer
+
+    def get_object(self, **kwargs):
+        resp = super().get_object(**kwargs)
+        racer, self.racer = self.racer, None
+        if racer:
+            racer(self)
+        return resp
+
+
+def test_conflicting_writers_both_land():
+    hour = datetime(2026, 10, 18, 2, tzinfo=timezone.utc)
+    key, empty = "valdez/2026/10/18/02.json.gz", content_index.empty_index("valdez", hour)
+    s3 = RacingS3(lambda s3: content_indexer.merge_index(s3, "content-index", key, empty,
+                                                        {"valdez-logs/b": {"key": "b"}}))
+    s3.put_object(Bucket="content-index", Key="valdez/2026/10/18/02.json.gz",
+                  Body=content_index.encode_index(content_index.empty_index("valdez", hour)))
+
+    content_indexer.merge_index(s3, "content-index", key, empty, {"valdez-logs/a": {"key": "a"}})
+
+    body = s3.get_object(Bucket="content-index", Key="valdez/2026/10/18/02.json.gz")["Body"].read()
+    assert sorted(content_index.decode_index(body)["objects"]) == ["valdez-logs/a", "valdez-logs/b"]
+    assert s3.calls["put_object"] == 4
+
+
+def test_merge_folds_new_parts_into_existing_hour_files(monkeypatch):
+    s3 = StubS3()
+    hour = datetime(2026, 10, 18, 2, tzinfo=timezone.utc)
+    for batch in range(3):
+        content_indexer.write_part(s3, "content-index", "valdez/2026/10/18/02.json.gz",
+                                   content_index.empty_index("valdez", hour), {
+            f"valdez-logs/{batch}": {"key": str(batch)}, "valdez-logs/again": {"key": "again", "batch": batch}})
+        if batch == 0:
+            content_indexer.merge_parts(s3, "content-index", 100)
+
+    assert content_indexer.merge_parts(s3, "content-index", 100)["mergedParts"] == 2
+    body = s3.get_object(Bucket="content-index", Key="valdez/2026/10/18/02.json.gz")["Body"].read()
+    objects = content_index.decode_index(body)["objects"]
+    assert sorted(objects) == ["valdez-logs/0", "valdez-logs/1", "valdez-logs/2", "valdez-logs/again"]
+    assert objects["valdez-logs/again"]["batch"] == 2
+    assert list(s3.buckets["content-index"]) == ["valdez/2026/10/18/02.json.gz"]
+
+
+def test_objects_longer_than_the_max_span_are_never_pruned(monkeypatch):
+    s3 = StubS3()
+    monkeypatch.setitem(content_indexer.clients, "s3", s3)
+    monkeypatch.setenv("CONTENT_INDEX_BUCKET", "content-index")
+    monkeypatch.setenv("BUCKET_DATACENTER_MAP", json.dumps({"valdez-logs": "valdez"}))
+    monkeypatch.setenv("CONTENT_INDEX_MAX_SPAN_HOURS", "48")
+    when = datetime(2026, 11, 2, tzinfo=timezone.utc)
+    # Three days of log: the 02:00 window is 70 hours before the object ends
+    body = log(2, ["web-1"], 10) + b"2026-10-20T23:30:00Z INFO host=web-9 still running\n"
+    s3.add_object("valdez-logs", "valdez/long.log", when, body=body)
+    s3.add_object("valdez-logs", "valdez/short.log", when, body=log(2, ["web-2"], 10))
+
+    content_indexer.lambda_handler(sqs_event(("valdez-logs", "valdez/long.log"),
+                                             ("valdez-logs", "valdez/short.log")), None)
+    assert sorted(key.rsplit("/", 1)[0] for key in s3.buckets["content-index"]) == [
+        "_parts/valdez/2026/10/18/02", "_parts/valdez/spans/2026/10"]
+
+    for merged in [False, True]:
+        if merged:
+            content_indexer.lambda_handler({"merge": True}, None)
+            assert sorted(s3.buckets["content-index"]) == [
+                "valdez/2026/10/18/02.json.gz", "valdez/spans/2026/10.json.gz"]
+        stats = {}
+        found = list(find_objects(s3, "content-index", ["valdez"], START, END, [("host", "web-1")], stats))
+        assert [entry["key"] for entry in found] == ["valdez/long.log"]
+        assert stats["hourFiles"] == 1 and stats["spansFiles"] == 1 and stats["indexed"] == 2
+
+    # Spans files of months before the window cannot hold anything in it
+    later = datetime(2026, 11, 1, tzinfo=timezone.utc)
+    stats = {}
+    assert list(find_objects(s3, "content-index", ["valdez"], later, later, [], stats)) == []
+    assert stats["spansFiles"] == 0
@@ -0,0 +1,45 @@
+import json
+
+import emf
+import presign_url
+from tests.stub_aws import StubSSM
+
+
+def test_record_is_embedded_metric_format(monkeypatch):
+    monkeypatch.setenv("METRICS_NAMESPACE", "Tripoli")
+    metrics = emf.Metrics({"FunctionName": "fn", "Datacenter": "valdez"}, [["FunctionName"], ["FunctionName", "Datacenter"]])
+    metrics.put_time("SignTime", 0.0015)
+    metrics.put_time("SignTime", 0.0005)
+    metrics.put("Requests", 1)
+    metrics.set_property("route", "/gen-url")
+
+    record = metrics.record()
+    directive = record["_aws"]["CloudWatchMetrics"][0]
+    assert directive["Namespace"] == "Tripoli"
+    assert directive["Dimensions"] == [["FunctionName"], ["FunctionName", "Datacenter"]]
+    assert {"Name": "SignTime", "Unit": "Milliseconds"} in directive["Metrics"]
+    assert record["SignTime"] == 2.0
+    assert record["Datacenter"] == "valdez" and record["route"] == "/gen-url"
+
+
+def test_presign_emits_stage_timings_per_datacenter(monkeypatch, capsys):
+    monkeypatch.setenv("METRICS_NAMESPACE", "Tripoli")
+    monkeypatch.setenv("SSM_logBucketMap_PARAM", "/tripoli/buckets")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "AKIDEXAMPLE")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "secret")
+    monkeypatch.setenv("AWS_REGION", "us-east-1")
+    monkeypatch.setenv("PRESIGN_SIGNER", "stdlib")
+    monkeypatch.setitem(presign_url.clients, "ssm", StubSSM({"/tripoli/buckets": {
+        "id-1": {"bucket": "valdez-logs", "datacenter": "valdez", "keyLayout": "hourly"}}}))
+    presign_url.bucketMapCache.update({"map": None, "version": None, "expires": 0.0, "lastRefresh": 0.0})
+
+    resp = presign_url.main({"resource": "/gen-urls", "requestContext": {"identity": {"apiKeyId": "id-1"}},
+                             "body": json.dumps({"keys": ["a.log", "b.log"]})}, None)
+    assert resp["statusCode"] == 200
+
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{"_aws"')]
+    assert len(records) == 1
+    record = records[0]
+    assert record["Datacenter"] == "valdez"
+    assert record["UrlsSigned"] == 2 and record["Requests"] == 1 and record["ErrorResponses"] == 0
+    assert {"MapLoadTime", "SignTime", "RequestTime", "ColdStart"} <= set(record)
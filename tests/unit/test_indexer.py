@@ -0,0 +1,64 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip("boto3")
+
+import indexer
+from tests.stub_aws import StubTable
+
+
+def record(key, event_time, bucket_name = "valdez-logs", event_name = "ObjectCreated:Put", size = 10):
+    return {
+        "eventName": event_name,
+        "eventTime": event_time,
+        "s3": {"bucket": {"name": bucket_name}, "object": {"key": key, "size": size, "eTag": "abc"}}
+    }
+
+
+@pytest.fixture
+def table(monkeypatch):
+    table = StubTable()
+    monkeypatch.setattr(indexer, "tables", {"uploads": table})
+    monkeypatch.setenv("INDEX_TABLE_NAME", "uploads")
+    monkeypatch.setenv("BUCKET_DATACENTER_MAP", json.dumps({"valdez-logs": "valdez", "vegas-logs": "vegas"}))
+    monkeypatch.setenv("INDEX_TTL_DAYS", "30")
+    monkeypatch.delenv("CHECKSUM_INDEX", raising = False)
+    return table
+
+
+def test_uploads_are_partitioned_by_datacenter_and_day(table):
+    resp = indexer.lambda_handler({"Records": [
+        record("host-1/late.log", "2026-10-17T23:59:59.999Z"),
+        record("host-1/app+2026-10-18%3A06.log", "2026-10-18T00:00:00.000Z"),
+        record("host-2/app.log", "2026-10-18T06:30:00.5+02:00", bucket_name = "vegas-logs")
+    ]}, None)
+    assert resp["body"] == "Indexed 3 objects"
+
+    assert sorted(table.partitions) == ["valdez#2026-10-17", "valdez#2026-10-18", "vegas#2026-10-18"]
+    assert table.partitions["valdez#2026-10-17"][0] == ["2026-10-17T23:59:59.999+00:00#valdez-logs/host-1/late.log"]
+    # Keys arrive URL-encoded in S3 events
+    [item] = table.partitions["valdez#2026-10-18"][1].values()
+    assert item == {
+        "pk": "valdez#2026-10-18",
+        "sk": "2026-10-18T00:00:00.000+00:00#valdez-logs/host-1/app 2026-10-18:06.log",
+        "bucket": "valdez-logs",
+        "key": "host-1/app 2026-10-18:06.log",
+        "size": 10,
+        "etag": "abc",
+        "uploaded": "2026-10-18T00:00:00.000+00:00",
+        "expires": int(datetime(2026, 11, 17, tzinfo = timezone.utc).timestamp())
+    }
+    # Times are stored in UTC, so the day of the partition is the UTC day
+    assert table.partitions["vegas#2026-10-18"][0] == ["2026-10-18T04:30:00.500+00:00#vegas-logs/host-2/app.log"]
+
+
+def test_only_new_uploads_are_indexed(table):
+    resp = indexer.lambda_handler({"Records": [
+        record("host-1/gone.log", "2026-10-18T06:00:00.000Z", event_name = "ObjectRemoved:Delete"),
+        record("_bundles/valdez/2026/10/16/06/bundle-run-0000.gz", "2026-10-18T06:00:00.000Z"),
+        record("host-1/app.log", "2026-10-18T06:00:00.000Z")
+    ]}, None)
+    assert resp["body"] == "Indexed 1 objects"
+    assert [item["key"] for _, items in table.partitions.values() for item in items.values()] == ["host-1/app.log"]
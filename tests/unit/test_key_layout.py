@@ -0,0 +1,51 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+import key_layout
+import presign_url
+from tests.stub_aws import StubSSM
+
+WHEN = datetime(2026, 10, 18, 6, 45, 12, tzinfo=timezone.utc)
+
+
+def test_build_key():
+    assert key_layout.build_key(key_layout.FLAT, "valdez", WHEN, "host-1/app.log") == "host-1/app.log"
+    assert key_layout.build_key(key_layout.HOURLY, "valdez", WHEN, "host-1/app.log") == \
+        "valdez/2026/10/18/06/host-1/app.log"
+
+
+def test_window_prefixes_cover_every_overlapping_hour():
+    start = datetime(2026, 10, 17, 22, 59, tzinfo=timezone.utc)
+    assert key_layout.window_prefixes("valdez", start, WHEN) == [
+        "valdez/2026/10/17/22/", "valdez/2026/10/17/23/", "valdez/2026/10/18/00/", "valdez/2026/10/18/01/",
+        "valdez/2026/10/18/02/", "valdez/2026/10/18/03/", "valdez/2026/10/18/04/", "valdez/2026/10/18/05/",
+        "valdez/2026/10/18/06/"]
+    assert key_layout.window_prefixes("valdez", WHEN, WHEN) == ["valdez/2026/10/18/06/"]
+
+
+@pytest.mark.parametrize("layout,expected", [
+    (None, "host-1/app.log"),
+    ("flat", "host-1/app.log"),
+    ("hourly", "valdez/2026/10/18/06/host-1/app.log")
+])
+def test_gen_url_returns_the_final_key(monkeypatch, layout, expected):
+    entry = {"bucket": "valdez-logs", "datacenter": "valdez"}
+    if layout:
+        entry["keyLayout"] = layout
+    for name, value in {"SSM_logBucketMap_PARAM": "/tripoli/buckets", "AWS_ACCESS_KEY_ID": "AKIDEXAMPLE",
+                        "AWS_SECRET_ACCESS_KEY": "secret", "AWS_REGION": "us-east-1",
+                        "PRESIGN_SIGNER": "stdlib"}.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.delenv("CHECKSUM_INDEX_TABLE", raising=False)
+    monkeypatch.setitem(presign_url.clients, "ssm", StubSSM({"/tripoli/buckets": {"id-1": entry}}))
+    presign_url.bucketMapCache.update({"map": None, "version": None, "expires": 0.0, "lastRefresh": 0.0})
+    monkeypatch.setattr(presign_url, "datetime", type("FixedDatetime", (datetime,), {
+        "now": classmethod(lambda cls, tz=None: WHEN)}))
+
+    resp = presign_url.main({"resource": "/gen-url", "requestContext": {"identity": {"apiKeyId": "id-1"}},
+                             "body": json.dumps({"key": "host-1/app.log"})}, None)
+    body = json.loads(resp["body"])
+    assert body["key"] == expected
+    assert f"/{expected}?" in body["url"]
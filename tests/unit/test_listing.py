@@ -0,0 +1,65 @@
+import time
+from datetime import datetime, timezone, timedelta
+
+import listing
+from tests.stub_s3 import StubS3, populate
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def keys(rows):
+    return [(row["bucketname"], row["filename"]) for row in rows]
+
+
+def test_sharded_listing_matches_sequential_order():
+    s3 = StubS3(page_size=50)
+    populate(s3, ["valdez", "vegas"], 500, prefixes=5, start=START)
+    s3.add_object("valdez", "top-level.log", START)
+
+    sequential = keys(listing.list_objects(s3, ["valdez", "vegas"], START, None, workers=1))
+    sharded = keys(listing.list_objects(s3, ["valdez", "vegas"], START, None, workers=8))
+
+    assert sharded == sequential
+    assert len(sharded) == 1001
+    assert sharded[0] == ("valdez", "top-level.log")
+
+
+def test_listing_filters_window_and_uses_given_prefixes():
+    s3 = StubS3()
+    populate(s3, ["valdez"], 100, prefixes=4, start=START)
+
+    rows = list(listing.list_objects(s3, ["valdez"], START + timedelta(seconds=50),
+                                     {"valdez": ["host001/", "host002/"]}, workers=4))
+
+    assert {row["filename"].split("/")[0] for row in rows} == {"host001", "host002"}
+    assert all(row["uploaded"] >= START + timedelta(seconds=50) for row in rows)
+    assert rows[0]["size"] == 1024 and rows[0]["storageclass"] == "STANDARD"
+
+
+def test_single_large_shard_is_streamed_with_bounded_buffering():
+    # A flat bucket whose keys have no "/" is one shard: pages must not pile up
+    # while the consumer is slow
+    s3 = StubS3(page_size=10)
+    for n in range(1000):
+        s3.add_object("flat", f"file-{n:04d}.log", START)
+
+    rows = listing.list_objects(s3, ["flat"], START, None, workers=8)
+    first = next(rows)
+    time.sleep(0.2)
+    assert s3.calls["list_objects_v2"] <= listing.QUEUE_PAGES + 2
+
+    assert first["filename"] == "file-0000.log"
+    assert len(list(rows)) == 999
+    assert s3.calls["list_objects_v2"] == 100
+
+
+def test_abandoned_listing_stops_fetching():
+    s3 = StubS3(page_size=10)
+    populate(s3, ["valdez", "vegas"], 500, prefixes=5, start=START)
+
+    rows = listing.list_objects(s3, ["valdez", "vegas"], START, None, workers=4)
+    next(rows)
+    rows.close()
+    fetched = s3.calls["list_objects_v2"]
+    time.sleep(0.1)
+    assert s3.calls["list_objects_v2"] == fetched < 100
@@ -0,0 +1,275 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("botocore")
+
+import presign_url
+from tests.stub_s3 import StubS3, client_error
+from tests.stub_aws import StubSSM
+
+PARAM = "/tripoli/buckets"
+VALDEZ = {"bucket": "valdez-logs", "datacenter": "valdez", "keyLayout": "flat"}
+VEGAS = {"bucket": "vegas-logs", "datacenter": "vegas", "keyLayout": "flat"}
+
+
+class FlakySSM(StubSSM):
+    # Raises `error` from get_parameter while it is set
+    error = None
+
+    def get_parameter(self, Name, **kwargs):
+        if self.error:
+            self._call("get_parameter")
+            raise self.error
+        return super().get_parameter(Name, **kwargs)
+
+
+@pytest.fixture
+def ssm(monkeypatch):
+    ssm = FlakySSM({PARAM: {"id-valdez": VALDEZ}})
+    monkeypatch.setitem(presign_url.clients, "ssm", ssm)
+    presign_url.bucketMapCache.update({"map": None, "version": None, "expires": 0.0, "lastRefresh": 0.0})
+    monkeypatch.setattr(presign_url, "cacheStats", dict.fromkeys(presign_url.cacheStats, 0))
+    # The cache runs on a clock the tests move by hand
+    ssm.now = 1000.0
+    monkeypatch.setattr(presign_url, "time", SimpleNamespace(
+        monotonic=lambda: ssm.now, perf_counter=presign_url.time.perf_counter))
+    return ssm
+
+
+@pytest.fixture
+def api(ssm, monkeypatch):
+    for name, value in {"SSM_logBucketMap_PARAM": PARAM, "AWS_ACCESS_KEY_ID": "AKIDEXAMPLE",
+                        "AWS_SECRET_ACCESS_KEY": "secret", "AWS_REGION": "us-east-1",
+                        "PRESIGN_SIGNER": "stdlib"}.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.delenv("AWS_SESSION_TOKEN", raising=False)
+    monkeypatch.delenv("CHECKSUM_INDEX_TABLE", raising=False)
+
+    def call(resource, body):
+        resp = presign_url.main({"resource": resource, "requestContext": {"identity": {"apiKeyId": "id-valdez"}},
+                                 "body": json.dumps(body)}, None)
+        return resp["statusCode"], json.loads(resp["body"])
+    return call
+
+
+def lookup(ssm, keyID, after=0.0):
+    ssm.now += after
+    return presign_url.lookup_bucket(PARAM, keyID)
+
+
+def test_map_is_cached_until_the_ttl_runs_out(ssm):
+    assert lookup(ssm, "id-valdez") == VALDEZ
+    assert lookup(ssm, "id-valdez", presign_url.CACHE_TTL_SECONDS - 1) == VALDEZ
+    assert ssm.calls == {"get_parameter": 1}
+
+    assert lookup(ssm, "id-valdez", 1) == VALDEZ
+    assert ssm.calls == {"get_parameter": 2}
+    stats = presign_url.get_cache_stats()
+    assert (stats["hits"], stats["misses"], stats["refreshes"]) == (1, 2, 2)
+    # Same Version: the JSON was parsed only once
+    assert stats["reparses"] == 1
+
+
+def test_version_change_alone_triggers_a_reparse(ssm):
+    lookup(ssm, "id-valdez")
+    cached = presign_url.bucketMapCache["map"]
+
+    # Same value written again, only the Version moves
+    ssm.put_parameter(PARAM, {"id-valdez": VALDEZ})
+    lookup(ssm, "id-valdez", presign_url.CACHE_TTL_SECONDS)
+    assert presign_url.bucketMapCache["version"] == 2
+    assert presign_url.bucketMapCache["map"] is not cached
+    assert presign_url.get_cache_stats()["reparses"] == 2
+
+
+def test_unknown_key_rechecks_early_at_most_every_min_refresh(ssm):
+    lookup(ssm, "id-valdez")
+    ssm.put_parameter(PARAM, {"id-valdez": VALDEZ, "id-vegas": VEGAS})
+
+    # Right after a refresh the unknown key is turned away without asking SSM
+    assert lookup(ssm, "id-vegas", presign_url.CACHE_MIN_REFRESH_SECONDS - 1) is None
+    assert ssm.calls == {"get_parameter": 1}
+
+    # Once the minimum gap has passed it re-checks well before the TTL
+    assert lookup(ssm, "id-vegas", 1) == VEGAS
+    assert ssm.calls == {"get_parameter": 2}
+
+    # A key that stays unknown is rate limited too
+    assert lookup(ssm, "id-bogus") is None
+    assert lookup(ssm, "id-bogus", presign_url.CACHE_MIN_REFRESH_SECONDS - 1) is None
+    assert ssm.calls == {"get_parameter": 2}
+    assert lookup(ssm, "id-bogus", 1) is None
+    assert ssm.calls == {"get_parameter": 3}
+
+
+def test_stale_map_is_served_while_ssm_throttles(ssm):
+    lookup(ssm, "id-valdez")
+    ssm.error = client_error("ThrottlingException", "GetParameter")
+
+    assert lookup(ssm, "id-valdez", presign_url.CACHE_TTL_SECONDS) == VALDEZ
+    assert presign_url.get_cache_stats()["staleServed"] == 1
+    # Backs off instead of asking again on every request
+    assert lookup(ssm, "id-valdez", presign_url.CACHE_THROTTLE_BACKOFF_SECONDS - 1) == VALDEZ
+    assert ssm.calls == {"get_parameter": 2}
+
+    ssm.error = None
+    assert lookup(ssm, "id-valdez", 1) == VALDEZ
+    assert ssm.calls == {"get_parameter": 3}
+    assert presign_url.bucketMapCache["expires"] == ssm.now + presign_url.CACHE_TTL_SECONDS
+
+
+def test_throttling_without_a_cached_map_is_an_error(ssm):
+    ssm.error = client_error("ThrottlingException", "GetParameter")
+    with pytest.raises(Exception) as excinfo:
+        lookup(ssm, "id-valdez")
+    assert excinfo.value.response["Error"]["Code"] == "ThrottlingException"
+
+
+def test_gen_urls_caps_the_batch_size(api, monkeypatch):
+    monkeypatch.setenv("BATCH_MAX_KEYS", "3")
+    status, body = api("/gen-urls", {"keys": ["a.log", "b.log", "c.log"]})
+    assert status == 200 and [url["key"] for url in body["urls"]] == ["a.log", "b.log", "c.log"]
+
+    status, body = api("/gen-urls", {"keys": ["a.log", "b.log", "c.log", "d.log"]})
+    assert status == 400 and body == {"error": "Too many keys, limit is 3 per request"}
+
+
+@pytest.mark.parametrize("keys", [None, [], "a.log", {"key": "a.log"}])
+def test_gen_urls_needs_a_keys_list(api, keys):
+    status, body = api("/gen-urls", {} if keys is None else {"keys": keys})
+    assert status == 400 and body == {"error": "Missing keys list in request"}
+
+
+def test_gen_urls_reports_bad_keys_next_to_signed_ones(api):
+    status, body = api("/gen-urls", {"keys": [
+        "a.log", "a.log", "", 42, None, {"size": 3}, {"key": ["b.log"]}, "x" * 1025, "b.log"]})
+
+    assert status == 200 and body["bucket"] == "valdez-logs" and body["stored"] == []
+    assert [url["key"] for url in body["urls"]] == ["a.log", "b.log"]
+    assert all(url["url"].startswith("https://valdez-logs.s3.amazonaws.com/") for url in body["urls"])
+    assert body["errors"] == [
+        {"key": "a.log", "error": "Duplicate key in request"},
+        {"key": "", "error": "Missing key in request"},
+        {"key": 42, "error": "Missing key in request"},
+        {"key": None, "error": "Missing key in request"},
+        {"key": None, "error": "Missing key in request"},
+        {"key": ["b.log"], "error": "Missing key in request"},
+        {"key": "x" * 1025, "error": "Key longer than 1024 bytes"}
+    ]
+
+
+def test_gen_urls_signing_failure_fails_only_that_key(api, monkeypatch):
+    presign_put = presign_url.presign_put
+
+    def flaky_presign_put(entry, key, metrics=None, checksum=None):
+        if key == "b.log":
+            raise RuntimeError("signing failed")
+        return presign_put(entry, key, metrics, checksum)
+    monkeypatch.setattr(presign_url, "presign_put", flaky_presign_put)
+
+    status, body = api("/gen-urls", {"keys": ["a.log", "b.log", "c.log"]})
+    assert status == 200
+    assert [url["key"] for url in body["urls"]] == ["a.log", "c.log"]
+    assert body["errors"] == [{"key": "b.log", "error": "signing failed"}]
+
+
+class FailingS3(StubS3):
+    # Multipart calls fail with `error` while it is set
+    error = None
+
+    def complete_multipart_upload(self, **kwargs):
+        if self.error:
+            raise self.error
+        return super().complete_multipart_upload(**kwargs)
+
+    def abort_multipart_upload(self, **kwargs):
+        if self.error:
+            raise self.error
+        return super().abort_multipart_upload(**kwargs)
+
+
+def s3_error(code, status):
+    from botocore.exceptions import ClientError
+    return ClientError({"Error": {"Code": code, "Message": f"{code} message"},
+                        "ResponseMetadata": {"HTTPStatusCode": status}}, "CompleteMultipartUpload")
+
+
+@pytest.fixture
+def s3(api, monkeypatch):
+    s3 = FailingS3()
+    monkeypatch.setitem(presign_url.clients, "s3", s3)
+    return s3
+
+
+def sign_parts(api, **body):
+    return api("/multipart/sign-parts", {"key": "big.log", "uploadId": "upload-1", **body})
+
+
+def test_sign_parts_from_a_part_count(api, monkeypatch):
+    monkeypatch.setenv("BATCH_MAX_KEYS", "4")
+    status, body = sign_parts(api, partCount=4)
+    assert status == 200 and body["errors"] == []
+    assert [url["partNumber"] for url in body["urls"]] == [1, 2, 3, 4]
+    assert all("partNumber=" in url["url"] and "uploadId=upload-1" in url["url"] for url in body["urls"])
+
+    for partCount in [0, -1, 5, "4", 2.0, None]:
+        status, body = sign_parts(api, partCount=partCount)
+        assert status == 400 and body == {"error": "Missing partNumbers or partCount (1-4) in request"}
+
+
+def test_sign_parts_checks_each_part_number(api, monkeypatch):
+    status, body = sign_parts(api, partNumbers=[1, 10000, 0, 10001, -3, "2", 2.0, True, None])
+    assert status == 200
+    assert [url["partNumber"] for url in body["urls"]] == [1, 10000]
+    assert [error["partNumber"] for error in body["errors"]] == [0, 10001, -3, "2", 2.0, True, None]
+    assert {error["error"] for error in body["errors"]} == {"Part number must be 1-10000"}
+
+    # The list wins over partCount, and is capped like a batch
+    status, body = sign_parts(api, partNumbers=[7], partCount=3)
+    assert [url["partNumber"] for url in body["urls"]] == [7]
+    monkeypatch.setenv("BATCH_MAX_KEYS", "2")
+    status, body = sign_parts(api, partNumbers=[1, 2, 3])
+    assert status == 400 and body == {"error": "Too many parts, limit is 2 per request"}
+    status, body = sign_parts(api, partNumbers=[])
+    assert status == 400
+
+
+def test_sign_parts_needs_an_upload_id(api):
+    status, body = api("/multipart/sign-parts", {"key": "big.log", "partCount": 1})
+    assert status == 400 and body == {"error": "Missing uploadId in request"}
+
+
+def test_complete_assembles_the_parts_in_order(api, s3):
+    uploadId = s3.create_multipart_upload(Bucket="valdez-logs", Key="big.log")["UploadId"]
+    for partNumber, data in [(1, b"first "), (2, b"second")]:
+        s3.upload_part(Bucket="valdez-logs", Key="big.log", UploadId=uploadId, PartNumber=partNumber, Body=data)
+
+    status, body = api("/multipart/complete", {"key": "big.log", "uploadId": uploadId, "parts": [
+        {"partNumber": 2, "etag": "e2"}, {"partNumber": "1", "etag": "e1"}]})
+    assert status == 200 and body["key"] == "big.log" and body["etag"].endswith('-2"')
+    assert s3.buckets["valdez-logs"]["big.log"][3] == b"first second"
+
+
+@pytest.mark.parametrize("parts", [None, [], [{"etag": "e1"}], [{"partNumber": "one", "etag": "e1"}], ["e1"]])
+def test_complete_rejects_bad_parts(api, s3, parts):
+    status, body = api("/multipart/complete", {"key": "big.log", "uploadId": "upload-1", "parts": parts})
+    assert status == 400 and "error" in body
+    assert s3.calls == {}
+
+
+@pytest.mark.parametrize("resource", ["/multipart/complete", "/multipart/abort"])
+@pytest.mark.parametrize("code,s3Status,status", [
+    ("NoSuchUpload", 404, 404),
+    ("InvalidPart", 400, 400),
+    ("AccessDenied", 403, 403),
+    ("InternalError", 500, 502),
+    ("SlowDown", 503, 502)
+])
+def test_s3_errors_map_to_client_or_gateway_errors(api, s3, resource, code, s3Status, status):
+    s3.error = s3_error(code, s3Status)
+    respStatus, body = api(resource, {"key": "big.log", "uploadId": "upload-1",
+                                      "parts": [{"partNumber": 1, "etag": "e1"}]})
+    assert respStatus == status
+    assert body == {"error": code, "message": f"{code} message"}
@@ -0,0 +1,121 @@
+import gzip
+import json
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+from report_dataset import PartitionedJsonWriter, ReportSummary, format_summary, partition_count, truncate_utf8
+from tests.stub_s3 import StubS3
+from tests.stub_aws import StubSNS, StubSSM
+
+START = datetime(2024, 3, 1, 0, 30, tzinfo = timezone.utc)
+
+
+def row(bucket_name, key, uploaded, size = 10):
+    return {"bucketname": bucket_name, "filename": key, "uploaded": uploaded, "size": size,
+            "storageclass": "STANDARD", "bundle": ""}
+
+
+def read_lines(s3, bucket_name, key):
+    return [json.loads(line) for line in gzip.decompress(s3.buckets[bucket_name][key][3]).splitlines()]
+
+
+def test_partitions_roll_over_when_too_many_are_open():
+    s3 = StubS3()
+    with PartitionedJsonWriter(s3, "out", "report-x/", max_open = 1) as writer:
+        for n, dc in enumerate(["valdez", "vegas", "valdez"]):
+            writer.write(dc, row(f"{dc}-logs", f"file-{n}.log", START + timedelta(minutes = n)))
+
+    keys = [f["key"] for f in writer.files]
+    assert keys == ["report-x/datacenter=valdez/hour=2024-03-01-00/part-0000.jsonl.gz",
+                    "report-x/datacenter=valdez/hour=2024-03-01-00/part-0001.jsonl.gz",
+                    "report-x/datacenter=vegas/hour=2024-03-01-00/part-0000.jsonl.gz"]
+    assert [line["key"] for line in read_lines(s3, "out", keys[1])] == ["file-2.log"]
+    assert read_lines(s3, "out", keys[2])[0] == {
+        "bucket": "vegas-logs", "key": "file-1.log", "uploaded": "2024-03-01T00:31:00+00:00",
+        "size": 10, "storageClass": "STANDARD", "bundleLocation": ""}
+
+
+def test_interleaved_hours_stay_one_file_per_partition():
+    # A day of listing in key order: every key prefix holds all 25 hours
+    end = START + timedelta(hours = 24)
+    datacenters = ["valdez", "vegas"]
+    s3 = StubS3()
+    max_open = partition_count(datacenters, START, end)
+    assert max_open == 50
+    with PartitionedJsonWriter(s3, "out", "report-x/", max_open = max_open) as writer:
+        for host in range(3):
+            for n in range(25):
+                for dc in datacenters:
+                    uploaded = min(end, START + timedelta(hours = n, minutes = host))
+                    writer.write(dc, row(f"{dc}-logs", f"host-{host}/file-{n}.log", uploaded))
+
+    assert len(writer.files) == 50
+    assert all(f["key"].endswith("/part-0000.jsonl.gz") and f["objects"] == 3 for f in writer.files)
+
+
+def test_summary_counts_largest_and_gaps():
+    summary = ReportSummary(["valdez", "vegas"], START, START + timedelta(hours = 5), top = 2)
+    for n, size in enumerate([5, 50, 20]):
+        summary.add("valdez", row("valdez-logs", f"f{n}", START + timedelta(hours = 2, minutes = n), size))
+    doc = summary.to_dict()
+
+    valdez = doc["datacenters"]["valdez"]
+    assert (doc["objects"], doc["bytes"]) == (3, 75)
+    assert [f["key"] for f in valdez["largest"]] == ["f1", "f2"]
+    # Whole hours in the window are 01:00-05:00; valdez uploaded only in 02:00
+    assert [(g["start"][11:16], g["hours"]) for g in valdez["gaps"]] == [("01:00", 1), ("03:00", 2)]
+    assert doc["datacenters"]["vegas"]["gaps"] == [{"start": "2024-03-01T01:00:00+00:00",
+                                                    "end": "2024-03-01T05:00:00+00:00", "hours": 4}]
+    text = format_summary(doc)
+    assert "valdez: 3 objects, 75 B" in text and "vegas: 0 objects" in text
+
+
+def test_summary_text_is_cut_on_encoded_length():
+    # Keys with multi-byte characters: three bytes each, one character
+    text = "日本" * 100
+    cut = truncate_utf8(text, 101, "\n...")
+    assert len(cut.encode("utf-8")) <= 101
+    assert cut == "日本" * 16 + "\n..."
+    assert truncate_utf8(text, 600) == text
+
+
+@pytest.mark.parametrize("report_format", ["csv", "jsonl"])
+def test_reporter_writes_summary_and_links_it(monkeypatch, report_format):
+    pytest.importorskip("boto3")
+    import reporter
+
+    now = datetime.now(timezone.utc)
+    s3, sns = StubS3(), StubSNS()
+    ssm = StubSSM({"/tripoli/buckets": {
+        "key-valdez": {"bucket": "valdez-logs", "datacenter": "valdez", "keyLayout": "flat"},
+        "key-vegas": {"bucket": "vegas-logs", "datacenter": "vegas", "keyLayout": "flat"}
+    }})
+    for n in range(6):
+        s3.add_object("valdez-logs", f"host/file-{n}.log", now - timedelta(hours = n + 1), size = 100 * (n + 1))
+    monkeypatch.setattr(reporter, "clients", {"s3": s3, "sns": sns, "ssm": ssm})
+    monkeypatch.setattr(reporter.bucket_map, "cache", {})
+    for name, value in {
+        "OUTPUT_BUCKET_NAME": "reports", "REPORTER_SNS_ARN": "arn:sns", "CUTOFF_HOUR": "24",
+        "REPORT_URL_EXPIRATION_SECONDS": "3600", "SETTLE_SECONDS": "0", "BACKFILL_SELF_INVOKE": "false",
+        "REPORT_FORMAT": report_format
+    }.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.delenv("INDEX_TABLE_NAME", raising = False)
+
+    assert reporter.lambda_handler({}, None)["statusCode"] == 200
+
+    [summary_key] = [key for key in s3.buckets["reports"] if key.endswith("summary.json")]
+    summary = json.loads(s3.buckets["reports"][summary_key][3])
+    assert summary["datacenters"]["valdez"]["objects"] == 6
+    assert summary["datacenters"]["valdez"]["largest"][0]["key"] == "host/file-5.log"
+    assert summary["datacenters"]["vegas"]["gaps"][0]["hours"] >= 23
+    if report_format == "jsonl":
+        files = summary["dataset"]["files"]
+        assert len(files) == 6 and all("/datacenter=valdez/hour=" in f["key"] and f["url"] for f in files)
+    else:
+        assert summary["report"]["location"].endswith(".csv.gz")
+
+    message = sns.messages[0]["Message"]
+    assert "valdez: 6 objects, 2.1 KB" in message and "largest: host/file-5.log" in message
+    assert "vegas: 0 objects" in message and "no uploads for" in message
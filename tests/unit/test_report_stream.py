@@ -0,0 +1,63 @@
+import gzip
+import os
+
+from report_stream import S3GzipStream, MIN_PART_SIZE
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        self.objects[(Bucket, Key)] = Body
+
+    def create_multipart_upload(self, Bucket, Key, ContentType):
+        self.uploads["up-1"] = {}
+        return {"UploadId": "up-1"}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploads[UploadId][PartNumber] = Body
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        self.objects[(Bucket, Key)] = b"".join(parts[p["PartNumber"]] for p in MultipartUpload["Parts"])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId)
+
+
+def test_small_report_is_single_put():
+    s3 = FakeS3()
+    with S3GzipStream(s3, "out", "r.csv.gz", "application/gzip") as stream:
+        stream.write("a,b\r\n")
+
+    assert gzip.decompress(s3.objects[("out", "r.csv.gz")]) == b"a,b\r\n"
+    assert not s3.uploads
+
+
+def test_large_report_is_multipart_and_roundtrips():
+    s3 = FakeS3()
+    lines = [os.urandom(64).hex() + "\r\n" for _ in range(100000)]
+    with S3GzipStream(s3, "out", "r.csv.gz", "application/gzip", MIN_PART_SIZE) as stream:
+        for line in lines:
+            stream.write(line)
+            assert stream.buffer.tell() < MIN_PART_SIZE + 1024 * 1024
+
+    assert len(stream.parts) > 1
+    assert gzip.decompress(s3.objects[("out", "r.csv.gz")]).decode() == "".join(lines)
+
+
+def test_failure_aborts_multipart_upload():
+    s3 = FakeS3()
+    try:
+        with S3GzipStream(s3, "out", "r.csv.gz", "application/gzip", MIN_PART_SIZE) as stream:
+            for _ in range(100000):
+                stream.write(os.urandom(64).hex())
+            raise RuntimeError("listing failed")
+    except RuntimeError:
+        pass
+
+    assert not s3.uploads
+    assert ("out", "r.csv.gz") not in s3.objects
@@ -0,0 +1,167 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timezone, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("boto3")
+
+import indexer
+import reporter
+from tests.stub_s3 import StubS3
+from tests.stub_aws import StubLambda, StubSNS, StubSSM, StubTable, key_conditions
+
+DAY = datetime(2026, 10, 10, 11, 0, tzinfo=timezone.utc)
+CONTEXT = SimpleNamespace(invoked_function_arn="arn:aws:lambda:us-east-1:123:function:reporter:live")
+
+
+class RecordingTable(StubTable):
+    # Remembers the partition of every query
+    def __init__(self):
+        super().__init__()
+        self.queried = []
+
+    def query(self, KeyConditionExpression, **kwargs):
+        self.queried.append(key_conditions(KeyConditionExpression)[0][2][0])
+        return super().query(KeyConditionExpression=KeyConditionExpression, **kwargs)
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    s3, sns, lam, table = StubS3(), StubSNS(), StubLambda(), RecordingTable()
+    ssm = StubSSM({"/tripoli/buckets": {
+        "key-valdez": {"bucket": "valdez-logs", "datacenter": "valdez", "keyLayout": "flat"},
+        "key-vegas": {"bucket": "vegas-logs", "datacenter": "vegas", "keyLayout": "flat"}
+    }})
+    monkeypatch.setattr(reporter, "clients", {"s3": s3, "sns": sns, "ssm": ssm, "lambda": lam,
+                                              ("dynamodb", "uploads"): table})
+    monkeypatch.setattr(reporter.bucket_map, "cache", {})
+    for name, value in {
+        "OUTPUT_BUCKET_NAME": "reports", "REPORTER_SNS_ARN": "arn:sns", "CUTOFF_HOUR": "24",
+        "REPORT_URL_EXPIRATION_SECONDS": "3600", "SETTLE_SECONDS": "0", "INDEX_TABLE_NAME": "uploads"
+    }.items():
+        monkeypatch.setenv(name, value)
+
+    def upload(bucket_name, key, uploaded):
+        dc = bucket_name.split("-")[0]
+        table.put_item(Item={
+            "pk": indexer.index_partition(dc, uploaded),
+            "sk": indexer.index_sort_key(uploaded, bucket_name, key),
+            "bucket": bucket_name, "key": key, "size": 10, "uploaded": indexer.format_time(uploaded)
+        })
+
+    def run(now, context=None):
+        # Runs the reporter at `now`; returns (SNS message, reported keys, checkpoint)
+        monkeypatch.setattr(reporter, "datetime", type("FixedDatetime", (datetime,), {
+            "now": classmethod(lambda cls, tz=None: now)}))
+        table.queried.clear()
+        assert reporter.lambda_handler({}, context)["statusCode"] == 200
+        body = s3.buckets["reports"][f"report-{now}.csv.gz"][3]
+        rows = list(csv.reader(io.StringIO(gzip.decompress(body).decode())))[1:]
+        checkpoint = json.loads(s3.buckets["reports"]["state/reporter-checkpoint.json"][3])
+        return sns.messages[-1]["Message"], [row[1] for row in rows], checkpoint
+
+    return SimpleNamespace(upload=upload, run=run, table=table, lam=lam)
+
+
+def test_first_run_then_daily_run_is_not_a_backfill(aws):
+    # A quiet tail: the only upload is hours before the first run
+    aws.upload("valdez-logs", "old.log", DAY - timedelta(hours=23))
+    message, keys, checkpoint = aws.run(DAY)
+    assert keys == ["old.log"]
+    assert checkpoint == {"watermark": DAY.isoformat(), "lastKeys": {}}
+
+    aws.upload("vegas-logs", "new.log", DAY + timedelta(hours=5))
+    message, keys, checkpoint = aws.run(DAY + timedelta(days=1), CONTEXT)
+    assert keys == ["new.log"]
+    assert f"Uploads from {DAY} to {DAY + timedelta(days=1)}" in message
+    assert "Backfill" not in message and aws.lam.invocations == []
+
+
+def test_resume_queries_only_the_window_days(aws):
+    aws.upload("valdez-logs", "before.log", DAY - timedelta(days=3))
+    aws.upload("valdez-logs", "edge.log", DAY - timedelta(hours=24))
+    aws.upload("valdez-logs", "inside.log", DAY - timedelta(hours=1))
+    aws.upload("valdez-logs", "after.log", DAY + timedelta(minutes=1))
+
+    _, keys, _ = aws.run(DAY)
+    # The window is [DAY - 24h, DAY]; later uploads wait for the next run
+    assert keys == ["edge.log", "inside.log"]
+    assert sorted(aws.table.queried) == ["valdez#2026-10-09", "valdez#2026-10-10",
+                                         "vegas#2026-10-09", "vegas#2026-10-10"]
+
+    _, keys, _ = aws.run(DAY + timedelta(hours=2))
+    assert keys == ["after.log"]
+    assert sorted(aws.table.queried) == ["valdez#2026-10-10", "vegas#2026-10-10"]
+
+
+def test_uploads_tied_with_the_watermark_are_reported_once(aws):
+    aws.upload("valdez-logs", "a.log", DAY)
+    aws.upload("valdez-logs", "b.log", DAY)
+    _, keys, checkpoint = aws.run(DAY)
+    assert keys == ["a.log", "b.log"]
+    assert checkpoint["lastKeys"] == {"valdez-logs": "b.log"}
+
+    # A late index write at the same instant
+    aws.upload("valdez-logs", "c.log", DAY)
+    _, keys, checkpoint = aws.run(DAY + timedelta(hours=1))
+    assert keys == ["c.log"]
+    assert checkpoint == {"watermark": (DAY + timedelta(hours=1)).isoformat(), "lastKeys": {}}
+
+
+def test_missed_days_are_backfilled_with_self_invoke(aws):
+    aws.run(DAY)
+    for n in range(3):
+        aws.upload("valdez-logs", f"day-{n}.log", DAY + timedelta(days=n, hours=2))
+
+    message, keys, checkpoint = aws.run(DAY + timedelta(days=3), CONTEXT)
+    assert keys == ["day-0.log"]
+    assert checkpoint["watermark"] == (DAY + timedelta(days=1)).isoformat()
+    assert "Backfill in progress" in message
+    assert aws.lam.invocations == [{"FunctionName": CONTEXT.invoked_function_arn,
+                                    "Payload": json.dumps({"backfill": True})}]
+
+    _, keys, _ = aws.run(DAY + timedelta(days=3), CONTEXT)
+    assert keys == ["day-1.log"]
+    message, keys, _ = aws.run(DAY + timedelta(days=3), CONTEXT)
+    assert keys == ["day-2.log"] and "Backfill" not in message
+    assert len(aws.lam.invocations) == 2
+
+
+def test_run_overlapped_by_another_does_not_move_the_checkpoint(aws, monkeypatch):
+    aws.upload("valdez-logs", "a.log", DAY - timedelta(hours=2))
+    aws.run(DAY)
+    s3 = reporter.clients["s3"]
+    load = reporter.load_checkpoint
+
+    def overlapped(*args):
+        # Another run saves its checkpoint while this one is reporting
+        checkpoint = load(*args)
+        reporter.save_checkpoint(s3, "reports", "state/reporter-checkpoint.json",
+                                 {"watermark": DAY + timedelta(days=5), "lastKeys": {}}, checkpoint["etag"])
+        return checkpoint
+
+    monkeypatch.setattr(reporter, "load_checkpoint", overlapped)
+    _, _, checkpoint = aws.run(DAY + timedelta(days=3), CONTEXT)
+    assert checkpoint["watermark"] == (DAY + timedelta(days=5)).isoformat()
+    # Behind, but the chain is left to the run that holds the checkpoint
+    assert not aws.lam.invocations
+
+
+def test_index_listing_reads_only_the_window(aws):
+    start, end = DAY - timedelta(days = 2, hours = 1), DAY
+    for key, uploaded in [("before.log", start - timedelta(milliseconds = 1)), ("start.log", start),
+                          ("inside.log", DAY - timedelta(days = 1)), ("end.log", end),
+                          ("after.log", end + timedelta(milliseconds = 1)),
+                          ("tomorrow.log", DAY + timedelta(days = 1))]:
+        aws.upload("valdez-logs", key, uploaded)
+
+    counters = {"pages": 0, "scanned": 0}
+    rows = list(reporter.list_from_index(aws.table, ["valdez"], start, end, counters))
+    # Both edges are included; nothing outside the window is read
+    assert [row["filename"] for row in rows] == ["start.log", "inside.log", "end.log"]
+    assert counters["scanned"] == 3
+    assert aws.table.queried == ["valdez#2026-10-08", "valdez#2026-10-09", "valdez#2026-10-10"]
@@ -0,0 +1,133 @@
+import csv
+import gzip
+import io
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("boto3")
+
+import restorer
+from tests.stub_s3 import StubS3
+from tests.stub_aws import StubSNS, StubSQS, StubSSM, StubTable
+
+UPLOADED = datetime(2024, 3, 1, 2, 30, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    s3, sqs, sns, table = StubS3(), StubSQS(), StubSNS(), StubTable()
+    ssm = StubSSM({"/tripoli/buckets": {"key-valdez": {"bucket": "valdez-logs", "datacenter": "valdez",
+                                                       "keyLayout": "hourly", "region": "us-east-1"}}})
+    monkeypatch.setattr(restorer, "clients", {("s3", None): s3, ("sqs", None): sqs, ("sns", None): sns,
+                                              ("ssm", None): ssm, ("dynamodb", "restores"): table})
+    monkeypatch.setattr(restorer.bucket_map, "cache", {})
+    for name, value in {
+        "RESTORE_TABLE_NAME": "restores",
+        "RESTORE_QUEUE_URL": "https://sqs/restore",
+        "OUTPUT_BUCKET_NAME": "reports",
+        "REPORTER_SNS_ARN": "arn:sns",
+        "AWS_REGION": "us-east-1",
+        "RESTORE_OBJECTS_PER_MESSAGE": "3",
+        "RESTORE_REQUESTS_PER_SECOND": "1000"
+    }.items():
+        monkeypatch.setenv(name, value)
+
+    for n in range(7):
+        s3.add_object("valdez-logs", f"valdez/2024/03/01/02/app-{n}.log", UPLOADED, size=10,
+                      storage_class="DEEP_ARCHIVE" if n % 2 else "GLACIER")
+    s3.add_object("valdez-logs", "valdez/2024/03/01/02/recent.log", UPLOADED, size=10, storage_class="GLACIER_IR")
+    s3.add_object("valdez-logs", "_bundles/valdez/2024/03/01/02/bundle-1-0000.gz", UPLOADED, size=10,
+                  storage_class="GLACIER")
+    s3.add_object("valdez-logs", "valdez/2024/03/01/05/outside.log", UPLOADED, size=10, storage_class="GLACIER")
+    # Flat keys from before valdez switched to the hourly layout
+    s3.add_object("valdez-logs", "host-1/flat.log", UPLOADED, size=10, storage_class="DEEP_ARCHIVE")
+    s3.add_object("valdez-logs", "host-1/flat-outside.log", datetime(2024, 3, 1, 5, tzinfo=timezone.utc), size=10,
+                  storage_class="DEEP_ARCHIVE")
+    return s3, sqs, sns, table
+
+
+def test_bulk_restore_end_to_end(aws):
+    s3, sqs, sns, table = aws
+    resp = restorer.start_handler({"action": "start", "datacenter": "valdez", "start": "2024-03-01T02:00:00Z",
+                                   "end": "2024-03-01T03:00:00Z", "tier": "Expedited", "days": 3}, None)
+    assert resp["statusCode"] == 200
+    job = resp["body"]["job"]
+    assert resp["body"] == {"job": job, "total": 10, "queued": 9, "ready": 1}
+    assert len(sqs.messages) == 3
+
+    records = [{"messageId": m["messageId"], "body": m["body"]} for m in sqs.messages]
+    assert restorer.submit_handler({"Records": records}, None) == {"batchItemFailures": []}
+    # A redelivered message doesn't submit or count anything twice
+    assert restorer.submit_handler({"Records": records[:1]}, None) == {"batchItemFailures": []}
+    tiers = {key: r["request"]["GlacierJobParameters"]["Tier"] for (_, key), r in s3.restores.items()}
+    assert len(tiers) == 9
+    assert tiers["valdez/2024/03/01/02/app-1.log"] == "Standard"
+    assert tiers["host-1/flat.log"] == "Standard"
+    assert tiers["valdez/2024/03/01/02/app-0.log"] == "Expedited"
+
+    # One object finishes through its restore event, the rest are found by polling
+    for (bucket, key) in list(s3.restores):
+        s3.finish_restore(bucket, key)
+    event = {"detail-type": "Object Restore Completed", "detail": {
+        "bucket": {"name": "valdez-logs"}, "object": {"key": "valdez/2024/03/01/02/app-0.log"},
+        "restore-expiry-time": "2026-10-23T00:00:00Z"}}
+    assert restorer.track_handler(event, None) == {"marked": 1}
+    assert restorer.track_handler(event, None) == {"marked": 1}
+    assert not sns.messages
+    assert restorer.track_handler({"detail-type": "Scheduled Event"}, None) == {"polled": 8, "restored": 8}
+
+    status = restorer.start_handler({"action": "status", "job": job}, None)["body"]
+    assert status["status"] == "complete" and status["restored"] == 10 and status["submitted"] == 9
+    assert len(sns.messages) == 1 and sns.messages[0]["Subject"] == f"Restore {job} ready"
+
+    manifest = s3.buckets["reports"][restorer.manifest_key(job)][3]
+    rows = list(csv.DictReader(io.StringIO(gzip.decompress(manifest).decode())))
+    assert len(rows) == 10 and all(row["Url"] and row["Status"] == "restored" for row in rows)
+    assert "outside.log" not in "".join(row["File_Name"] for row in rows)
+    assert "host-1/flat.log" in [row["File_Name"] for row in rows]
+
+
+def test_rejects_bad_requests(aws):
+    assert restorer.start_handler({"action": "start", "datacenter": "nowhere", "prefix": "x"}, None)["statusCode"] == 400
+    assert restorer.start_handler({"action": "start", "datacenter": "valdez"}, None)["statusCode"] == 400
+    assert restorer.start_handler({"action": "start", "datacenter": "valdez", "prefix": "valdez/",
+                                   "tier": "Fast"}, None)["statusCode"] == 400
+
+
+def test_poll_continues_where_the_last_run_stopped(aws):
+    s3, sqs, sns, table = aws
+    job = restorer.start_handler({"action": "start", "datacenter": "valdez", "start": "2024-03-01T02:00:00Z",
+                                  "end": "2024-03-01T03:00:00Z"}, None)["body"]["job"]
+    restorer.submit_handler({"Records": [{"messageId": m["messageId"], "body": m["body"]} for m in sqs.messages]},
+                            None)
+    for (bucket, key) in list(s3.restores):
+        s3.finish_restore(bucket, key)
+
+    # Seconds left per call: the job's share is taken at 100, then three objects
+    # fit before the time drops under the 20 s margin
+    left = [100, 100, 100, 100, 10]
+    context = SimpleNamespace(get_remaining_time_in_millis=lambda: (left.pop(0) if len(left) > 1 else left[0]) * 1000)
+    assert restorer.track_handler({"detail-type": "Scheduled Event"}, context) == {"polled": 3, "restored": 3}
+    cursor = table.get_item(Key=restorer.job_key(job))["Item"]["pollCursor"]
+    assert cursor == "obj#valdez-logs/valdez/2024/03/01/02/app-0.log"
+
+    # The next run starts after the cursor, and the job completes
+    assert restorer.track_handler({"detail-type": "Scheduled Event"}, None) == {"polled": 6, "restored": 6}
+    item = table.get_item(Key=restorer.job_key(job))["Item"]
+    assert item["status"] == "complete"
+    assert len(sns.messages) == 1
+
+
+def test_listing_stops_past_the_object_limit(aws, monkeypatch):
+    s3, sqs, sns, table = aws
+    monkeypatch.setenv("RESTORE_MAX_OBJECTS", "3")
+    seen = []
+    rows = restorer.matching_objects
+    monkeypatch.setattr(restorer, "matching_objects",
+                        lambda *args: (seen.append(row) or row for row in rows(*args)))
+    resp = restorer.start_handler({"action": "start", "datacenter": "valdez", "start": "2024-03-01T02:00:00Z",
+                                   "end": "2024-03-01T03:00:00Z"}, None)
+    assert resp == {"statusCode": 400, "body": {"error": "More than 3 objects match, the limit per job; narrow the range"}}
+    assert len(seen) == 4 and not sqs.messages
@@ -0,0 +1,79 @@
+import random
+from datetime import datetime, timezone
+
+import pytest
+
+import sigv4
+
+boto3 = pytest.importorskip("boto3")
+from botocore.config import Config
+
+NOW = datetime(2026, 10, 18, 6, 3, 11, tzinfo=timezone.utc)
+BUCKET = "tripolistack-tripolivaldezlogbucket-1a2b3c4d"
+CHARS = "abcXYZ019 /+=!'()*~_-.é漢%&?#@$,;:[]{}|\\^`\"<>"
+
+
+@pytest.fixture(params=[None, "IQoJb3JpZ2luX2Vj/+=token"])
+def clients(request, monkeypatch):
+    import botocore.auth
+    monkeypatch.setattr(botocore.auth, "get_current_datetime",
+                        lambda *args, **kwargs: NOW.replace(tzinfo=None))
+    credentials = {"accessKey": "AKIDEXAMPLE", "secretKey": "wJalr/XUtnFEMI+K7MDENG", "token": request.param}
+    session = boto3.session.Session(aws_access_key_id=credentials["accessKey"],
+                                    aws_secret_access_key=credentials["secretKey"],
+                                    aws_session_token=credentials["token"],
+                                    region_name="eu-central-1")
+    return session.client("s3", config=Config(signature_version="s3v4")), credentials
+
+
+def test_put_and_upload_part_urls_match_boto3(clients):
+    s3, credentials = clients
+    rng = random.Random(7)
+    for n in range(200):
+        key = "".join(rng.choice(CHARS) for _ in range(rng.randint(1, 40)))
+        assert sigv4.presign_s3("PUT", BUCKET, key, "eu-central-1", credentials, 3600, now=NOW) == \
+            s3.generate_presigned_url("put_object", Params={"Bucket": BUCKET, "Key": key}, ExpiresIn=3600)
+
+        params = {"uploadId": "x/y+z=", "partNumber": n + 1}
+        assert sigv4.presign_s3("PUT", BUCKET, key, "eu-central-1", credentials, 900, params=params, now=NOW) == \
+            s3.generate_presigned_url("upload_part", ExpiresIn=900, Params={
+                "Bucket": BUCKET, "Key": key, "UploadId": "x/y+z=", "PartNumber": n + 1})
+
+
+def test_virtual_hostable_buckets():
+    assert sigv4.virtual_hostable(BUCKET)
+    assert not sigv4.virtual_hostable("with.dots")
+    assert not sigv4.virtual_hostable("Upper")
+    assert not sigv4.virtual_hostable("ab")
+    assert not sigv4.virtual_hostable("192.168.1.1")
+
+
+@pytest.mark.parametrize("endpoint,s3_options", [
+    (sigv4.REGIONAL, {"addressing_style": "virtual", "us_east_1_regional_endpoint": "regional"}),
+    (sigv4.ACCELERATE, {"use_accelerate_endpoint": True})
+])
+@pytest.mark.parametrize("region", ["us-east-1", "ap-southeast-2"])
+def test_regional_and_accelerated_urls_match_boto3(clients, endpoint, s3_options, region):
+    _, credentials = clients
+    session = boto3.session.Session(aws_access_key_id=credentials["accessKey"],
+                                    aws_secret_access_key=credentials["secretKey"],
+                                    aws_session_token=credentials["token"],
+                                    region_name=region)
+    s3 = session.client("s3", config=Config(signature_version="s3v4", s3=s3_options))
+    host = sigv4.endpoint_host(BUCKET, region, endpoint)
+    for key in ["app.log", "valdez/2026/10/18/06/rack 1/app+1.log"]:
+        assert sigv4.presign_s3("PUT", BUCKET, key, region, credentials, 3600, host=host, now=NOW) == \
+            s3.generate_presigned_url("put_object", Params={"Bucket": BUCKET, "Key": key}, ExpiresIn=3600)
+
+
+@pytest.mark.parametrize("header,param,value", [
+    ("x-amz-checksum-sha256", "ChecksumSHA256", "n4bQgYhMfWWaL+qgxVrQFaO/TxsrC4Is0V1sFbDwCgg="),
+    ("x-amz-checksum-crc32c", "ChecksumCRC32C", "yZRlqg==")
+])
+def test_checksum_header_urls_match_boto3(clients, header, param, value):
+    s3, credentials = clients
+    for key in ["app.log", "valdez/2026/10/18/06/rack 1/app+1.log"]:
+        assert sigv4.presign_s3("PUT", BUCKET, key, "eu-central-1", credentials, 3600,
+                                headers={header: value}, now=NOW) == \
+            s3.generate_presigned_url("put_object", Params={"Bucket": BUCKET, "Key": key, param: value},
+                                      ExpiresIn=3600)
@@ -1,15 +1,319 @@
+import json
+import os
+import pytest
+
 import aws_cdk as core
 import aws_cdk.assertions as assertions
 
-from tripoli.tripoli_stack import TripoliStack
+from tripoli.tripoli_stack import REPORTSUB, TripoliStack
 
-# example tests. To run these tests, uncomment this file along with the example
-# resource in tripoli/tripoli_stack.py
-def test_sqs_queue_created():
+
+@pytest.fixture(scope="module")
+def template():
+    # The default stack, synthesized once for every test that only reads it
     app = core.App()
-    stack = TripoliStack(app, "tripoli")
-    template = assertions.Template.from_stack(stack)
+    return assertions.Template.from_stack(TripoliStack(app, "tripoli"))
+
 
+# example tests. To run these tests, uncomment this file along with the example
+# resource in tripoli/tripoli_stack.py
+def test_sqs_queue_created(template):
+    pass
 #     template.has_resource_properties("AWS::SQS::Queue", {
 #         "VisibilityTimeout": 300
 #     })
+
+
+def test_presign_api_resources(template):
+    template.has_resource_properties("AWS::ApiGateway::Resource", {
+        "PathPart": "gen-url"
+    })
+    template.has_resource_properties("AWS::ApiGateway::Resource", {
+        "PathPart": "gen-urls"
+    })
+
+
+def test_log_buckets_abort_incomplete_multipart_uploads(template):
+    template.has_resource_properties("AWS::S3::Bucket", {
+        "LifecycleConfiguration": {
+            "Rules": assertions.Match.array_with([
+                assertions.Match.object_like({
+                    "AbortIncompleteMultipartUpload": {"DaysAfterInitiation": 7}
+                })
+            ])
+        }
+    })
+    for action in ["initiate", "sign-parts", "complete", "abort"]:
+        template.has_resource_properties("AWS::ApiGateway::Resource", {
+            "PathPart": action
+        })
+
+
+def test_upload_index_feeds_reporter(template):
+    template.has_resource_properties("AWS::DynamoDB::Table", {
+        "KeySchema": [
+            {"AttributeName": "pk", "KeyType": "HASH"},
+            {"AttributeName": "sk", "KeyType": "RANGE"}
+        ],
+        "TimeToLiveSpecification": {"AttributeName": "expires", "Enabled": True}
+    })
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "indexer.lambda_handler"
+    })
+    template.resource_count_is("Custom::S3BucketNotifications", 2)
+
+
+def test_presign_reads_checksum_index(template):
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "presign_url.main",
+        "Environment": {"Variables": assertions.Match.object_like({
+            "CHECKSUM_INDEX_TABLE": assertions.Match.any_value()
+        })}
+    })
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "indexer.lambda_handler",
+        "Environment": {"Variables": assertions.Match.object_like({"CHECKSUM_INDEX": "true"})}
+    })
+    template.has_resource_properties("AWS::IAM::Policy", {
+        "PolicyDocument": {"Statement": assertions.Match.array_with([
+            assertions.Match.object_like({
+                "Action": assertions.Match.array_with(["dynamodb:BatchGetItem"])
+            })
+        ])},
+        "Roles": [{"Ref": assertions.Match.string_like_regexp("TripoliLambdaPresignURLServiceRole")}]
+    })
+
+
+def test_reporter_knows_key_layouts(template):
+    # The reporter reads buckets and key layouts from the presign SSM map
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "reporter.lambda_handler",
+        "Environment": {
+            "Variables": assertions.Match.object_like({"SSM_logBucketMap_PARAM": "/tripoli/buckets"})
+        }
+    })
+    [param] = template.find_resources("AWS::SSM::Parameter").values()
+    bucketMap = json.dumps(param["Properties"]["Value"])
+    # Datacenters keep flat keys unless they opt into the hourly layout
+    assert bucketMap.count('\\"keyLayout\\": \\"flat\\"') == 2
+
+
+def test_reporter_scan_time_alarm(template):
+    template.has_resource_properties("AWS::CloudWatch::Alarm", {
+        "ComparisonOperator": "GreaterThanOrEqualToThreshold",
+        "Threshold": 240000,
+        "Metrics": [assertions.Match.object_like({
+            "MetricStat": assertions.Match.object_like({
+                "Metric": assertions.Match.object_like({"Namespace": "Tripoli", "MetricName": "ScanTime"}),
+                "Stat": "Maximum"
+            })
+        })]
+    })
+    for handler in ["presign_url.main", "reporter.lambda_handler"]:
+        template.has_resource_properties("AWS::Lambda::Function", {
+            "Handler": handler,
+            "Environment": {
+                "Variables": assertions.Match.object_like({"METRICS_NAMESPACE": "Tripoli"})
+            }
+        })
+
+
+def test_request_metrics_for_every_datacenter(template):
+    buckets = template.find_resources("AWS::S3::Bucket", {
+        "Properties": {"MetricsConfigurations": [{"Id": "EntireBucket"}]}
+    })
+    assert len(buckets) == 2
+    alarms = template.find_resources("AWS::CloudWatch::Alarm", {
+        "Properties": {"Threshold": 5000, "ComparisonOperator": "GreaterThanThreshold"}
+    })
+    assert len(alarms) == 2
+
+
+def test_datacenter_in_another_region_with_acceleration():
+    app = core.App(context={"tripoli:datacenters": {
+        "valdez": {},
+        "vegas": {"region": "ap-southeast-2", "accelerate": True}
+    }})
+    stack = TripoliStack(app, "tripoli", env=core.Environment(account="123456789012", region="us-east-1"))
+    template = assertions.Template.from_stack(stack)
+    regional = assertions.Template.from_stack(app.node.find_child("tripoli-vegas"))
+
+    regional.has_resource_properties("AWS::S3::Bucket", {
+        "AccelerateConfiguration": {"AccelerationStatus": "Enabled"}
+    })
+    regional.resource_count_is("AWS::CloudWatch::Alarm", 1)
+    # The regional alarm topic has its own name and is mailed like the main one
+    [topic] = regional.find_resources("AWS::SNS::Topic").values()
+    assert "TopicName" not in topic.get("Properties", {})
+    regional.has_resource_properties("AWS::SNS::Subscription", {"Protocol": "email", "Endpoint": REPORTSUB})
+    template.has_resource_properties("AWS::SNS::Topic", {"TopicName": "tripolis-alarm"})
+    template.resource_count_is("AWS::S3::Bucket", 3)
+    # Only the local bucket notifies the indexer, the reporter lists the other one
+    template.resource_count_is("Custom::S3BucketNotifications", 1)
+
+    [param] = template.find_resources("AWS::SSM::Parameter").values()
+    bucketMap = json.dumps(param["Properties"]["Value"])
+    assert '\\"region\\": \\"ap-southeast-2\\", \\"endpoint\\": \\"accelerate\\"' in bucketMap
+    assert '\\"region\\": \\"us-east-1\\", \\"endpoint\\": \\"regional\\"' in bucketMap
+
+
+def test_content_indexer_fed_by_object_created_events(template):
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "content_indexer.lambda_handler"
+    })
+    template.has_resource_properties("AWS::Events::Rule", {
+        "EventPattern": assertions.Match.object_like({"source": ["aws.s3"], "detail-type": ["Object Created"]})
+    })
+    template.has_resource_properties("AWS::Lambda::EventSourceMapping", {
+        "FunctionResponseTypes": ["ReportBatchItemFailures"]
+    })
+    template.has_resource_properties("AWS::Events::Rule", {
+        "ScheduleExpression": "rate(10 minutes)",
+        "Targets": [assertions.Match.object_like({"Input": '{"merge":true}'})]
+    })
+
+
+def test_restore_pipeline_is_rate_limited(template):
+    for handler in ["restorer.start_handler", "restorer.submit_handler", "restorer.track_handler"]:
+        template.has_resource_properties("AWS::Lambda::Function", {"Handler": handler})
+    template.has_resource_properties("AWS::Lambda::EventSourceMapping", {
+        "ScalingConfig": {"MaximumConcurrency": 2},
+        "FunctionResponseTypes": ["ReportBatchItemFailures"]
+    })
+    template.has_resource_properties("AWS::Events::Rule", {
+        "EventPattern": assertions.Match.object_like({"detail-type": ["Object Restore Completed"]})
+    })
+    template.has_resource_properties("AWS::IAM::Policy", {
+        "PolicyDocument": {"Statement": assertions.Match.array_with([
+            assertions.Match.object_like({"Action": "s3:RestoreObject"})
+        ])}
+    })
+
+
+def test_lambda_profiles_deployed():
+    # What cdk deploy builds: the defaults with the overrides in cdk.json
+    with open(os.path.join(os.path.dirname(__file__), "..", "..", "cdk.json")) as f:
+        profiles = json.load(f)["context"]["tripoli:lambdaProfiles"]
+    app = core.App(context={"tripoli:lambdaProfiles": profiles})
+    template = assertions.Template.from_stack(TripoliStack(app, "tripoli"))
+
+    for handler, memory, timeout, reserved in [("presign_url.main", 512, 30, assertions.Match.absent()),
+                                               ("reporter.lambda_handler", 1024, 300, 1)]:
+        template.has_resource_properties("AWS::Lambda::Function", {
+            "Handler": handler,
+            "MemorySize": memory,
+            "Timeout": timeout,
+            "Architectures": ["arm64"],
+            "EphemeralStorage": {"Size": 512},
+            "ReservedConcurrentExecutions": reserved
+        })
+    # Only the presign function has provisioned concurrency
+    [alias] = template.find_resources("AWS::Lambda::Alias").values()
+    assert alias["Properties"]["ProvisionedConcurrencyConfig"] == {"ProvisionedConcurrentExecutions": 2}
+    assert "PresignURL" in json.dumps(alias["Properties"]["FunctionName"])
+
+
+def test_lambda_profiles_from_context():
+    app = core.App(context={"tripoli:lambdaProfiles": {
+        "presign": {"memorySize": 1769, "reservedConcurrency": 50, "provisionedConcurrency": 5},
+        "reporter": {"architecture": "x86_64", "timeoutSeconds": 900, "ephemeralStorageMiB": 2048}
+    }})
+    stack = TripoliStack(app, "tripoli")
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "presign_url.main",
+        "MemorySize": 1769,
+        "Architectures": ["arm64"],
+        "ReservedConcurrentExecutions": 50
+    })
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "reporter.lambda_handler",
+        "Timeout": 900,
+        "Architectures": ["x86_64"],
+        "EphemeralStorage": {"Size": 2048}
+    })
+    # The scan-time alarm follows the reporter timeout
+    template.has_resource_properties("AWS::CloudWatch::Alarm", {"Threshold": 720000})
+
+    # Provisioned concurrency on the alias, and the API invokes the alias
+    template.has_resource_properties("AWS::Lambda::Alias", {
+        "Name": "live",
+        "ProvisionedConcurrencyConfig": {"ProvisionedConcurrentExecutions": 5}
+    })
+    alias_id = next(iter(template.find_resources("AWS::Lambda::Alias")))
+    methods = template.find_resources("AWS::ApiGateway::Method", {"Properties": {"HttpMethod": "POST"}})
+    assert methods and all(alias_id in json.dumps(method["Properties"]["Integration"]["Uri"])
+                           for method in methods.values())
+
+
+def test_lambda_profiles_rejected_at_synth():
+    for profiles in [
+        {"presign": {"memorySize": 64}},
+        {"reporter": {"timeoutSeconds": 1200}},
+        {"presign": {"architecture": "arm"}},
+        {"presign": {"memory": 512}},
+        {"presign": {"reservedConcurrency": 2, "provisionedConcurrency": 4}},
+        {"reporter": {"reservedConcurrency": 0}}
+    ]:
+        app = core.App(context={"tripoli:lambdaProfiles": profiles})
+        with pytest.raises(ValueError):
+            TripoliStack(app, "tripoli")
+
+
+def test_datacenters_from_config_with_usage_plan_throttling(tmp_path):
+    config = tmp_path / "datacenters.json"
+    config.write_text(json.dumps({
+        "valdez": {},
+        "vegas": {"keyLayout": "flat", "throttle": {"rateLimit": 20, "burstLimit": 40}},
+        "reno": {"throttle": None, "quota": {"limit": 100000, "period": "DAY"}}
+    }))
+    app = core.App(context={"tripoli:datacenters": str(config)})
+    stack = TripoliStack(app, "tripoli")
+    template = assertions.Template.from_stack(stack)
+
+    template.resource_count_is("AWS::ApiGateway::UsagePlan", 3)
+    template.resource_count_is("AWS::ApiGateway::ApiKey", 3)
+    template.has_resource_properties("AWS::ApiGateway::UsagePlan", {
+        "Throttle": {"RateLimit": 100, "BurstLimit": 200}
+    })
+    template.has_resource_properties("AWS::ApiGateway::UsagePlan", {
+        "Throttle": {"RateLimit": 20, "BurstLimit": 40}
+    })
+    template.has_resource_properties("AWS::ApiGateway::UsagePlan", {
+        "Throttle": assertions.Match.absent(),
+        "Quota": {"Limit": 100000, "Period": "DAY"}
+    })
+    # Onboarding doesn't grow any Lambda environment with the bucket list
+    for function in template.find_resources("AWS::Lambda::Function").values():
+        variables = function["Properties"].get("Environment", {}).get("Variables", {})
+        assert "INPUT_BUCKET_NAME" not in variables and "KEY_LAYOUT_MAP" not in variables
+
+    [param] = template.find_resources("AWS::SSM::Parameter").values()
+    assert param["Properties"]["Tier"] == "Standard"
+    bucketMap = json.dumps(param["Properties"]["Value"])
+    assert '\\"datacenter\\": \\"reno\\"' in bucketMap
+    assert '\\"keyLayout\\": \\"flat\\"' in bucketMap
+
+
+def test_large_datacenter_map_uses_advanced_parameter():
+    app = core.App(context={"tripoli:datacenters": {f"site-{n:02d}": {} for n in range(20)}})
+    stack = TripoliStack(app, "tripoli")
+    template = assertions.Template.from_stack(stack)
+
+    template.resource_count_is("AWS::ApiGateway::UsagePlan", 20)
+    template.has_resource_properties("AWS::SSM::Parameter", {"Tier": "Advanced"})
+
+
+def test_datacenter_config_rejected_at_synth():
+    for config in [
+        {},
+        {"Valdez": {}},
+        {"valdez": {"keyLayout": "daily"}},
+        {"valdez": {"throttle": {"rateLimit": 10}}},
+        {"valdez": {"quota": {"limit": 10, "period": "YEAR"}}},
+        {"valdez": {"bucket": "mine"}}
+    ]:
+        app = core.App(context={"tripoli:datacenters": config})
+        with pytest.raises(ValueError):
+            TripoliStack(app, "tripoli")
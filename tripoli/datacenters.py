@@ -0,0 +1,82 @@
+import json
+import os
+import re
+
+# Datacenters are configuration, not code: datacenters.json at the repo root,
+# or whatever the "tripoli:datacenters" context names (an object inline, or a
+# path to another JSON file, relative to the repo root):
+#   cdk deploy -c tripoli:datacenters=config/datacenters-prod.json
+# Per datacenter:
+#   keyLayout   "flat" -> <key> (default), "hourly" -> <dc>/yyyy/mm/dd/hh/<key> (server-side key layout)
+#   region      put the bucket in another region (TripoliStack then needs an explicit env region)
+#   accelerate  S3 Transfer Acceleration, URLs are signed for <bucket>.s3-accelerate.amazonaws.com
+#   throttle    steady-state requests/s and burst for the datacenter's API usage plan
+#   quota       optional request quota per DAY, WEEK or MONTH on the usage plan
+CONTEXT_KEY = "tripoli:datacenters"
+DEFAULT_CONFIG_FILE = "datacenters.json"
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_SETTINGS = {
+    "keyLayout": "flat",
+    "region": None,
+    "accelerate": False,
+    "throttle": {"rateLimit": 100, "burstLimit": 200},
+    "quota": None
+}
+KEY_LAYOUTS = ("hourly", "flat")
+QUOTA_PERIODS = ("DAY", "WEEK", "MONTH")
+# Names end up in S3 key prefixes, construct IDs and the upload index keys
+NAME = re.compile(r"^[a-z0-9][a-z0-9-]{0,31}$")
+
+
+def read_config(scope) -> dict:
+    config = scope.node.try_get_context(CONTEXT_KEY)
+    if config is None:
+        config = DEFAULT_CONFIG_FILE
+    if isinstance(config, str) and config.lstrip().startswith("{"):
+        config = json.loads(config)
+    if isinstance(config, str):
+        with open(os.path.join(REPO_ROOT, config)) as f:
+            config = json.load(f)
+    return config
+
+
+def load_datacenters(scope) -> dict:
+    # name -> settings with the defaults filled in, checked at synth time
+    config = read_config(scope)
+    if not isinstance(config, dict) or not config:
+        raise ValueError(f"{CONTEXT_KEY} must map at least one datacenter name to its settings")
+
+    datacenters = {}
+    for name, settings in config.items():
+        if not NAME.match(name):
+            raise ValueError(f"Datacenter name {name!r} must be lowercase letters, digits and '-' (max 32)")
+        settings = settings or {}
+        unknown = set(settings) - set(DEFAULT_SETTINGS)
+        if unknown:
+            raise ValueError(f"Unknown setting(s) for datacenter {name}: {', '.join(sorted(unknown))}")
+        dc = {**DEFAULT_SETTINGS, **settings}
+
+        if dc["keyLayout"] not in KEY_LAYOUTS:
+            raise ValueError(f"{name}: keyLayout must be one of {', '.join(KEY_LAYOUTS)}")
+        if dc["region"] is not None and not isinstance(dc["region"], str):
+            raise ValueError(f"{name}: region must be a region name or null")
+        if not isinstance(dc["accelerate"], bool):
+            raise ValueError(f"{name}: accelerate must be true or false")
+
+        throttle = dc["throttle"]
+        if throttle is not None:
+            rate, burst = throttle.get("rateLimit"), throttle.get("burstLimit")
+            if set(throttle) - {"rateLimit", "burstLimit"} \
+                    or not isinstance(rate, (int, float)) or isinstance(rate, bool) or rate <= 0 \
+                    or not isinstance(burst, int) or isinstance(burst, bool) or burst < 1:
+                raise ValueError(f"{name}: throttle needs rateLimit > 0 and an integer burstLimit >= 1")
+        quota = dc["quota"]
+        if quota is not None:
+            limit = quota.get("limit")
+            if set(quota) - {"limit", "period"} or quota.get("period") not in QUOTA_PERIODS \
+                    or not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+                raise ValueError(f"{name}: quota needs an integer limit >= 1 and a period of "
+                                 f"{', '.join(QUOTA_PERIODS)}")
+        datacenters[name] = dc
+    return datacenters
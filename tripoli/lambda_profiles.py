@@ -0,0 +1,93 @@
+import json
+
+from aws_cdk import (
+    Duration,
+    Size,
+    aws_lambda as _lambda
+)
+from constructs import Construct
+
+# Performance profile per function. These are the only defaults: cdk.json
+# context (or `cdk synth -c 'tripoli:lambdaProfiles={...}'`) holds just the
+# settings a deployment changes, key by key:
+#   "tripoli:lambdaProfiles": {"presign": {"provisionedConcurrency": 2}}
+CONTEXT_KEY = "tripoli:lambdaProfiles"
+DEFAULT_PROFILES = {
+    "presign": {
+        "memorySize": 512,
+        "architecture": "arm64",
+        "ephemeralStorageMiB": 512,
+        "timeoutSeconds": 30,
+        "reservedConcurrency": None,
+        "provisionedConcurrency": None
+    },
+    "reporter": {
+        "memorySize": 1024,
+        "architecture": "arm64",
+        "ephemeralStorageMiB": 512,
+        "timeoutSeconds": 300,
+        # One run at a time: a schedule firing during a backfill chain waits
+        "reservedConcurrency": 1,
+        "provisionedConcurrency": None
+    }
+}
+ARCHITECTURES = {"arm64": _lambda.Architecture.ARM_64, "x86_64": _lambda.Architecture.X86_64}
+# Provisioned concurrency is attached to this alias, callers invoke it instead of $LATEST
+PROFILE_ALIAS = "live"
+
+# Lambda limits for each setting: (min, max), None = optional
+LIMITS = {
+    "memorySize": (128, 10240),
+    "ephemeralStorageMiB": (512, 10240),
+    "timeoutSeconds": (1, 900),
+    # 0 would throttle every invocation
+    "reservedConcurrency": (1, None),
+    "provisionedConcurrency": (1, None)
+}
+
+
+def lambda_profile(scope: Construct, name: str) -> dict:
+    # Defaults for `name` with the context overrides applied, checked at synth time
+    profiles = scope.node.try_get_context(CONTEXT_KEY) or {}
+    if isinstance(profiles, str):
+        profiles = json.loads(profiles)
+    overrides = profiles.get(name) or {}
+    unknown = set(overrides) - set(DEFAULT_PROFILES[name])
+    if unknown:
+        raise ValueError(f"Unknown {CONTEXT_KEY} setting(s) for {name}: {', '.join(sorted(unknown))}")
+    profile = {**DEFAULT_PROFILES[name], **overrides}
+
+    if profile["architecture"] not in ARCHITECTURES:
+        raise ValueError(f"{name}: architecture must be one of {', '.join(ARCHITECTURES)}")
+    for setting, (low, high) in LIMITS.items():
+        value = profile[setting]
+        if value is None and setting in ("reservedConcurrency", "provisionedConcurrency"):
+            continue
+        if isinstance(value, bool) or not isinstance(value, int) or value < low or (high and value > high):
+            raise ValueError(f"{name}: {setting} must be an integer in [{low}, {high or 'account limit'}], got {value!r}")
+    reserved, provisioned = profile["reservedConcurrency"], profile["provisionedConcurrency"]
+    if provisioned and reserved is not None and provisioned > reserved:
+        raise ValueError(f"{name}: provisionedConcurrency ({provisioned}) exceeds reservedConcurrency ({reserved})")
+    return profile
+
+
+def function_props(profile: dict) -> dict:
+    # Keyword arguments for _lambda.Function
+    return {
+        "memory_size": profile["memorySize"],
+        "architecture": ARCHITECTURES[profile["architecture"]],
+        "ephemeral_storage_size": Size.mebibytes(profile["ephemeralStorageMiB"]),
+        "timeout": Duration.seconds(profile["timeoutSeconds"]),
+        "reserved_concurrent_executions": profile["reservedConcurrency"]
+    }
+
+
+def profile_alias(scope: Construct, function: _lambda.Function, profile: dict) -> _lambda.IFunction:
+    # The function to wire triggers to: an alias with provisioned concurrency
+    # when the profile asks for it, otherwise the function itself
+    if not profile["provisionedConcurrency"]:
+        return function
+    return _lambda.Alias(scope, f"{function.node.id}Alias",
+        alias_name=PROFILE_ALIAS,
+        version=function.current_version,
+        provisioned_concurrent_executions=profile["provisionedConcurrency"])
@@ -0,0 +1,85 @@
+from aws_cdk import (
+    Stack,
+    Duration,
+    RemovalPolicy,
+    aws_s3 as s3,
+    aws_sns as sns,
+    aws_sns_subscriptions as subs,
+    aws_cloudwatch as cloudwatch,
+    aws_cloudwatch_actions as cloudwatch_actions
+)
+from constructs import Construct
+
+# Incomplete multipart uploads are aborted so orphaned parts don't pile up
+ABORT_MULTIPART_DAYS = 7
+
+
+def create_log_bucket(scope: Construct, construct_id: str, metrics_filter_id: str,
+                      accelerate: bool = False) -> s3.Bucket:
+    # Datacenter log bucket with the tiering lifecycle and request metrics
+    lifecycleRule = s3.LifecycleRule(
+        enabled=True,
+        expiration=Duration.days(365*5),
+        abort_incomplete_multipart_upload_after=Duration.days(ABORT_MULTIPART_DAYS),
+        transitions=[
+            s3.Transition(
+                storage_class=s3.StorageClass.INFREQUENT_ACCESS,
+                transition_after=Duration.days(30)),
+            s3.Transition(
+                storage_class=s3.StorageClass.GLACIER_INSTANT_RETRIEVAL,
+                transition_after=Duration.days(90)
+            ),
+            s3.Transition(
+                storage_class=s3.StorageClass.GLACIER,
+                transition_after=Duration.days(180)
+            ),
+            s3.Transition(
+                storage_class=s3.StorageClass.DEEP_ARCHIVE,
+                transition_after=Duration.days(365*2)
+            )]
+    )
+    return s3.Bucket(scope, construct_id,
+        block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+        encryption=s3.BucketEncryption.S3_MANAGED,
+        versioned=False,
+        removal_policy=RemovalPolicy.DESTROY,
+        auto_delete_objects=True,
+        lifecycle_rules=[lifecycleRule],
+        transfer_acceleration=accelerate or None,
+        metrics=[s3.BucketMetrics(id=metrics_filter_id)])
+
+
+class TripoliRegionalBucketStack(Stack):
+    # A datacenter bucket placed in the region nearest to its shippers.
+    # Alarms must live in the region of their metric, so the bucket's
+    # upload-latency alarm and its topic (mailed to alarm_email) are created
+    # here as well.
+
+    def __init__(self, scope: Construct, construct_id: str, dc: str, bucket_id: str, metrics_filter_id: str,
+                 accelerate: bool, latency_alarm_ms: int, alarm_email: str, **kwargs) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+
+        self.bucket = create_log_bucket(self, bucket_id, metrics_filter_id, accelerate)
+
+        # No fixed name: every regional stack has its own topic
+        alarm_topic = sns.Topic(self, "AlarmTopic")
+        alarm_topic.add_subscription(subs.EmailSubscription(alarm_email))
+        self.upload_latency_alarm = cloudwatch.Metric(
+            namespace="AWS/S3",
+            metric_name="TotalRequestLatency",
+            dimensions_map={
+                "BucketName": self.bucket.bucket_name,
+                "FilterId": metrics_filter_id,
+            },
+            statistic="p90",
+            period=Duration.minutes(5),
+        ).create_alarm(
+            self,
+            f"{dc}UploadLatencyHigh",
+            alarm_description=f"p90 S3 request latency of the {dc} log bucket",
+            threshold=latency_alarm_ms,
+            evaluation_periods=3,
+            comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+        )
+        self.upload_latency_alarm.add_alarm_action(cloudwatch_actions.SnsAction(alarm_topic))
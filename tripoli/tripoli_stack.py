@@ -1,11 +1,15 @@
 import json
 from aws_cdk import (
     Stack,
+    Environment,
+    Token,
     Duration,
     CfnOutput,
     RemovalPolicy,
     aws_logs as logs,
     aws_s3 as s3,
+    aws_s3_notifications as s3n,
+    aws_dynamodb as dynamodb,
     aws_lambda as _lambda,
     aws_apigateway as apigw,
     aws_ssm as ssm,
@@ -14,101 +18,154 @@ from aws_cdk import (
     aws_sns_subscriptions as subs,
     aws_events as events,
     aws_events_targets as targets,
+    aws_sqs as sqs,
+    aws_lambda_event_sources as lambda_event_sources,
     aws_cloudwatch as cloudwatch,
     aws_cloudwatch_actions as cloudwatch_actions
 )
 from constructs import Construct
 
+from tripoli.log_buckets import create_log_bucket, TripoliRegionalBucketStack
+from tripoli.lambda_profiles import lambda_profile, function_props, profile_alias
+from tripoli.datacenters import load_datacenters
+
 REPORTSUB = "Brian_Frodelius@student.uml.edu"
 TRIPOLI = "Tripoli"
-DATACENTERS = ["valdez", "vegas"]
+# Datacenters (key layout, region, acceleration, API throttling) are read from
+# datacenters.json or the "tripoli:datacenters" context, see tripoli/datacenters.py
+# SSM parameter holding the API key -> bucket/datacenter map
+BUCKET_MAP_PARAM = "/tripoli/buckets"
+# A standard SSM parameter holds 4 KB, about this many map entries
+SSM_STANDARD_TIER_DATACENTERS = 16
+# CloudWatch namespace for the Lambdas' embedded metric format (EMF) records
+METRICS_NAMESPACE = "Tripoli"
+# S3 request metrics filter covering each whole log bucket (1-minute metrics)
+REQUEST_METRICS_FILTER_ID = "EntireBucket"
+# Per-DC alarm: p90 S3 TotalRequestLatency above this for 15 minutes
+UPLOAD_LATENCY_ALARM_MS = 5000
 
 class TripoliStack(Stack):
 
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
+        datacenters = load_datacenters(scope)
+        # Buckets in other regions are referenced across regions
+        if any(settings["region"] for settings in datacenters.values()):
+            kwargs.setdefault("cross_region_references", True)
         super().__init__(scope, construct_id, **kwargs)
 
         logBucketMap = {}
         logBuckets = {}
-        
-        # Create s3 buckets and lifecycle rules
-        for dc in DATACENTERS:
-            lifecycleRule = s3.LifecycleRule(
-                enabled=True,
-                expiration=Duration.days(365*5),
-                transitions=[
-                    s3.Transition(
-                        storage_class=s3.StorageClass.INFREQUENT_ACCESS,
-                        transition_after=Duration.days(30)),
-                    s3.Transition(
-                        storage_class=s3.StorageClass.GLACIER_INSTANT_RETRIEVAL,
-                        transition_after=Duration.days(90)
-                    ),
-                    s3.Transition(
-                        storage_class=s3.StorageClass.GLACIER,
-                        transition_after=Duration.days(180)
-                    ),
-                    s3.Transition(
-                        storage_class=s3.StorageClass.DEEP_ARCHIVE,
-                        transition_after=Duration.days(365*2)
-                    )]
-            )
+        logBucketRegions = {}
+        regionalStacks = {}
+
+        # Create s3 buckets and lifecycle rules (tripoli/log_buckets.py).
+        # A datacenter with its own region gets its bucket from a sibling stack
+        # deployed there; the rest live in this stack.
+        for dc, upload in datacenters.items():
             CDK_logBucketName = f"{TRIPOLI}-{dc}logBucket"
-            logBucket = s3.Bucket(self, CDK_logBucketName,
-                block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
-                encryption=s3.BucketEncryption.S3_MANAGED,
-                versioned=False,
-                removal_policy=RemovalPolicy.DESTROY,
-                auto_delete_objects=True,
-                lifecycle_rules=[lifecycleRule])
+            if upload["region"] and upload["region"] != self.region:
+                if Token.is_unresolved(self.region):
+                    raise ValueError(f"Datacenter {dc} has its own region, "
+                                     "deploy TripoliStack with an explicit env region")
+                regionalStacks[dc] = TripoliRegionalBucketStack(scope, f"{construct_id}-{dc}",
+                    dc=dc,
+                    bucket_id=CDK_logBucketName,
+                    metrics_filter_id=REQUEST_METRICS_FILTER_ID,
+                    accelerate=upload["accelerate"],
+                    latency_alarm_ms=UPLOAD_LATENCY_ALARM_MS,
+                    alarm_email=REPORTSUB,
+                    env=Environment(account=self.account, region=upload["region"]))
+                logBucket = regionalStacks[dc].bucket
+                logBucketRegions[dc] = upload["region"]
+            else:
+                logBucket = create_log_bucket(self, CDK_logBucketName, REQUEST_METRICS_FILTER_ID,
+                                              upload["accelerate"])
+                logBucketRegions[dc] = self.region
             logBucketMap[dc] = logBucket.bucket_name
             logBuckets[dc] = logBucket
+        # Upload index notifications and compaction only work within one region
+        localDatacenters = [dc for dc in datacenters if dc not in regionalStacks]
 
         # Create Lambda
+        # Memory, architecture, storage, timeout and concurrency come from the
+        # "tripoli:lambdaProfiles" context (tripoli/lambda_profiles.py)
         CDK_lambdaName = f"{TRIPOLI}-Lambda-PresignURL"
+        presignProfile = lambda_profile(self, "presign")
         urlExpirySeconds = 3600
-        lambdaTimeoutSeconds = 30
+        ssmCacheTTLSeconds = 60
+        batchMaxKeys = 1000
         LambdaPresignURL = _lambda.Function(self, CDK_lambdaName,
             runtime=_lambda.Runtime.PYTHON_3_12,
             handler="presign_url.main",
             code=_lambda.Code.from_asset("lambda"),
-            timeout=Duration.seconds(lambdaTimeoutSeconds),
+            **function_props(presignProfile),
             environment={
-                "SSM_logBucketMap_PARAM": "/tripoli/buckets",
-                "URL_EXPIRATION": str(urlExpirySeconds)
+                "SSM_logBucketMap_PARAM": BUCKET_MAP_PARAM,
+                "URL_EXPIRATION": str(urlExpirySeconds),
+                "SSM_CACHE_TTL_SECONDS": str(ssmCacheTTLSeconds),
+                "BATCH_MAX_KEYS": str(batchMaxKeys),
+                "PRESIGN_SIGNER": "stdlib",
+                "METRICS_NAMESPACE": METRICS_NAMESPACE
             })
 
-        # Lambda PUT permission to buckets
-        for dc in DATACENTERS:
+        # Lambda PUT permission to buckets (includes multipart create/complete/abort)
+        for dc in datacenters:
             logBuckets[dc].grant_put(LambdaPresignURL)
 
         # Grant SSM read permission upfront (without specific parameter dependency)
         LambdaPresignURL.add_to_role_policy(iam.PolicyStatement(
             actions=["ssm:GetParameter"],
-            resources=[f"arn:aws:ssm:{self.region}:{self.account}:parameter/tripoli/buckets"]
+            resources=[f"arn:aws:ssm:{self.region}:{self.account}:parameter{BUCKET_MAP_PARAM}"]
         ))
 
         # REST API
         CDK_APIPresignURLName = f"{TRIPOLI}-RestApiGW"
         APIPresignURL = apigw.RestApi(self, CDK_APIPresignURLName)
 
-        # Pass apiKey to Lambda (using proxy integration)
-        LambdaPresignURLIntegration = apigw.LambdaIntegration(LambdaPresignURL, proxy=True)
+        # Pass apiKey to Lambda (using proxy integration). With provisioned
+        # concurrency the API calls the warm alias, so rotation bursts skip cold starts
+        LambdaPresignURLTarget = profile_alias(self, LambdaPresignURL, presignProfile)
+        LambdaPresignURLIntegration = apigw.LambdaIntegration(LambdaPresignURLTarget, proxy=True)
         LambdaPresignURLResource = APIPresignURL.root.add_resource("gen-url")
         LambdaPresignURLResource.add_method("POST", LambdaPresignURLIntegration, api_key_required=True)
 
-        # Add API keys & Usage plans, and build out bucket map
+        # Batch resource: many keys -> many presigned URLs in one call
+        LambdaPresignURLBatchResource = APIPresignURL.root.add_resource("gen-urls")
+        LambdaPresignURLBatchResource.add_method("POST", LambdaPresignURLIntegration, api_key_required=True)
+
+        # Multipart upload resources for large files
+        LambdaMultipartResource = APIPresignURL.root.add_resource("multipart")
+        for action in ["initiate", "sign-parts", "complete", "abort"]:
+            LambdaMultipartResource.add_resource(action).add_method(
+                "POST", LambdaPresignURLIntegration, api_key_required=True)
+
+        # Add API keys & Usage plans (throttled per datacenter), and build out bucket map
         PresignURLapi_key_map = {}
-        for dc in DATACENTERS:
+        for dc, settings in datacenters.items():
             CDK_keyName = f"{TRIPOLI}-{dc}-APIPresignURLKey"
             key = APIPresignURL.add_api_key(CDK_keyName)
             CDK_usagePlanName = f"{TRIPOLI}-{dc}-UsagePlan"
+            throttle = settings["throttle"]
+            quota = settings["quota"]
             usagePlan = APIPresignURL.add_usage_plan(CDK_usagePlanName,
-                api_stages=[apigw.UsagePlanPerApiStage(api=APIPresignURL, stage=APIPresignURL.deployment_stage)])
+                api_stages=[apigw.UsagePlanPerApiStage(api=APIPresignURL, stage=APIPresignURL.deployment_stage)],
+                throttle=apigw.ThrottleSettings(
+                    rate_limit=throttle["rateLimit"],
+                    burst_limit=throttle["burstLimit"]) if throttle else None,
+                quota=apigw.QuotaSettings(
+                    limit=quota["limit"],
+                    period=apigw.Period[quota["period"]]) if quota else None)
             usagePlan.add_api_key(key)
 
-            # Map API key ID to bucket
-            PresignURLapi_key_map[key.key_id] = logBucketMap[dc]
+            # Map API key ID to bucket, datacenter, key layout and upload endpoint.
+            # The reporter and restorer read their bucket list from this map too.
+            PresignURLapi_key_map[key.key_id] = {
+                "bucket": logBucketMap[dc],
+                "datacenter": dc,
+                "keyLayout": settings["keyLayout"],
+                "region": logBucketRegions[dc],
+                "endpoint": "accelerate" if settings["accelerate"] else "regional"
+            }
 
             # Outputs key IDs
             CfnOutput(self, f"{dc}-APIPresignURLKeyID", value=key.key_id)
@@ -116,12 +173,163 @@ class TripoliStack(Stack):
         # Create SSM SP with API key to bucket mapping
         CDK_ssmName = f"{TRIPOLI}-logBucketMapSP"
         logBucketMapSSM = ssm.StringParameter(self, CDK_ssmName,
-            parameter_name="/tripoli/buckets",
-            string_value=json.dumps(PresignURLapi_key_map))
+            parameter_name=BUCKET_MAP_PARAM,
+            string_value=json.dumps(PresignURLapi_key_map),
+            tier=ssm.ParameterTier.ADVANCED if len(datacenters) > SSM_STANDARD_TIER_DATACENTERS
+                 else ssm.ParameterTier.STANDARD)
 
         # API endpoint
         CfnOutput(self, "APIPresignURLEndpoint", value=APIPresignURL.url)
 
+        # Upload index: S3 ObjectCreated -> indexer lambda -> per-day/per-DC records
+        # lets the reporter read only the days inside its cutoff window
+        indexTTLDays = 30
+        upload_index = dynamodb.Table(self, "UploadIndexTable",
+            partition_key=dynamodb.Attribute(name="pk", type=dynamodb.AttributeType.STRING),
+            sort_key=dynamodb.Attribute(name="sk", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires",
+            removal_policy=RemovalPolicy.DESTROY)
+
+        localBucketDatacenterMap = json.dumps({logBucketMap[dc]: dc for dc in localDatacenters})
+
+        index_lambda = _lambda.Function(
+            self,
+            "IndexerLambda",
+            runtime = _lambda.Runtime.PYTHON_3_12,
+            code = _lambda.Code.from_asset("lambda"),
+            handler = "indexer.lambda_handler",
+            timeout = Duration.seconds(30),
+            environment = {
+                "INDEX_TABLE_NAME" : upload_index.table_name,
+                "BUCKET_DATACENTER_MAP" : localBucketDatacenterMap,
+                "INDEX_TTL_DAYS" : str(indexTTLDays),
+                "CHECKSUM_INDEX" : "true",
+                # same as the log buckets' expiration
+                "CHECKSUM_TTL_DAYS" : str(365*5)
+            }
+        )
+        upload_index.grant_write_data(index_lambda)
+        # HEAD with ChecksumMode=ENABLED for the SHA-256 S3 verified on upload
+        for dc in localDatacenters:
+            logBuckets[dc].grant_read(index_lambda)
+
+        # Presign looks checksums up in the same table to answer "already stored"
+        LambdaPresignURL.add_environment("CHECKSUM_INDEX_TABLE", upload_index.table_name)
+        upload_index.grant_read_data(LambdaPresignURL)
+
+        for dc in localDatacenters:
+            logBuckets[dc].add_event_notification(
+                s3.EventType.OBJECT_CREATED,
+                s3n.LambdaDestination(index_lambda))
+
+        # Hourly compaction of small uploads into gzip bundles + index sidecars
+        # runs 48h behind so daily reports still see the original objects.
+        # An hour of tiny files is thousands of GETs: 16 run at once, memory
+        # holds 2 bodies per GET worker plus one 8 MB bundle part, and hours cut
+        # short by the timeout are left pending for the next run
+        compactGetWorkers = 16
+        compact_lambda = _lambda.Function(
+            self,
+            "CompactorLambda",
+            runtime = _lambda.Runtime.PYTHON_3_12,
+            code = _lambda.Code.from_asset("lambda"),
+            handler = "compactor.lambda_handler",
+            memory_size = 1024,
+            timeout = Duration.minutes(15),
+            environment = {
+                "INDEX_TABLE_NAME" : upload_index.table_name,
+                "BUCKET_DATACENTER_MAP" : localBucketDatacenterMap,
+                "INDEX_TTL_DAYS" : str(indexTTLDays),
+                "COMPACT_DELAY_HOURS" : "48",
+                "COMPACT_MAX_OBJECT_BYTES" : str(1024 * 1024),
+                "COMPACT_MIN_OBJECTS" : "2",
+                "COMPACT_MAX_BUNDLE_BYTES" : str(256 * 1024 * 1024),
+                "COMPACT_GET_WORKERS" : str(compactGetWorkers),
+                "COMPACT_TIME_MARGIN_SECONDS" : "60",
+                "COMPACT_MAX_ATTEMPTS" : "5"
+            }
+        )
+        upload_index.grant_read_write_data(compact_lambda)
+        for dc in localDatacenters:
+            logBuckets[dc].grant_read_write(compact_lambda)
+            logBuckets[dc].grant_delete(compact_lambda)
+
+        compact_schedule = events.Rule(
+            self,
+            "CompactSchedule",
+            schedule = events.Schedule.cron(minute = "15")
+        )
+        compact_schedule.add_target(targets.LambdaFunction(compact_lambda))
+
+        # Content index: ObjectCreated (EventBridge) -> SQS -> content indexer, which
+        # streams each new object and writes its time range, line count and term
+        # bloom filter as per-batch part files; a 10-minute schedule merges them
+        # into the per-hour index files read by `python -m tripoli_query`
+        content_index_bucket = s3.Bucket(self, "ContentIndexBucket",
+            block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+            encryption=s3.BucketEncryption.S3_MANAGED,
+            versioned=False,
+            removal_policy=RemovalPolicy.DESTROY,
+            auto_delete_objects=True,
+            lifecycle_rules=[s3.LifecycleRule(enabled=True, expiration=Duration.days(365*5))])
+
+        # SQS wants the visibility timeout at 6x the function timeout
+        contentIndexTimeoutMinutes = 5
+        content_index_dlq = sqs.Queue(self, "ContentIndexDLQ", retention_period=Duration.days(14))
+        content_index_queue = sqs.Queue(self, "ContentIndexQueue",
+            visibility_timeout=Duration.minutes(6 * contentIndexTimeoutMinutes),
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=3, queue=content_index_dlq))
+
+        content_index_lambda = _lambda.Function(
+            self,
+            "ContentIndexerLambda",
+            runtime = _lambda.Runtime.PYTHON_3_12,
+            code = _lambda.Code.from_asset("lambda"),
+            handler = "content_indexer.lambda_handler",
+            timeout = Duration.minutes(contentIndexTimeoutMinutes),
+            memory_size = 1024,
+            environment = {
+                "CONTENT_INDEX_BUCKET" : content_index_bucket.bucket_name,
+                "BUCKET_DATACENTER_MAP" : localBucketDatacenterMap,
+                "CONTENT_INDEX_BLOOM_FP_RATE" : "0.01",
+                "CONTENT_INDEX_MAX_TERMS" : "1000000",
+                "CONTENT_INDEX_MAX_SPAN_HOURS" : "48",
+                "CONTENT_INDEX_MERGE_MAX_PARTS" : "10000"
+            }
+        )
+        content_index_lambda.add_event_source(lambda_event_sources.SqsEventSource(content_index_queue,
+            batch_size = 50,
+            max_batching_window = Duration.seconds(30),
+            report_batch_item_failures = True))
+        content_index_bucket.grant_read_write(content_index_lambda)
+        content_index_merge = events.Rule(
+            self,
+            "ContentIndexMergeSchedule",
+            schedule = events.Schedule.rate(Duration.minutes(10))
+        )
+        content_index_merge.add_target(targets.LambdaFunction(content_index_lambda,
+            event = events.RuleTargetInput.from_object({"merge" : True})))
+
+        if localDatacenters:
+            for dc in localDatacenters:
+                logBuckets[dc].enable_event_bridge_notification()
+                logBuckets[dc].grant_read(content_index_lambda)
+            events.Rule(
+                self,
+                "ContentIndexRule",
+                event_pattern = events.EventPattern(
+                    source = ["aws.s3"],
+                    detail_type = ["Object Created"],
+                    detail = {
+                        "bucket" : {"name" : [logBucketMap[dc] for dc in localDatacenters]},
+                        "object" : {"key" : [{"anything-but" : {"prefix" : "_bundles/"}}]}
+                    }
+                ),
+                targets = [targets.SqsQueue(content_index_queue)]
+            )
+        CfnOutput(self, "ContentIndexBucketName", value=content_index_bucket.bucket_name)
+
         # bucket for reports
         lifecycleRule = s3.LifecycleRule(
             enabled=True,
@@ -143,28 +351,54 @@ class TripoliStack(Stack):
         # lambda for making the report
         # cutoff is for what files in the last hours should be reported
         # expiration is how long the URL will last in seconds
+        reportProfile = lambda_profile(self, "reporter")
+        reportTimeoutSeconds = reportProfile["timeoutSeconds"]
         report_lambda = _lambda.Function(
             self,
             "ReporterLambda",
             runtime = _lambda.Runtime.PYTHON_3_12,
             code = _lambda.Code.from_asset("lambda"),
             handler = "reporter.lambda_handler",
-            timeout = Duration.seconds(30),
+            **function_props(reportProfile),
             environment = {
-                "INPUT_BUCKET_NAME" : ",".join([logBuckets[dc].bucket_name for dc in DATACENTERS]),
+                "SSM_logBucketMap_PARAM" : BUCKET_MAP_PARAM,
                 "OUTPUT_BUCKET_NAME" : report_bucket.bucket_name,
                 "REPORTER_SNS_ARN" : report_message.topic_arn,
+                "INDEX_TABLE_NAME" : upload_index.table_name,
+                "KEY_LAYOUT_SLACK_SECONDS" : str(urlExpirySeconds),
                 "CUTOFF_HOUR" : "24",
-                "REPORT_URL_EXPIRATION_SECONDS" : "86400"
+                "REPORT_URL_EXPIRATION_SECONDS" : "86400",
+                # "csv" (one file) or "jsonl" (gzip JSON lines partitioned by datacenter and hour)
+                "REPORT_FORMAT" : "csv",
+                "REPORT_MAX_OPEN_PARTITIONS" : "512",
+                "REPORT_SUMMARY_TOP_FILES" : "5",
+                "CHECKPOINT_KEY" : "state/reporter-checkpoint.json",
+                "BACKFILL_MAX_WINDOW_HOURS" : "24",
+                "SETTLE_SECONDS" : "300",
+                "LIST_WORKERS" : "8",
+                "METRICS_NAMESPACE" : METRICS_NAMESPACE
             }
         )
 
-        for dc in DATACENTERS:
+        report_target = profile_alias(self, report_lambda, reportProfile)
+
+        # Backfill: the reporter re-invokes itself (through the ARN it was
+        # invoked with, so possibly the alias) until it has caught up.
+        # Separate policy so the function doesn't depend on its own ARN.
+        iam.Policy(self, "ReporterSelfInvokePolicy",
+            roles=[report_lambda.role],
+            statements=[iam.PolicyStatement(
+                actions=["lambda:InvokeFunction"],
+                resources=[report_lambda.function_arn, f"{report_lambda.function_arn}:*"])])
+
+        for dc in datacenters:
             logBuckets[dc].grant_read(report_lambda)
             
+        upload_index.grant_read_data(report_lambda)
         report_bucket.grant_put(report_lambda)
         report_bucket.grant_read(report_lambda)
         report_message.grant_publish(report_lambda)
+        logBucketMapSSM.grant_read(report_lambda)
 
         # event bridge trigger for reporter lambda
         # In UTC time, every day, at 11 am
@@ -180,11 +414,101 @@ class TripoliStack(Stack):
             )
         )
 
-        report_schedule.add_target(targets.LambdaFunction(report_lambda))
+        report_schedule.add_target(targets.LambdaFunction(report_target))
+
+        # Bulk restores of archived logs (lambda/restorer.py): the start function
+        # queues a job's archived objects, the submitter drains the queue at a
+        # bounded rate, restore-completed events (and an hourly poll) track the
+        # objects, and the finished job's URL manifest goes out on ReportSNS
+        restore_table = dynamodb.Table(self, "RestoreTable",
+            partition_key=dynamodb.Attribute(name="pk", type=dynamodb.AttributeType.STRING),
+            sort_key=dynamodb.Attribute(name="sk", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires",
+            removal_policy=RemovalPolicy.DESTROY)
+        restore_table.add_global_secondary_index(index_name="ObjectIndex",
+            partition_key=dynamodb.Attribute(name="object", type=dynamodb.AttributeType.STRING),
+            projection_type=dynamodb.ProjectionType.KEYS_ONLY)
+        restore_table.add_global_secondary_index(index_name="OpenJobs",
+            partition_key=dynamodb.Attribute(name="open", type=dynamodb.AttributeType.STRING),
+            projection_type=dynamodb.ProjectionType.KEYS_ONLY)
+
+        restoreSubmitTimeoutMinutes = 5
+        restore_dlq = sqs.Queue(self, "RestoreDLQ", retention_period=Duration.days(14))
+        restore_queue = sqs.Queue(self, "RestoreQueue",
+            visibility_timeout=Duration.minutes(6 * restoreSubmitTimeoutMinutes),
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=5, queue=restore_dlq))
+
+        # Restore throughput: RESTORE_REQUESTS_PER_SECOND per submitter, at most
+        # restoreConcurrency submitters (20 requests/s, 72k objects an hour)
+        restoreConcurrency = 2
+        restoreEnvironment = {
+            "RESTORE_TABLE_NAME" : restore_table.table_name,
+            "RESTORE_QUEUE_URL" : restore_queue.queue_url,
+            "OUTPUT_BUCKET_NAME" : report_bucket.bucket_name,
+            "REPORTER_SNS_ARN" : report_message.topic_arn,
+            "SSM_logBucketMap_PARAM" : BUCKET_MAP_PARAM,
+            "LIST_WORKERS" : "8",
+            "RESTORE_MAX_OBJECTS" : "100000",
+            "RESTORE_OBJECTS_PER_MESSAGE" : "25",
+            "RESTORE_REQUESTS_PER_SECOND" : "10",
+            "RESTORE_POLL_TIME_MARGIN_SECONDS" : "20",
+            "RESTORE_URL_EXPIRATION_SECONDS" : "86400"
+        }
+
+        def restore_function(construct_id: str, handler: str, timeout: Duration) -> _lambda.Function:
+            function = _lambda.Function(
+                self,
+                construct_id,
+                runtime = _lambda.Runtime.PYTHON_3_12,
+                code = _lambda.Code.from_asset("lambda"),
+                handler = handler,
+                timeout = timeout,
+                environment = restoreEnvironment
+            )
+            restore_table.grant_read_write_data(function)
+            report_bucket.grant_read_write(function)
+            report_message.grant_publish(function)
+            logBucketMapSSM.grant_read(function)
+            for dc in datacenters:
+                logBuckets[dc].grant_read(function)
+            return function
+
+        restore_start_lambda = restore_function("RestoreStartLambda", "restorer.start_handler", Duration.minutes(5))
+        restore_queue.grant_send_messages(restore_start_lambda)
+
+        restore_submit_lambda = restore_function("RestoreSubmitLambda", "restorer.submit_handler",
+                                                 Duration.minutes(restoreSubmitTimeoutMinutes))
+        restore_submit_lambda.add_to_role_policy(iam.PolicyStatement(
+            actions=["s3:RestoreObject"],
+            resources=[logBuckets[dc].arn_for_objects("*") for dc in datacenters]))
+        restore_submit_lambda.add_event_source(lambda_event_sources.SqsEventSource(restore_queue,
+            batch_size = 4,
+            max_concurrency = restoreConcurrency,
+            report_batch_item_failures = True))
+
+        restore_track_lambda = restore_function("RestoreTrackLambda", "restorer.track_handler", Duration.minutes(5))
+        if localDatacenters:
+            events.Rule(
+                self,
+                "RestoreCompletedRule",
+                event_pattern = events.EventPattern(
+                    source = ["aws.s3"],
+                    detail_type = ["Object Restore Completed"],
+                    detail = {"bucket" : {"name" : [logBucketMap[dc] for dc in localDatacenters]}}
+                ),
+                targets = [targets.LambdaFunction(restore_track_lambda)]
+            )
+        events.Rule(
+            self,
+            "RestorePollSchedule",
+            schedule = events.Schedule.rate(Duration.hours(1)),
+            targets = [targets.LambdaFunction(restore_track_lambda)]
+        )
+        CfnOutput(self, "RestoreStartFunctionName", value=restore_start_lambda.function_name)
 
         ingestion_lambda_name = LambdaPresignURL.function_name
         report_lambda_name = report_lambda.function_name
-        raw_bucket_name = logBucketMap[DATACENTERS[0]]
 
         dashboard = cloudwatch.Dashboard(
             self,
@@ -205,7 +529,9 @@ class TripoliStack(Stack):
 
         def s3_metric(bucket_name: str, metric_name: str,
                       storage_type: str,
-                      period_hours: int = 1) -> cloudwatch.Metric:
+                      period_hours: int = 1,
+                      label: str = None,
+                      region: str = None) -> cloudwatch.Metric:
             return cloudwatch.Metric(
                 namespace="AWS/S3",
                 metric_name=metric_name,
@@ -215,6 +541,27 @@ class TripoliStack(Stack):
                 },
                 statistic="Average",
                 period=Duration.hours(period_hours),
+                label=label,
+                region=region,
+            )
+
+        # S3 request metrics: near real time, unlike the daily storage metrics
+        def s3_request_metric(bucket_name: str, metric_name: str,
+                              statistic: str = "Sum",
+                              period_minutes: int = 5,
+                              label: str = None,
+                              region: str = None) -> cloudwatch.Metric:
+            return cloudwatch.Metric(
+                namespace="AWS/S3",
+                metric_name=metric_name,
+                dimensions_map={
+                    "BucketName": bucket_name,
+                    "FilterId": REQUEST_METRICS_FILTER_ID,
+                },
+                statistic=statistic,
+                period=Duration.minutes(period_minutes),
+                label=label or f"{metric_name} {statistic}",
+                region=region,
             )
 
         # Ingestion Lambda metrics + Success Ratio
@@ -252,6 +599,7 @@ class TripoliStack(Stack):
             "AlarmTopic",
             topic_name="tripolis-alarm",
         )
+        alarm_topic.add_subscription(subs.EmailSubscription(REPORTSUB))
 
         # Attach SNS action to the ratio alarm
         ratio_alarm.add_alarm_action(
@@ -259,29 +607,55 @@ class TripoliStack(Stack):
         )
 
 
-        # Overall ingestion: how many files + total size
-        raw_total_objects = s3_metric(
-            raw_bucket_name, "NumberOfObjects", "AllStorageTypes"
-        )
-        raw_total_size = s3_metric(
-            raw_bucket_name, "BucketSizeBytes", "StandardStorage"
-        )
-
-        raw_standard_objects = s3_metric(
-            raw_bucket_name, "NumberOfObjects", "StandardStorage"
-        )
-        raw_ia_objects = s3_metric(
-            raw_bucket_name, "NumberOfObjects", "StandardIAStorage"
-        )
-        raw_glacier_ir_objects = s3_metric(
-            raw_bucket_name, "NumberOfObjects", "GlacierInstantRetrievalStorage"
-        )
-        raw_glacier_objects = s3_metric(
-            raw_bucket_name, "NumberOfObjects", "GlacierStorage"
-        )
-        raw_deep_archive_objects = s3_metric(
-            raw_bucket_name, "NumberOfObjects", "DeepArchiveStorage"
-        )
+        # S3 metrics of a bucket in another region are read from that region
+        metricRegions = {dc: logBucketRegions[dc] if dc in regionalStacks else None for dc in datacenters}
+
+        # Overall ingestion: how many files + total size, per datacenter bucket
+        raw_total_objects = [
+            s3_metric(logBucketMap[dc], "NumberOfObjects", "AllStorageTypes", label=dc,
+                      region=metricRegions[dc])
+            for dc in datacenters
+        ]
+        raw_total_size = [
+            s3_metric(logBucketMap[dc], "BucketSizeBytes", "StandardStorage", label=f"{dc} size",
+                      region=metricRegions[dc])
+            for dc in datacenters
+        ]
+
+        storage_types = {
+            "Standard": "StandardStorage",
+            "IA": "StandardIAStorage",
+            "Glacier IR": "GlacierInstantRetrievalStorage",
+            "Glacier": "GlacierStorage",
+            "Deep Archive": "DeepArchiveStorage",
+        }
+        raw_storage_class_objects = {
+            dc: [
+                s3_metric(logBucketMap[dc], "NumberOfObjects", storage_type, label=name,
+                          region=metricRegions[dc])
+                for name, storage_type in storage_types.items()
+            ]
+            for dc in datacenters
+        }
+
+        # Per-datacenter ingestion performance from the request metrics.
+        # Alarms must be in their metric's region, regional stacks own theirs.
+        upload_latency_alarms = {dc: regionalStacks[dc].upload_latency_alarm for dc in regionalStacks}
+        for dc in localDatacenters:
+            upload_latency_alarms[dc] = s3_request_metric(
+                logBucketMap[dc], "TotalRequestLatency", "p90"
+            ).create_alarm(
+                self,
+                f"{TRIPOLI}-{dc}UploadLatencyHigh",
+                alarm_description=f"p90 S3 request latency of the {dc} log bucket",
+                threshold=UPLOAD_LATENCY_ALARM_MS,
+                evaluation_periods=3,
+                comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+                treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+            )
+            upload_latency_alarms[dc].add_alarm_action(
+                cloudwatch_actions.SnsAction(alarm_topic)
+            )
 
         # Report Lambda metrics
         report_duration = lambda_metric(
@@ -291,6 +665,51 @@ class TripoliStack(Stack):
             report_lambda_name, "Errors"
         )
 
+        # EMF metrics written by the Lambdas themselves (lambda/emf.py)
+        def emf_metric(function_name: str, metric_name: str,
+                       statistic: str = "Sum",
+                       period_minutes: int = 5,
+                       datacenter: str = None) -> cloudwatch.Metric:
+            dimensions = {"FunctionName": function_name}
+            if datacenter:
+                dimensions["Datacenter"] = datacenter
+            return cloudwatch.Metric(
+                namespace=METRICS_NAMESPACE,
+                metric_name=metric_name,
+                dimensions_map=dimensions,
+                statistic=statistic,
+                period=Duration.minutes(period_minutes),
+                label=f"{metric_name} {datacenter or statistic}",
+            )
+
+        presign_stages = ["MapLoadTime", "SignTime", "RequestTime"]
+        presign_p50 = [emf_metric(ingestion_lambda_name, stage, "p50") for stage in presign_stages]
+        presign_p99 = [emf_metric(ingestion_lambda_name, stage, "p99") for stage in presign_stages]
+        presign_cold_starts = emf_metric(ingestion_lambda_name, "ColdStart")
+        presign_requests_by_dc = [
+            emf_metric(ingestion_lambda_name, "Requests", datacenter=dc) for dc in datacenters
+        ]
+
+        # The reporter runs once a day (plus backfills), so look at daily periods
+        report_stages = ["ScanTime", "CsvWriteTime", "UploadTime", "TotalTime"]
+        report_p50 = [emf_metric(report_lambda_name, stage, "p50", 60 * 24) for stage in report_stages]
+        report_p99 = [emf_metric(report_lambda_name, stage, "p99", 60 * 24) for stage in report_stages]
+        report_scanned = emf_metric(report_lambda_name, "ObjectsScanned", period_minutes=60 * 24)
+        report_reported = emf_metric(report_lambda_name, "ObjectsReported", period_minutes=60 * 24)
+        report_pages = emf_metric(report_lambda_name, "ListPages", period_minutes=60 * 24)
+
+        # Alarm before the reporter's scan runs into its timeout (80% of it)
+        report_scan_alarm = emf_metric(
+            report_lambda_name, "ScanTime", "Maximum", 60
+        ).create_alarm(
+            self,
+            "ReporterScanTimeNearTimeout",
+            threshold=reportTimeoutSeconds * 1000 * 0.8,
+            evaluation_periods=1,
+            comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_OR_EQUAL_TO_THRESHOLD,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+        )
+
         # SNS metrics (email delivery for daily report)
         sns_notifications_delivered = cloudwatch.Metric(
             namespace="AWS/SNS",
@@ -339,9 +758,9 @@ class TripoliStack(Stack):
         # Row 2: S3 backups (overall files + size)
         dashboard.add_widgets(
             cloudwatch.GraphWidget(
-                title="Raw Backup Bucket: Files & Size",
-                left=[raw_total_objects],
-                right=[raw_total_size],
+                title="Raw Backup Buckets: Files & Size",
+                left=raw_total_objects,
+                right=raw_total_size,
                 width=24,
             ),
         )
@@ -362,17 +781,93 @@ class TripoliStack(Stack):
         )
 
         # Row 4: Storage class distribution (Standard / IA / Glacier IR / Glacier / DA)
-        dashboard.add_widgets(
+        dashboard.add_widgets(*[
             cloudwatch.GraphWidget(
-                title="Raw Bucket Storage Classes (Standard / IA / Glacier / DA)",
-                left=[
-                    raw_standard_objects,
-                    raw_ia_objects,
-                    raw_glacier_ir_objects,
-                    raw_glacier_objects,
-                    raw_deep_archive_objects,
-                ],
+                title=f"{dc} Bucket Storage Classes (Standard / IA / Glacier / DA)",
+                left=raw_storage_class_objects[dc],
                 view=cloudwatch.GraphWidgetView.PIE,
-                width=24,
+                width=max(24 // len(datacenters), 6),
+            )
+            for dc in datacenters
+        ])
+
+        # One row per datacenter: request metrics (1-minute) + latency alarm
+        for dc in datacenters:
+            bucket_name = logBucketMap[dc]
+            region = metricRegions[dc]
+            dashboard.add_widgets(
+                cloudwatch.GraphWidget(
+                    title=f"{dc}: PUT Requests & Bytes Uploaded",
+                    left=[s3_request_metric(bucket_name, "PutRequests", period_minutes=1, region=region)],
+                    right=[s3_request_metric(bucket_name, "BytesUploaded", period_minutes=1, region=region)],
+                    width=6,
+                ),
+                cloudwatch.GraphWidget(
+                    title=f"{dc}: 4xx / 5xx Errors",
+                    left=[
+                        s3_request_metric(bucket_name, "4xxErrors", period_minutes=1, region=region),
+                        s3_request_metric(bucket_name, "5xxErrors", period_minutes=1, region=region),
+                    ],
+                    width=6,
+                ),
+                cloudwatch.GraphWidget(
+                    title=f"{dc}: First Byte / Total Request Latency p50 / p99 (ms)",
+                    left=[
+                        s3_request_metric(bucket_name, metric, statistic, period_minutes=1, region=region)
+                        for metric in ["FirstByteLatency", "TotalRequestLatency"]
+                        for statistic in ["p50", "p99"]
+                    ],
+                    width=6,
+                ),
+                cloudwatch.AlarmWidget(
+                    title=f"ALARM: {dc} Upload Latency p90 > {UPLOAD_LATENCY_ALARM_MS} ms",
+                    alarm=upload_latency_alarms[dc],
+                    region=region,
+                    width=6,
+                ),
+            )
+
+        report_scan_alarm.add_alarm_action(
+            cloudwatch_actions.SnsAction(alarm_topic)
+        )
+
+        # Row 5: Presign stage latency (EMF) + cold starts / per-DC requests
+        dashboard.add_widgets(
+            cloudwatch.GraphWidget(
+                title="Presign Lambda: Stage Latency p50 (ms)",
+                left=presign_p50,
+                width=8,
+            ),
+            cloudwatch.GraphWidget(
+                title="Presign Lambda: Stage Latency p99 (ms)",
+                left=presign_p99,
+                width=8,
             ),
-        )
\ No newline at end of file
+            cloudwatch.GraphWidget(
+                title="Presign Lambda: Requests per Datacenter & Cold Starts",
+                left=presign_requests_by_dc,
+                right=[presign_cold_starts],
+                width=8,
+            ),
+        )
+
+        # Row 6: Reporter stage timings, scan volume and the timeout alarm
+        dashboard.add_widgets(
+            cloudwatch.GraphWidget(
+                title="Report Lambda: Stage Time p50 / p99 (ms)",
+                left=report_p50,
+                right=report_p99,
+                width=10,
+            ),
+            cloudwatch.GraphWidget(
+                title="Report Lambda: Objects Scanned vs Reported",
+                left=[report_scanned, report_reported],
+                right=[report_pages],
+                width=8,
+            ),
+            cloudwatch.AlarmWidget(
+                title="ALARM: Reporter Scan Time > 80% of Timeout",
+                alarm=report_scan_alarm,
+                width=6,
+            ),
+        )
@@ -0,0 +1,4 @@
+from tripoli_client.api import TripoliApi
+from tripoli_client.http_pool import HttpPool
+from tripoli_client.uploader import Uploader, collect_files
+from tripoli_client.watch import watch
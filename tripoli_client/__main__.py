@@ -0,0 +1,83 @@
+import argparse
+import json
+import os
+import sys
+
+from tripoli_client.api import TripoliApi
+from tripoli_client.http_pool import HttpPool
+from tripoli_client.uploader import MIB, Uploader, collect_files
+from tripoli_client.watch import watch
+
+# Command line entry point:
+#   python -m tripoli_client upload FILE_OR_DIR ... [--prefix host-1/]
+#   python -m tripoli_client watch DIR [--interval 5] [--state uploaded.json]
+# The API endpoint and key come from --endpoint/--api-key or TRIPOLI_ENDPOINT
+# and TRIPOLI_API_KEY.
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog = "tripoli_client", description = "Upload files through the Tripoli API")
+    parser.add_argument("--endpoint", default = os.environ.get("TRIPOLI_ENDPOINT"),
+                        help = "API stage URL, e.g. https://<id>.execute-api.<region>.amazonaws.com/prod")
+    parser.add_argument("--api-key", default = os.environ.get("TRIPOLI_API_KEY"))
+    parser.add_argument("--prefix", default = "", help = "prepended to every key")
+    parser.add_argument("--workers", type = int, default = 8, help = "concurrent PUTs")
+    parser.add_argument("--max-inflight-mb", type = float, default = 256, help = "bytes buffered at once")
+    parser.add_argument("--multipart-threshold-mb", type = float, default = 64)
+    parser.add_argument("--part-size-mb", type = float, default = 16)
+    parser.add_argument("--batch-size", type = int, default = 100, help = "keys per /gen-urls call")
+    parser.add_argument("--retries", type = int, default = 5)
+    parser.add_argument("--checksum", action = "store_true",
+                        help = "send each small file's SHA-256: S3 verifies it and already stored files are skipped")
+    parser.add_argument("--json", action = "store_true", help = "print per-file results and the summary as JSON")
+
+    commands = parser.add_subparsers(dest = "command", required = True)
+    upload = commands.add_parser("upload", help = "upload files and directories once")
+    upload.add_argument("paths", nargs = "+")
+    watcher = commands.add_parser("watch", help = "keep uploading new files from a directory")
+    watcher.add_argument("directory")
+    watcher.add_argument("--interval", type = float, default = 5.0, help = "seconds between scans")
+    watcher.add_argument("--state", help = "file remembering what was uploaded across restarts")
+    watcher.add_argument("--delete-after-upload", action = "store_true")
+
+    args = parser.parse_args(argv)
+    if not args.endpoint or not args.api_key:
+        parser.error("--endpoint and --api-key (or TRIPOLI_ENDPOINT and TRIPOLI_API_KEY) are required")
+    return args
+
+
+def main(argv = None):
+    args = parse_args(argv)
+    pool = HttpPool()
+    uploader = Uploader(
+        TripoliApi(args.endpoint, args.api_key, pool),
+        pool,
+        workers = args.workers,
+        max_inflight_bytes = int(args.max_inflight_mb * MIB),
+        multipart_threshold = int(args.multipart_threshold_mb * MIB),
+        part_size = int(args.part_size_mb * MIB),
+        batch_size = args.batch_size,
+        retries = args.retries,
+        checksums = args.checksum
+    )
+    with uploader:
+        if args.command == "watch":
+            summary = watch(uploader, args.directory, args.prefix, args.interval, args.state,
+                            args.delete_after_upload, log = lambda line: print(line, file = sys.stderr))
+            results = []
+        else:
+            results = uploader.upload(collect_files(args.paths, args.prefix))
+            summary = uploader.stats.summary()
+            for result in results:
+                if "error" in result:
+                    print(f"Failed {result['path']}: {result['error']}", file = sys.stderr)
+
+    if args.json:
+        print(json.dumps({"results": results, "summary": summary}, indent = 2))
+    else:
+        print(uploader.stats.format())
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
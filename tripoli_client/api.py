@@ -0,0 +1,44 @@
+import json
+
+# Thin wrapper over the presign API (see README "Client Requests a Presigned
+# URL"). Every call is a POST with the datacenter's API key.
+
+# Matches the Lambda's default BATCH_MAX_KEYS
+MAX_BATCH_KEYS = 1000
+
+
+class TripoliApi:
+    def __init__(self, endpoint, api_key, pool):
+        self.endpoint = endpoint.rstrip("/")
+        self.api_key = api_key
+        self.pool = pool
+
+    def post(self, resource, payload):
+        resp = self.pool.request(
+            "POST",
+            f"{self.endpoint}/{resource}",
+            body = json.dumps(payload).encode("utf-8"),
+            headers = {"x-api-key": self.api_key, "Content-Type": "application/json"}
+        )
+        return json.loads(resp.body)
+
+    def gen_url(self, key):
+        return self.post("gen-url", {"key": key})
+
+    def gen_urls(self, keys):
+        # keys: key strings or {"key", "checksumSHA256", "size"} entries.
+        # {"bucket", "urls": [{"key", "finalKey", "url", "headers"?}],
+        #  "stored": [{"key", "finalKey", "bucket", "uploaded"}], "errors": [{"key", "error"}]}
+        return self.post("gen-urls", {"keys": keys})
+
+    def multipart_initiate(self, key):
+        return self.post("multipart/initiate", {"key": key})
+
+    def multipart_sign_parts(self, key, upload_id, part_numbers):
+        return self.post("multipart/sign-parts", {"key": key, "uploadId": upload_id, "partNumbers": part_numbers})
+
+    def multipart_complete(self, key, upload_id, parts):
+        return self.post("multipart/complete", {"key": key, "uploadId": upload_id, "parts": parts})
+
+    def multipart_abort(self, key, upload_id):
+        return self.post("multipart/abort", {"key": key, "uploadId": upload_id})
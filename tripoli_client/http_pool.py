@@ -0,0 +1,102 @@
+import http.client
+import threading
+from urllib.parse import urlsplit
+
+# Keep-alive HTTP(S) connections, one per host per thread, so a worker reuses
+# the same TCP/TLS session for every API call and PUT it makes. The pool also
+# tracks every connection it opened, so close() shuts the worker threads'
+# connections too. Standard library only, so the client installs nowhere near boto3.
+
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+class HttpError(Exception):
+    def __init__(self, method, url, status, body):
+        super().__init__(f"{method} {url.split('?')[0]} returned {status}: {body[:200]!r}")
+        self.status = status
+        self.body = body
+        self.retryable = status in RETRYABLE_STATUS
+
+
+class HttpResponse:
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+class HttpPool:
+    def __init__(self, timeout = 60):
+        self.timeout = timeout
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.open_connections = set()
+        self.opened = 0
+        self.requests = 0
+
+    def _connections(self):
+        connections = getattr(self.local, "connections", None)
+        if connections is None:
+            connections = self.local.connections = {}
+        return connections
+
+    def _connect(self, scheme, netloc):
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(netloc, timeout = self.timeout)
+        else:
+            conn = http.client.HTTPConnection(netloc, timeout = self.timeout)
+        with self.lock:
+            self.opened += 1
+            self.open_connections.add(conn)
+        return conn
+
+    def _drop(self, connections, pool_key, conn):
+        conn.close()
+        connections.pop(pool_key, None)
+        with self.lock:
+            self.open_connections.discard(conn)
+
+    def request(self, method, url, body = None, headers = None):
+        parts = urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        connections = self._connections()
+        pool_key = (parts.scheme, parts.netloc)
+
+        # A kept-alive connection may have been closed by the server while idle,
+        # in which case the request is sent once more on a fresh connection
+        for attempt in (1, 2):
+            conn = connections.get(pool_key)
+            reused = conn is not None
+            if conn is None:
+                conn = connections[pool_key] = self._connect(parts.scheme, parts.netloc)
+            try:
+                conn.request(method, path, body = body, headers = headers or {})
+                resp = conn.getresponse()
+                data = resp.read()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self._drop(connections, pool_key, conn)
+                if reused and attempt == 1:
+                    continue
+                raise
+            except Exception:
+                self._drop(connections, pool_key, conn)
+                raise
+
+            with self.lock:
+                self.requests += 1
+            if resp.will_close:
+                self._drop(connections, pool_key, conn)
+            if resp.status >= 300:
+                raise HttpError(method, url, resp.status, data)
+            return HttpResponse(resp.status, {k.lower(): v for k, v in resp.getheaders()}, data)
+
+    def close(self):
+        # Every thread's connections; a thread that uses the pool again
+        # afterwards reconnects on its own
+        with self.lock:
+            connections, self.open_connections = self.open_connections, set()
+        for conn in connections:
+            conn.close()
+        self._connections().clear()
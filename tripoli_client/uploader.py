@@ -0,0 +1,354 @@
+import base64
+import hashlib
+import http.client
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlsplit
+
+from tripoli_client.api import MAX_BATCH_KEYS
+from tripoli_client.http_pool import HttpError
+
+# Concurrent uploader: small files are presigned in /gen-urls batches and PUT
+# by a pool of workers, files over the multipart threshold are split into
+# parts signed by /multipart/sign-parts and PUT by the same workers. Reading
+# a file or part into memory first waits on a byte budget, so at most
+# `max_inflight_bytes` are buffered however many workers there are. A part
+# whose URL expired while it waited, or that S3 refuses with 403, is signed
+# again on its own.
+# With `checksums` on, small files are presigned with their SHA-256: S3 then
+# verifies each PUT, and content the datacenter already stored is skipped.
+
+MIB = 1024 * 1024
+# S3 limits: 5 MiB minimum part size (except the last), 10000 parts per upload
+MIN_PART_SIZE = 5 * MIB
+MAX_PARTS = 10000
+# Read size when hashing files for checksums
+HASH_CHUNK = 1 * MIB
+# A part URL this close to its expiry is signed again before the PUT
+URL_EXPIRY_MARGIN = 60
+
+
+class ByteBudget:
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.peak = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, size):
+        # An item bigger than the whole budget goes through once nothing else is in flight
+        with self.cond:
+            while self.in_flight and self.in_flight + size > self.limit:
+                self.cond.wait()
+            self.in_flight += size
+            self.peak = max(self.peak, self.in_flight)
+
+    def release(self, size):
+        with self.cond:
+            self.in_flight -= size
+            self.cond.notify_all()
+
+
+class UploadStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.files = 0
+        self.failed = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.retries = 0
+        self.api_calls = 0
+        self.latencies = []
+
+    def add(self, field, value = 1):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + value)
+
+    def uploaded(self, size, seconds):
+        with self.lock:
+            self.files += 1
+            self.bytes += size
+            self.latencies.append(seconds)
+
+    def summary(self):
+        with self.lock:
+            elapsed = max(time.monotonic() - self.started, 1e-9)
+            latencies = sorted(self.latencies)
+            pick = lambda pct: latencies[min(len(latencies) - 1, int(pct / 100 * len(latencies)))] if latencies else 0
+            return {
+                "files": self.files,
+                "failed": self.failed,
+                "alreadyStored": self.skipped,
+                "bytes": self.bytes,
+                "seconds": round(elapsed, 3),
+                "mibPerSecond": round(self.bytes / MIB / elapsed, 2),
+                "filesPerSecond": round(self.files / elapsed, 2),
+                "p50Seconds": round(pick(50), 3),
+                "p99Seconds": round(pick(99), 3),
+                "retries": self.retries,
+                "apiCalls": self.api_calls
+            }
+
+    def format(self):
+        s = self.summary()
+        return (f"Uploaded {s['files']} files ({s['bytes'] / MIB:.1f} MiB) in {s['seconds']:.1f} s: "
+                f"{s['mibPerSecond']:.1f} MiB/s, {s['filesPerSecond']:.1f} files/s, "
+                f"p50 {s['p50Seconds']:.3f} s, p99 {s['p99Seconds']:.3f} s per file, "
+                f"{s['apiCalls']} API calls, {s['retries']} retries, {s['failed']} failed"
+                + (f", {s['alreadyStored']} already stored" if s["alreadyStored"] else ""))
+
+
+def retryable(error):
+    if isinstance(error, HttpError):
+        return error.retryable
+    return isinstance(error, (OSError, http.client.HTTPException))
+
+
+def url_expired(url, margin = URL_EXPIRY_MARGIN):
+    # SigV4 query URLs: signed at X-Amz-Date, valid for X-Amz-Expires seconds
+    query = parse_qs(urlsplit(url).query)
+    try:
+        signed = datetime.strptime(query["X-Amz-Date"][0], "%Y%m%dT%H%M%SZ").replace(tzinfo = timezone.utc)
+        expires = int(query["X-Amz-Expires"][0])
+    except (KeyError, ValueError):
+        return False
+    return time.time() + margin >= signed.timestamp() + expires
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return base64.b64encode(digest.digest()).decode("ascii")
+
+
+def collect_files(paths, prefix = ""):
+    # (path, key) pairs: files keep their name, directories their relative layout
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                for name in sorted(names):
+                    full = os.path.join(root, name)
+                    relative = os.path.relpath(full, path).replace(os.sep, "/")
+                    files.append((full, prefix + relative))
+        else:
+            files.append((path, prefix + os.path.basename(path)))
+    return files
+
+
+class Uploader:
+    def __init__(self, api, pool, workers = 8, max_inflight_bytes = 256 * MIB, multipart_threshold = 64 * MIB,
+                 part_size = 16 * MIB, batch_size = 100, retries = 5, backoff = 0.5, max_backoff = 20.0,
+                 checksums = False):
+        self.api = api
+        self.pool = pool
+        self.budget = ByteBudget(max_inflight_bytes)
+        self.multipart_threshold = multipart_threshold
+        self.part_size = part_size
+        self.batch_size = min(batch_size, MAX_BATCH_KEYS)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.checksums = checksums
+        self.stats = UploadStats()
+        self.executor = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = "tripoli-upload")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        self.executor.shutdown(wait = True)
+        self.pool.close()
+
+    def with_retries(self, fn, *args):
+        # Exponential backoff with jitter on throttling, 5xx and connection errors
+        for attempt in range(self.retries + 1):
+            try:
+                return fn(*args)
+            except Exception as e:
+                if attempt == self.retries or not retryable(e):
+                    raise
+                self.stats.add("retries")
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                time.sleep(delay * random.uniform(0.5, 1.0))
+
+    def call_api(self, fn, *args):
+        self.stats.add("api_calls")
+        return self.with_retries(fn, *args)
+
+    def part_size_for(self, size):
+        return max(self.part_size, MIN_PART_SIZE, math.ceil(size / MAX_PARTS))
+
+    def upload(self, files):
+        # files: (path, key) pairs. Returns one result per file, in order, with
+        # "finalKey" and "etag" on success, "finalKey" and "alreadyStored" when
+        # the content was stored before, or "error" on failure.
+        results = [None] * len(files)
+        pending = []
+        small = []
+        large = []
+        for i, (path, key) in enumerate(files):
+            try:
+                size = os.path.getsize(path)
+            except OSError as e:
+                results[i] = self.failed(path, key, e)
+                continue
+            (large if size > self.multipart_threshold else small).append((i, path, key, size))
+
+        for start in range(0, len(small), self.batch_size):
+            batch, entries = self.batch_entries(small[start:start + self.batch_size], results)
+            if not batch:
+                continue
+            try:
+                resp = self.call_api(self.api.gen_urls, entries)
+            except Exception as e:
+                for i, path, key, _ in batch:
+                    results[i] = self.failed(path, key, e)
+                continue
+            urls = {entry["key"]: entry for entry in resp.get("urls", [])}
+            stored = {entry["key"]: entry for entry in resp.get("stored", [])}
+            errors = {entry["key"]: entry["error"] for entry in resp.get("errors", [])}
+            for i, path, key, size in batch:
+                if key in stored:
+                    self.stats.add("skipped")
+                    results[i] = {"path": path, "key": key, "finalKey": stored[key]["finalKey"],
+                                  "alreadyStored": True}
+                    continue
+                if key not in urls:
+                    results[i] = self.failed(path, key, errors.get(key, "No URL returned"))
+                    continue
+                self.budget.acquire(size)
+                pending.append((i, self.executor.submit(self.put_file, path, key, size, urls[key])))
+
+        uploads = []
+        for i, path, key, size in large:
+            try:
+                uploads.append((i, self.start_multipart(path, key, size)))
+            except Exception as e:
+                results[i] = self.failed(path, key, e)
+
+        for i, future in pending:
+            results[i] = future.result()
+        for i, upload in uploads:
+            results[i] = self.finish_multipart(upload)
+        return results
+
+    def batch_entries(self, batch, results):
+        # /gen-urls entries for a batch: plain keys, or with checksums on each
+        # key with its file's SHA-256 and size (hashed on the workers)
+        if not self.checksums:
+            return batch, [key for _, _, key, _ in batch]
+        hashing = [(item, self.executor.submit(file_sha256, item[1])) for item in batch]
+        kept = []
+        entries = []
+        for (i, path, key, size), future in hashing:
+            try:
+                checksum = future.result()
+            except OSError as e:
+                results[i] = self.failed(path, key, e)
+                continue
+            kept.append((i, path, key, size))
+            entries.append({"key": key, "checksumSHA256": checksum, "size": size})
+        return kept, entries
+
+    def failed(self, path, key, error):
+        self.stats.add("failed")
+        return {"path": path, "key": key, "error": str(error)}
+
+    def put_file(self, path, key, size, entry):
+        start = time.monotonic()
+        try:
+            with open(path, "rb") as f:
+                body = f.read()
+            # Checksum headers are signed into the URL and must be sent as given
+            headers = {"Content-Length": str(len(body)), **entry.get("headers", {})}
+            resp = self.with_retries(self.pool.request, "PUT", entry["url"], body, headers)
+        except Exception as e:
+            return self.failed(path, key, e)
+        finally:
+            self.budget.release(size)
+        self.stats.uploaded(len(body), time.monotonic() - start)
+        return {"path": path, "key": key, "finalKey": entry["finalKey"], "etag": resp.headers.get("etag")}
+
+    def put_part(self, upload, number, url, offset, length):
+        try:
+            with open(upload["path"], "rb") as f:
+                f.seek(offset)
+                body = f.read(length)
+            headers = {"Content-Length": str(len(body))}
+            if url_expired(url):
+                url = self.sign_part(upload, number)
+            try:
+                resp = self.with_retries(self.pool.request, "PUT", url, body, headers)
+            except HttpError as e:
+                if e.status != 403:
+                    raise
+                # Expired or no longer accepted signature: sign the part again, once
+                resp = self.with_retries(self.pool.request, "PUT", self.sign_part(upload, number), body, headers)
+        finally:
+            self.budget.release(length)
+        return resp.headers["etag"]
+
+    def sign_part(self, upload, number):
+        signed = self.call_api(self.api.multipart_sign_parts, upload["finalKey"], upload["uploadId"], [number])
+        if signed.get("errors") or not signed.get("urls"):
+            raise RuntimeError(f"Could not sign part {number}: {signed.get('errors')}")
+        return signed["urls"][0]["url"]
+
+    def start_multipart(self, path, key, size):
+        # Initiates the upload and queues every part; finish_multipart completes it
+        part_size = self.part_size_for(size)
+        count = math.ceil(size / part_size)
+        init = self.call_api(self.api.multipart_initiate, key)
+        upload = {"path": path, "key": key, "finalKey": init["key"], "uploadId": init["uploadId"],
+                  "size": size, "parts": [], "started": time.monotonic()}
+        try:
+            for first in range(1, count + 1, MAX_BATCH_KEYS):
+                numbers = list(range(first, min(count, first + MAX_BATCH_KEYS - 1) + 1))
+                signed = self.call_api(self.api.multipart_sign_parts, upload["finalKey"], upload["uploadId"], numbers)
+                if signed.get("errors"):
+                    raise RuntimeError(f"Could not sign parts: {signed['errors']}")
+                for part in signed["urls"]:
+                    offset = (part["partNumber"] - 1) * part_size
+                    length = min(part_size, size - offset)
+                    self.budget.acquire(length)
+                    future = self.executor.submit(self.put_part, upload, part["partNumber"], part["url"],
+                                                  offset, length)
+                    upload["parts"].append((part["partNumber"], length, future))
+        except Exception:
+            self.abort_multipart(upload)
+            raise
+        return upload
+
+    def finish_multipart(self, upload):
+        try:
+            parts = [{"partNumber": number, "etag": future.result()} for number, _, future in upload["parts"]]
+            resp = self.call_api(self.api.multipart_complete, upload["finalKey"], upload["uploadId"], parts)
+        except Exception as e:
+            self.abort_multipart(upload)
+            return self.failed(upload["path"], upload["key"], e)
+        self.stats.uploaded(upload["size"], time.monotonic() - upload["started"])
+        return {"path": upload["path"], "key": upload["key"], "finalKey": upload["finalKey"],
+                "etag": resp.get("etag")}
+
+    def abort_multipart(self, upload):
+        for _, length, future in upload["parts"]:
+            if future.cancel():
+                self.budget.release(length)
+        try:
+            self.call_api(self.api.multipart_abort, upload["finalKey"], upload["uploadId"])
+        except Exception:
+            pass  # the bucket lifecycle rule aborts it after 7 days
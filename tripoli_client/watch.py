@@ -0,0 +1,75 @@
+import json
+import os
+import time
+
+from tripoli_client.uploader import collect_files
+
+# Directory-watch mode: the directory is re-scanned every `interval` seconds
+# and files are uploaded once their size and mtime have held still for one
+# full scan, so files still being written are skipped until they settle.
+# Uploaded files are remembered by (size, mtime) and optionally kept in a state
+# file so a restarted watcher doesn't upload them again.
+
+
+def load_state(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return {name: tuple(value) for name, value in json.load(f).items()}
+
+
+def save_state(path, uploaded):
+    if not path:
+        return
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(uploaded, f)
+    os.replace(tmp, path)
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def ready_files(directory, prefix, uploaded, last_seen):
+    # Files whose signature matches the previous scan and that weren't uploaded as they are now
+    ready = []
+    seen = {}
+    for path, key in collect_files([directory], prefix):
+        try:
+            signature = file_signature(path)
+        except OSError:
+            continue  # rotated away between listing and stat
+        seen[path] = signature
+        if uploaded.get(path) != signature and last_seen.get(path) == signature:
+            ready.append((path, key, signature))
+    return ready, seen
+
+
+def watch(uploader, directory, prefix = "", interval = 5.0, state_path = None, delete_after = False,
+          max_scans = None, log = print):
+    uploaded = load_state(state_path)
+    last_seen = {}
+    scans = 0
+    try:
+        while max_scans is None or scans < max_scans:
+            scans += 1
+            ready, last_seen = ready_files(directory, prefix, uploaded, last_seen)
+            if ready:
+                results = uploader.upload([(path, key) for path, key, _ in ready])
+                for (path, _, signature), result in zip(ready, results):
+                    if "error" in result:
+                        log(f"Failed {path}: {result['error']}")
+                        continue
+                    if delete_after:
+                        os.remove(path)
+                    else:
+                        uploaded[path] = signature
+                save_state(state_path, uploaded)
+                log(uploader.stats.format())
+            if max_scans is None or scans < max_scans:
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    return uploader.stats.summary()
@@ -0,0 +1,77 @@
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda"))
+
+import content_index
+from tripoli_query.query import find_objects, matching_lines, parse_terms
+
+# Command line entry point:
+#   python -m tripoli_query --dc valdez --start 2026-10-18T02:00 --end 2026-10-18T03:00 \
+#       --match host=web-7 [--lines]
+# The content index bucket comes from --index-bucket or TRIPOLI_CONTENT_INDEX_BUCKET
+# (stack output ContentIndexBucketName); AWS credentials from the usual boto3 chain.
+
+
+def parse_time(value):
+    when = datetime.fromisoformat(value)
+    return when.replace(tzinfo = timezone.utc) if when.tzinfo is None else when.astimezone(timezone.utc)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog = "tripoli_query", description = "Find uploaded logs with the content index")
+    parser.add_argument("--index-bucket", default = os.environ.get("TRIPOLI_CONTENT_INDEX_BUCKET"))
+    parser.add_argument("--dc", action = "append", required = True, help = "datacenter, repeatable")
+    parser.add_argument("--start", type = parse_time, required = True, help = "ISO time, UTC unless an offset is given")
+    parser.add_argument("--end", type = parse_time, required = True)
+    parser.add_argument("--match", action = "append", default = [], metavar = "FIELD=VALUE",
+                        help = "term every object must contain, e.g. host=web-7 (repeatable)")
+    parser.add_argument("--fields", help = "JSON field -> regex map, if the indexer's CONTENT_INDEX_FIELDS was changed")
+    parser.add_argument("--lines", action = "store_true", help = "fetch the candidates and print the matching lines")
+    parser.add_argument("--json", action = "store_true", help = "print candidates as JSON lines")
+
+    args = parser.parse_args(argv)
+    if not args.index_bucket:
+        parser.error("--index-bucket (or TRIPOLI_CONTENT_INDEX_BUCKET) is required")
+    if args.end < args.start:
+        parser.error("--end is before --start")
+    try:
+        args.match = parse_terms(args.match)
+    except ValueError as e:
+        parser.error(str(e))
+    return args
+
+
+def main(argv = None):
+    args = parse_args(argv)
+    import boto3
+    from botocore.exceptions import ClientError
+    s3 = boto3.client("s3")
+    fields = content_index.compile_fields(json.loads(args.fields) if args.fields else content_index.DEFAULT_FIELDS)
+
+    stats = {}
+    for entry in find_objects(s3, args.index_bucket, args.dc, args.start, args.end, args.match, stats):
+        if args.lines:
+            try:
+                for line in matching_lines(s3, entry, args.start, args.end, args.match, fields):
+                    print(f"{entry['key']}: {line}")
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+                    raise
+                # Deleted, or compacted into a bundle that is gone too
+                print(f"Not found: s3://{entry['bucket']}/{entry['key']}", file = sys.stderr)
+        elif args.json:
+            print(json.dumps({k : v for k, v in entry.items() if k != "bloom"}))
+        else:
+            print(f"s3://{entry['bucket']}/{entry['key']}  {entry['minTime']} .. {entry['maxTime']}  {entry['lines']} lines")
+
+    print(f"{stats['hourFiles']} hour files, {stats['spansFiles']} spans files, {stats['candidates']} of {stats['indexed']} objects "
+          f"({stats['candidateBytes']} of {stats['indexedBytes']} bytes) left to fetch", file = sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
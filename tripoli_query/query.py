@@ -0,0 +1,147 @@
+import io
+import json
+from datetime import datetime, timedelta
+
+import bundles
+import content_index
+
+# Prunes uploaded logs with the content index before anything is fetched:
+# only the hour files overlapping the window are read, and objects whose
+# time range or bloom filter rules them out are dropped.
+# content_index and bundles are the Lambda modules of the same name; `python -m tripoli_query`
+# puts lambda/ on the path, library callers do it themselves.
+
+
+def parse_terms(values):
+    # "host=web-7" -> ("host", "web-7")
+    terms = []
+    for value in values:
+        field, sep, term_value = value.partition("=")
+        if not sep or not field or not term_value:
+            raise ValueError(f"Expected <field>=<value>, got {value!r}")
+        terms.append((field, term_value))
+    return terms
+
+
+def window_hours(start, end):
+    hour = content_index.floor_hour(start)
+    while hour <= end:
+        yield hour
+        hour += timedelta(hours = 1)
+
+
+def read_index(s3, index_bucket, key):
+    from botocore.exceptions import ClientError
+    try:
+        resp = s3.get_object(Bucket = index_bucket, Key = key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+            return None
+        raise
+    return content_index.decode_index(resp["Body"].read())
+
+
+def list_keys(s3, index_bucket, prefix):
+    pagin = s3.get_paginator("list_objects_v2")
+    for page in pagin.paginate(Bucket = index_bucket, Prefix = prefix):
+        yield from page.get("Contents", [])
+
+
+def read_file(s3, index_bucket, key):
+    # The index file plus the batch parts not merged into it yet. Parts are
+    # read first: the merge writes the file before it deletes the parts, so a
+    # part gone by the time it is fetched is in the file read after it
+    listed = sorted(list_keys(s3, index_bucket, content_index.part_prefix(key)), key = lambda obj: obj["LastModified"])
+    parts = [read_index(s3, index_bucket, obj["Key"]) for obj in listed]
+
+    index = read_index(s3, index_bucket, key)
+    parts = [part for part in parts if part is not None]
+    if index is None and not parts:
+        return None
+    index = index or dict(parts[0], objects = {})
+    for part in parts:
+        index["objects"].update(part["objects"])
+    return index
+
+
+def spans_files(s3, index_bucket, dc, start):
+    # Spans files (and their unmerged parts) of every month from start's on
+    keys = {obj["Key"] for obj in list_keys(s3, index_bucket, content_index.spans_prefix(dc))}
+    keys.update(content_index.part_target(obj["Key"])
+                for obj in list_keys(s3, index_bucket, content_index.PARTS_PREFIX + content_index.spans_prefix(dc)))
+    first = start.replace(day = 1, hour = 0, minute = 0, second = 0, microsecond = 0)
+    return sorted(key for key in keys if content_index.spans_month(key) >= first)
+
+
+def find_objects(s3, index_bucket, datacenters, start, end, terms, stats = None):
+    # Candidate entries, once per object, oldest hour first, then the objects
+    # too long for hour files
+    stats = stats if stats is not None else {}
+    stats.update({"hourFiles" : 0, "spansFiles" : 0, "indexed" : 0, "candidates" : 0, "candidateBytes" : 0,
+                  "indexedBytes" : 0})
+    wanted = [content_index.term(field, value) for field, value in terms]
+    seen = set()
+    for dc in datacenters:
+        files = [("hourFiles", content_index.hour_key(dc, hour)) for hour in window_hours(start, end)]
+        files += [("spansFiles", key) for key in spans_files(s3, index_bucket, dc, start)]
+        for kind, key in files:
+            index = read_file(s3, index_bucket, key)
+            if index is None:
+                continue
+            stats[kind] += 1
+            for object_id, entry in index["objects"].items():
+                if object_id in seen:
+                    continue
+                seen.add(object_id)
+                stats["indexed"] += 1
+                stats["indexedBytes"] += entry.get("size", 0)
+                if content_index.matches(entry, start, end, wanted):
+                    stats["candidates"] += 1
+                    stats["candidateBytes"] += entry.get("size", 0)
+                    yield dict(entry, datacenter = dc)
+
+
+def bundled_body(s3, entry):
+    # The object's member in the bundle of its upload hour, found through the
+    # bundles' sidecars; None when it is in none of them (or was indexed
+    # before entries had an upload time)
+    if "uploaded" not in entry:
+        return None
+    hour = content_index.floor_hour(datetime.fromisoformat(entry["uploaded"]))
+    prefix = f"{bundles.BUNDLE_PREFIX}{entry['datacenter']}/{hour.strftime('%Y/%m/%d/%H')}/"
+    for obj in list_keys(s3, entry["bucket"], prefix):
+        if not obj["Key"].endswith(".index.json"):
+            continue
+        resp = s3.get_object(Bucket = entry["bucket"], Key = obj["Key"])
+        sidecar = json.loads(resp["Body"].read())
+        # The key may have been uploaded again since: only the version that was indexed
+        for member in sidecar["members"]:
+            if member["key"] == entry["key"] and member.get("etag") == entry.get("etag"):
+                return bundles.read_member(s3, entry["bucket"], sidecar["bundle"], member["offset"], member["length"])
+    return None
+
+
+def matching_lines(s3, entry, start, end, terms, fields):
+    # Streams one candidate and yields the lines with every term in the window;
+    # bloom false positives fall out here
+    from botocore.exceptions import ClientError
+    patterns = [(fields[field], value.encode("utf-8")) for field, value in terms if field in fields]
+    try:
+        body = s3.get_object(Bucket = entry["bucket"], Key = entry["key"])["Body"]
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+            raise
+        # Compacted since it was indexed
+        member = bundled_body(s3, entry)
+        if member is None:
+            raise
+        body = io.BytesIO(member)
+    for line in content_index.iter_lines(body):
+        if not all(value in pattern.findall(line) for pattern, value in patterns):
+            continue
+        match = content_index.TIMESTAMP.search(line)
+        if match:
+            when = content_index.parse_timestamp(match.groups())
+            if when < start or when > end:
+                continue
+        yield line.decode("utf-8", "replace")